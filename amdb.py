@@ -0,0 +1,211 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# Non-blocking versions of the read paths of mdb.py on aiomysql, used by asgi.py.
+#
+# The queries are the same ones mdb.py runs and the results end up in the same caches (the table
+# list, the result cache) under the same keys, so the two can be mixed freely. A query waiting
+# for a slow ProxySQL only holds a coroutine, not a thread.
+
+import asyncio
+import logging
+import time
+
+try:
+    import aiomysql
+    import pymysql
+except ImportError:
+    aiomysql = None
+
+import mdb
+
+_pools = {}          # server -> (dsn, settings, aiomysql pool)
+_pools_lock = asyncio.Lock()
+
+
+def _pool_settings():
+    settings = dict(mdb.pool_defaults)
+    settings.update((mdb.get_config().get('global') or {}).get('pool') or {})
+    return settings
+
+
+async def _create_pool(dsn, settings):
+    try:
+        return await aiomysql.create_pool(
+            host=dsn.get('host', 'localhost'), port=int(dsn.get('port', 6032)), user=dsn.get('user'),
+            password=dsn.get('passwd', dsn.get('password', '')), db=dsn.get('db', dsn.get('database')),
+            minsize=0, maxsize=int(settings['size']), pool_recycle=int(settings['max_lifetime']),
+            connect_timeout=3, autocommit=mdb.pool_connect_options['read']['autocommit'])
+    except (TypeError, ValueError) as e:
+        raise mdb.ConfigError(f"Invalid pool settings: {str(e)}")
+
+
+async def get_pool(server):
+    """Returns with the pool of the server and its settings, (re)creating it if its DSN or pool settings changed"""
+    if aiomysql is None:
+        raise mdb.ConfigError("The async mode needs aiomysql, see requirements-async.txt")
+    cnf = mdb.get_config()
+    if server not in cnf['servers']:
+        raise mdb.DatabaseError(f"Server '{server}' not found in configuration")
+    if 'dsn' not in cnf['servers'][server] or not cnf['servers'][server]['dsn']:
+        raise mdb.DatabaseError(f"No DSN configuration found for server '{server}'")
+    dsn = cnf['servers'][server]['dsn'][0]
+    settings = _pool_settings()
+
+    found = _pools.get(server)
+    if found is not None and found[0] == dsn and found[1] == settings:
+        return found[2], settings
+    async with _pools_lock:
+        found = _pools.get(server)
+        if found is None or found[0] != dsn or found[1] != settings:
+            if found is not None:
+                found[2].close()
+            logging.debug("async pool %s: new pool to %s:%s", server, dsn.get('host'), dsn.get('port'))
+            found = _pools[server] = (dict(dsn), settings, await _create_pool(dsn, settings))
+        return found[2], settings
+
+
+async def close_pools():
+    pools = [found[2] for found in _pools.values()]
+    _pools.clear()
+    for pool in pools:
+        pool.close()
+    for pool in pools:
+        await pool.wait_closed()
+
+
+async def _execute(server, queries):
+    """Runs the queries on one pooled connection, returns with [(column_names, rows)] of each"""
+    pool, settings = await get_pool(server)
+    try:
+        conn = await asyncio.wait_for(pool.acquire(), float(settings['checkout_timeout']))
+    except asyncio.TimeoutError:
+        raise mdb.DatabaseError(f"No free connection to {server} within {settings['checkout_timeout']} seconds")
+    except (pymysql.err.MySQLError, OSError) as e:
+        mdb.metric_connect_errors.inc(server)
+        raise mdb.DatabaseError(str(e))
+    failed = True
+    try:
+        results = []
+        async with conn.cursor() as cur:
+            for sql in queries:
+                started = time.perf_counter()
+                try:
+                    await cur.execute(sql)
+                    rows = list(await cur.fetchall())
+                except pymysql.err.MySQLError as e:
+                    mdb.metric_query_errors.inc(server)
+                    raise mdb.DatabaseError(str(e))
+                finally:
+                    mdb.metric_query.observe(server, value=time.perf_counter() - started)
+                mdb.metric_rows.inc(server, amount=len(rows))
+                results.append(([i[0] for i in cur.description] if cur.description else [], rows))
+        failed = False
+        return results
+    finally:
+        # a query cancelled halfway (timeout) leaves the connection in an unknown state
+        if failed:
+            conn.close()
+        pool.release(conn)
+
+
+async def fetch_query(server, sql):
+    """mdb.fetch_query(): returns with (column_names, rows)"""
+    return (await _execute(server, [sql]))[0]
+
+
+async def get_catalog(server, refresh=False):
+    """Reads the database/table list of the server into mdb's shared catalog cache if it's missing or stale"""
+    catalog = mdb.catalog_cache.get(server)
+    if not refresh and catalog is not None and catalog.expires >= time.monotonic():
+        return
+    column_names, rows = await fetch_query(server, mdb.sql_get_databases)
+    databases = [row[column_names.index('name')] for row in rows]
+    tables = {database: [] for database in databases}
+    if databases:
+        try:
+            column_names, rows = await fetch_query(server, mdb.catalog_union_sql(databases))
+        except (mdb.DatabaseError, mdb.ValidationError) as e:
+            logging.debug("catalog union query failed, falling back to show tables: %s", e)
+            rows = []
+            for database in databases:
+                rows.extend((database, row[0]) for row in (await fetch_query(server, mdb.sql_show_tables % database))[1])
+        for database, table in rows:
+            tables[database].append(table)
+    mdb.store_catalog(server, tables)
+
+
+async def get_table_columns(server, database, table):
+    """mdb.get_table_columns(), returns with the cache entry"""
+    key = (server, 'columns', database, table)
+    entry = mdb.result_cache.get(key)
+    if entry is None:
+        sql = mdb.sql_show_table_columns % (mdb.quote_identifier(database), mdb.quote_identifier(table))
+        column_names, rows = await fetch_query(server, sql)
+        ttl = float((mdb.get_config().get('global') or {}).get('catalog_ttl', mdb.catalog_ttl_default))
+        entry = mdb.result_cache.put(key, column_names, ttl)
+    return entry
+
+
+async def get_table_page_cached(server, database, table, **paging):
+    """mdb.get_table_page_cached(): one page of the table through the result cache, returns with the cache entry"""
+    ttl = mdb.cache_ttl(table)
+    key = mdb.table_page_key(server, database, table, paging)
+    entry = mdb.result_cache.get(key) if ttl > 0 else None
+    if entry is None:
+        column_names = (await get_table_columns(server, database, table)).value
+        sql_count, sql_page = mdb.table_page_sql(database, table, column_names, **paging)
+        (_, counted), (_, rows) = await _execute(server, [sql_count, sql_page])
+        total, filtered = counted[0]
+        content = {'column_names': column_names, 'rows': rows,
+                   'records_total': int(total or 0), 'records_filtered': int(filtered or 0)}
+        entry = mdb.result_cache.put(key, mdb.process_table_content(table, content), ttl)
+    return entry
+
+
+async def execute_adhoc_query_cached(server, sql):
+    """mdb.execute_adhoc_query_cached(), returns with the cache entry"""
+    sql = mdb.validate_sql(sql)
+    ttl = float(mdb.cache_settings()['sql_ttl'])
+    key = (server, 'sql', mdb.normalize_sql(sql))
+    entry = mdb.result_cache.get(key) if ttl > 0 else None
+    if entry is None:
+        column_names, rows = await fetch_query(server, sql)
+        entry = mdb.result_cache.put(key, {'column_names': column_names, 'rows': rows}, ttl)
+    return entry
+
+
+async def execute_adhoc_report(server):
+    """mdb.execute_adhoc_report(): the queries run at once, adhoc_concurrency at a time, adhoc_timeout seconds each"""
+    items, concurrency, timeout = mdb.adhoc_settings()
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def run(item):
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                fetched = await asyncio.wait_for(fetch_query(server, item.get('sql', '')), timeout)
+                return mdb.adhoc_result(item, fetched, None, time.monotonic() - started)
+            except asyncio.TimeoutError:
+                error = f"Timed out after {timeout:g} seconds"
+            except Exception as e:
+                error = str(e)
+            return mdb.adhoc_result(item, None, error, time.monotonic() - started)
+
+    return list(await asyncio.gather(*(run(item) for item in items)))
@@ -19,10 +19,26 @@ __license__ = "GPLv3"
 
 import logging
 from collections import defaultdict
-from flask import Flask, render_template, request, session, url_for, flash, redirect
+from flask import Flask, render_template, request, session, url_for, flash, redirect, jsonify, Response, g
+from flask import before_render_template, template_rendered
 from functools import wraps
+import hmac
+import json
 import re
+import time
+import yaml
+from jinja2.utils import htmlsafe_json_dumps
 import mdb
+import metrics
+import sampler
+import digest
+import drift
+import query_rules
+import bulk
+import live
+import sessions
+import compress
+import tracing
 
 app = Flask(__name__)
 
@@ -36,8 +52,77 @@ flask_custom_config = mdb.get_config(config)
 for key in flask_custom_config['flask']:
     app.config[key] = flask_custom_config['flask'][key]
 
+# the session cookie only carries an id, see the sessions: section of the config
+query_history = sessions.install(app)
+# gzip/brotli, see the compression: section of the config
+compress.install(app)
+# per request spans, the slow request log and ?profile=1, see the tracing: section of the config
+tracing.install(app)
+
+logging.getLogger().setLevel(str((flask_custom_config.get('global') or {}).get('log_level', 'INFO')).upper())
+
+# optional background sampler of the stats tables, see the sampler: section of the config
+sampler.start()
+
+metrics_config = flask_custom_config.get('metrics') or {}
+# with several workers the metrics are added up through the files in this directory
+metrics.start(metrics_config.get('dir'))
+
+metric_request = metrics.histogram('proxyweb_request_seconds', 'Request latency per route',
+                                   ['route', 'method', 'status'])
+metric_render = metrics.histogram('proxyweb_render_seconds', 'Template rendering time', ['template'])
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+    if 'request_started' in g:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metric_request.observe(route, request.method, str(response.status_code),
+                               value=time.perf_counter() - g.request_started)
+    return response
+
+
+def _start_render_timer(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+
+def _observe_render(sender, template, context, **extra):
+    if 'render_started' in g:
+        metric_render.observe(template.name or 'string', value=time.perf_counter() - g.render_started)
+        tracing.record('render', g.render_started, template.name)
+
+
+before_render_template.connect(_start_render_timer, app)
+template_rendered.connect(_observe_render, app)
+
+@app.context_processor
+def inject_catalog():
+    # the table list, the config and the query history are shared, the session only keeps where the user is
+    context = {'catalog': mdb.get_catalog, 'bulk_tables': bulk.tables, 'servers': [], 'misc': {},
+               'read_only': False, 'history': []}
+    try:
+        servers = mdb.get_servers()
+        server = session.get('server')
+        context.update(servers=servers, misc=mdb.get_config(config).get('misc') or {},
+                       read_only=server in servers and mdb.get_read_only(server),
+                       history=query_history.recent())
+    except (mdb.ConfigError, mdb.DatabaseError) as e:
+        # a broken config must not take the settings editor and the error page down with it
+        logging.debug("template context without the config: %s", e)
+    return context
+
+
+@app.template_filter('rows_json')
+def rows_json(content):
+    """the column names once and the rows as arrays, the browser builds the table cells from it"""
+    return htmlsafe_json_dumps({'columns': content.get('column_names', []), 'rows': content.get('rows', [])},
+                               dumps=json.dumps, default=str, separators=(',', ':'))
 
-mdb.logging.debug(flask_custom_config)
 
 def login_required(f):
     @wraps(f)
@@ -75,12 +160,8 @@ def logout():
 def render_list_dbs():
     try:
         server = mdb.get_config(config)['global']['default_server']
-        session['history'] = []
         session['server'] = server
-        session['dblist'] = mdb.get_all_dbs_and_tables(db, server)
-        session['servers'] = mdb.get_servers()
-        session['read_only'] = mdb.get_read_only(server)
-        session['misc'] = mdb.get_config(config)['misc']
+        mdb.get_catalog(server, refresh=request.args.get('refresh') == '1')
 
         return render_template("list_dbs.html", server=server)
     except Exception as e:
@@ -91,58 +172,193 @@ def render_list_dbs():
 @login_required
 def render_show_table_content(server, database="main", table="global_variables"):
     try:
-        # refresh the tablelist if changing to a new server
-
-        if server not in session['dblist']:
-            session['dblist'].update(mdb.get_all_dbs_and_tables(db, server))
+        # the table list is cached server side, ?refresh=1 re-reads it
+        mdb.get_catalog(server, refresh=request.args.get('refresh') == '1')
 
-        session['servers'] = mdb.get_servers()
         session['server'] = server
         session['table'] = table
         session['database'] = database
-        session['misc'] = mdb.get_config(config)['misc']
-        session['read_only'] = mdb.get_read_only(server)
-        content = mdb.get_table_content(db, server, database, table)
-        mdb.process_table_content(table,content)
-        return render_template("show_table_info.html", content=content)
+        content = table_page_content(server, database, table)
+        interval = request.args.get('live', 0, type=int)
+        if interval:
+            # the rows come from the event stream instead of the paged data endpoint
+            content['ajax'] = None
+            content['live_interval'] = interval
+            content['live'] = url_for('render_live', server=server, database=database, table=table,
+                                      interval=interval)
+        return render_template("show_table_info.html", content=content,
+                               live_intervals=live.get_settings()['intervals'])
+    except Exception as e:
+        raise ValueError(e)
+
+
+def table_page_content(server, database, table):
+    """content for show_table_info.html where the rows are fetched page by page by DataTables"""
+    return {
+        'column_names': mdb.get_table_columns(db, server, database, table),
+        'rows': [],
+        'ajax': url_for('render_table_data', server=server, database=database, table=table),
+    }
+
+
+def table_paging(args):
+    """get_table_page() arguments from the DataTables server-side request"""
+    return {'start': args.get('start', 0, type=int),
+            'length': args.get('length', 25, type=int),
+            'order_column': args.get('order[0][column]', 0, type=int),
+            'order_dir': args.get('order[0][dir]', 'asc'),
+            'search': args.get('search[value]', '')}
+
+
+@app.route('/<server>/<database>/<table>/data/')
+@login_required
+def render_table_data(server, database, table):
+    """DataTables server-side processing endpoint"""
+    try:
+        entry = mdb.get_table_page_cached(db, server, database, table, **table_paging(request.args))
+        # the ETag doesn't depend on draw, the page's ajax function resends it with If-None-Match
+        if compress.etag_matches(entry.etag):
+            response = Response(status=304)
+        else:
+            content = entry.value
+            response = jsonify({
+                'draw': request.args.get('draw', 0, type=int),
+                'recordsTotal': content['records_total'],
+                'recordsFiltered': content['records_filtered'],
+                'data': [list(row) for row in content['rows']],
+            })
+        response.set_etag(entry.etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception as e:
+        return jsonify({'draw': request.args.get('draw', 0, type=int), 'error': str(e)})
+
+@app.route('/<server>/<database>/<table>/live/')
+@login_required
+def render_live(server, database, table):
+    """Server-Sent Events: the whole table once, then the changed rows every ?interval= seconds"""
+    try:
+        events = live.stream(server, database, table, request.args.get('interval', 2, type=int))
+    except mdb.ValidationError as e:
+        return jsonify({'error': str(e)}), 400
+    return Response(events, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+export_mimetypes = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def export_response(chunks, filename, fmt, compress):
+    headers = {'Content-Disposition': 'attachment; filename="%s.%s%s"' % (filename, fmt, '.gz' if compress else '')}
+    mimetype = 'application/gzip' if compress else export_mimetypes[fmt]
+    return Response(chunks, mimetype=mimetype, headers=headers)
+
+
+@app.route('/<server>/<database>/<table>/export.<fmt>')
+@login_required
+def export_table(server, database, table, fmt):
+    """streams the whole table as csv or ndjson, ?gzip=1 compresses it"""
+    try:
+        compress = request.args.get('gzip') == '1'
+        chunks = mdb.export_table(db, server, database, table, fmt, compress)
+        return export_response(chunks, "%s_%s_%s" % (server, database, table), fmt, compress)
+    except Exception as e:
+        raise ValueError(e)
+
+
+@app.route('/<server>/export.<fmt>', methods=['GET', 'POST'])
+@login_required
+def export_query(server, fmt):
+    """streams the result of the read-only ?sql= query as csv or ndjson, ?gzip=1 compresses it"""
+    try:
+        compress = request.values.get('gzip') == '1'
+        sql = mdb.validate_read_only_sql(request.values.get('sql', ''))
+        chunks = mdb.export_query(server, sql, fmt, compress)
+        return export_response(chunks, "%s_query" % server, fmt, compress)
     except Exception as e:
         raise ValueError(e)
 
+
 @app.route('/<server>/<database>/<table>/sql/', methods=['GET', 'POST'])
 @login_required
 def render_change(server, database, table):
     try:
         error = ""
         message = ""
-        ret = ""
+        statements = []
+        fanout = []
         
         # Validate SQL input
         raw_sql = request.form.get("sql", "").strip()
         if not raw_sql:
             error = "SQL query cannot be empty"
-            content = mdb.get_table_content(db, server, database, table)
+            content = table_page_content(server, database, table)
             return render_template("show_table_info.html", content=content, error=error)
         
         session['sql'] = raw_sql
 
-
-        mdb.logging.debug(session['history'])
         select = re.match(r'^SELECT.*FROM.*$', session['sql'], re.M | re.I)
-        if select:
-            content = mdb.execute_adhoc_query(db, server, session['sql'])
+        if request.form.get('fanout'):
+            # read-only query on several servers at once, merged into one table
+            try:
+                content = mdb.execute_fanout_query(db, request.form.getlist('servers'), session['sql'])
+                content['order'] = 'true'
+                fanout = content['servers']
+            except mdb.ValidationError as e:
+                error = f"VALIDATION ERROR: {str(e)}"
+                content = table_page_content(server, database, table)
+        elif select:
+            # the cached result is shared, don't modify it
+            content = dict(mdb.execute_adhoc_query_cached(db, server, session['sql']).value)
             content['order'] = 'true'
         else:
-            ret = mdb.execute_change(db, server, session['sql'])
-            content = mdb.get_table_content(db, server, database, table)
-
-        if "ERROR" in ret:
-            error = ret
-        else:
+            try:
+                statements = mdb.execute_changes(db, server, session['sql'])
+            except mdb.ValidationError as e:
+                error = f"VALIDATION ERROR: {str(e)}"
+            content = table_page_content(server, database, table)
+
+        failed = [s for s in statements if s['status'] == 'error']
+        if failed:
+            error = "; ".join(s['error'] for s in failed)
+        elif fanout and all(s['error'] for s in fanout):
+            error = "; ".join("%s: %s" % (s['server'], s['error']) for s in fanout)
+        elif not error:
             message = "Success"
-        if session['sql'].replace("\r\n","") not in session['history'] and not error:
-            session['history'].append(session['sql'].replace("\r\n",""))
+        if not error:
+            query_history.add(server, session['sql'].replace("\r\n",""))
 
-        return render_template("show_table_info.html", content=content, error=error, message=message)
+        return render_template("show_table_info.html", content=content, error=error, message=message,
+                               statements=statements, fanout=fanout)
+    except Exception as e:
+        raise ValueError(e)
+
+@app.route('/<server>/<database>/<table>/import/', methods=['POST'])
+@login_required
+def render_import(server, database, table):
+    """bulk import of an uploaded CSV/YAML file into the table, see bulk.py"""
+    try:
+        error = ""
+        message = ""
+        statements = []
+        upload = request.files.get('file')
+        session['sql'] = "IMPORT %s INTO %s" % (upload.filename if upload else '', table)
+        try:
+            if not upload or not upload.filename:
+                raise mdb.ValidationError("No file was uploaded")
+            rows = bulk.parse(upload.read(), bulk.format_of(upload.filename))
+            statements = bulk.load(server, table, rows, mode=request.form.get('mode', 'insert'),
+                                   load_to_runtime=bool(request.form.get('load_to_runtime')),
+                                   save_to_disk=bool(request.form.get('save_to_disk')))
+        except mdb.ValidationError as e:
+            error = f"VALIDATION ERROR: {str(e)}"
+        failed = [s for s in statements if s['status'] == 'error']
+        if failed:
+            error = "; ".join(s['error'] for s in failed)
+        elif not error:
+            message = "%d row(s) imported" % len(rows)
+        content = table_page_content(server, database, table)
+        return render_template("show_table_info.html", content=content, error=error, message=message,
+                               statements=statements)
     except Exception as e:
         raise ValueError(e)
 
@@ -150,13 +366,105 @@ def render_change(server, database, table):
 @login_required
 def adhoc_report(server):
     try:
-
-        adhoc_results = mdb.execute_adhoc_report(db, server)
+        if request.args.get('fanout') == '1':
+            # ?fanout=1&servers=a&servers=b, all servers if none is given
+            adhoc_results = mdb.execute_adhoc_report_fanout(db, request.args.getlist('servers'))
+        else:
+            adhoc_results = mdb.execute_adhoc_report(db, server)
         return render_template("show_adhoc_report.html", adhoc_results=adhoc_results)
     except Exception as e:
         raise ValueError(e)
 
 
+@app.route('/<server>/digest/delta/')
+@login_required
+def digest_delta_report(server):
+    """top digests by their change over the last ?interval= seconds, without resetting the digest stats"""
+    try:
+        report = digest.get_digest_delta(server, interval=request.args.get('interval', 60, type=int),
+                                         top=request.args.get('top', 10, type=int),
+                                         order=request.args.get('order', 'sum_time'))
+        return render_template("show_adhoc_report.html", adhoc_results=[report])
+    except Exception as e:
+        raise ValueError(e)
+
+
+@app.route('/<server>/drift/')
+@login_required
+def drift_report(server):
+    """runtime config checksums of ?servers= (all servers by default) and the row diff of the modules that differ"""
+    try:
+        return render_template("show_adhoc_report.html",
+                               adhoc_results=drift.get_drift_report(request.args.getlist('servers')))
+    except Exception as e:
+        raise ValueError(e)
+
+
+@app.route('/<server>/rules/simulate/')
+@login_required
+def simulate_query_rules(server):
+    """routes the current query digests through the ?source=main (default) or runtime query rules, offline"""
+    try:
+        reports = query_rules.simulate(server, source=request.args.get('source', 'main'),
+                                       top=request.args.get('top', 50, type=int))
+        return render_template("show_adhoc_report.html", adhoc_results=reports)
+    except Exception as e:
+        raise ValueError(e)
+
+
+@app.route('/<server>/stats/<table>/rate/')
+@login_required
+def render_stats_rate(server, table):
+    """per second rates of the sampled stats table over ?window= seconds, from the local store"""
+    try:
+        return jsonify(sampler.get_rates(server, table, request.args.get('window', 60, type=int)))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/<server>/stats/<table>/history/')
+@login_required
+def render_stats_history(server, table):
+    """[[ts, value, delta], ...] of one ?key=&metric= series over the last ?since= seconds, from the local store"""
+    try:
+        return jsonify(sampler.get_history(server, table, request.args.get('key', ''), request.args.get('metric', ''),
+                                           request.args.get('since', 3600, type=int)))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/history/')
+@login_required
+def render_history():
+    """the query history as JSON, ?q= narrows it down to the queries containing the text"""
+    try:
+        return jsonify({'history': query_history.search(request.args.get('q', ''),
+                                                        min(request.args.get('limit', 25, type=int), 1000))})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/metrics')
+def render_metrics():
+    """Prometheus metrics, off by default: for the logged in users and for scrapers sending metrics: token:"""
+    metrics_config = mdb.get_config(config).get('metrics') or {}
+    if not metrics_config.get('enabled', False):
+        return "metrics are disabled\n", 404
+    # scrapers can't log in, they send "Authorization: Bearer <token>"; without a token only the login works
+    token = str(metrics_config.get('token') or '')
+    authorization = request.headers.get('Authorization', '')
+    if not session.get('logged_in') and not (
+            token and hmac.compare_digest(authorization.encode('utf-8'), ('Bearer %s' % token).encode('utf-8'))):
+        return "unauthorized\n", 401
+    return Response(metrics.exposition(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/pool/stats/')
+@login_required
+def render_pool_stats():
+    return jsonify(mdb.pool_stats())
+
+
 @app.route('/settings/<action>/', methods=['GET', 'POST'])
 @login_required
 def render_settings(action):
@@ -167,12 +475,23 @@ def render_settings(action):
             with open(config, "r") as f:
                 config_file_content = f.read()
         if action == 'save':
+            # a config that doesn't parse is sent back to the editor instead of being saved
+            try:
+                parsed = yaml.safe_load(request.form["settings"])
+                error = None if isinstance(parsed, dict) else "The config must be a YAML mapping"
+            except yaml.YAMLError as e:
+                error = f"YAML parsing error: {str(e)}"
+            if error:
+                return render_template("settings.html", config_file_content=request.form["settings"], error=error)
+
             # back it up first
             with open(config, "r") as src, open(config + ".bak", "w") as dest:
                 dest.write(src.read())
 
             with open(config, "w") as f:
                 f.write(request.form["settings"])
+            # don't wait for the mtime check, the new file may have the same size and timestamp
+            mdb.invalidate_config(config)
             message = "success"
         return render_template("settings.html", config_file_content=config_file_content, message=message)
     except Exception as e:
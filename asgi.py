@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# Async serving mode: uvicorn --app-dir /app asgi:app
+#
+# The read paths (the table list, table pages, adhoc SELECTs and the adhoc report) are queried on
+# aiomysql in the event loop before the request is handed to the Flask app. The views find the
+# results through mdb.prefetched and only render them, so one worker can wait for hundreds of
+# ProxySQL queries at once and a dead node only delays the pages reading from it. Everything else
+# (writes, exports, live streams, settings) runs in the thread pool of the WSGI bridge as before.
+
+import asyncio
+import logging
+import os
+import re
+import time
+import urllib.parse
+
+from a2wsgi import WSGIMiddleware
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import RequestRedirect
+
+import amdb
+import mdb
+import metrics
+import app as proxyweb
+
+flask_app = proxyweb.app
+wsgi = WSGIMiddleware(flask_app, workers=int(os.environ.get('WEBSERVER_THREADS', 10)))
+
+metric_prefetch = metrics.histogram('proxyweb_prefetch_seconds', 'Time spent fetching the data of a request '
+                                    'on the async driver', ['endpoint'])
+
+# render_change() runs the query as a SELECT if it matches this
+_select = re.compile(r'^SELECT.*FROM.*$', re.M | re.I)
+
+# largest form read ahead of render_change()
+max_form_bytes = 1024 * 1024
+
+
+async def _store(found, key, fetch):
+    """Runs fetch and stores its result (or the exception it raised) under key"""
+    try:
+        found[key] = await fetch
+    except Exception as e:
+        found[key] = e
+
+
+async def _catalog(found, server, refresh=False):
+    async def fetch():
+        await amdb.get_catalog(server, refresh)
+        return True
+    await _store(found, (server, 'catalog'), fetch())
+
+
+async def _table_columns(found, server, database, table):
+    await _store(found, (server, 'columns', database, table), amdb.get_table_columns(server, database, table))
+
+
+async def _list_dbs(found, args, form):
+    server = mdb.get_config()['global']['default_server']
+    await _catalog(found, server, args.get('refresh') == '1')
+
+
+async def _show_table_content(found, args, form, server, database="main", table="global_variables"):
+    await asyncio.gather(_catalog(found, server, args.get('refresh') == '1'),
+                         _table_columns(found, server, database, table))
+
+
+async def _table_data(found, args, form, server, database, table):
+    paging = proxyweb.table_paging(args)
+    await _store(found, mdb.table_page_key(server, database, table, paging),
+                 amdb.get_table_page_cached(server, database, table, **paging))
+
+
+async def _change(found, args, form, server, database, table):
+    sql = form.get('sql', '').strip()
+    fetches = [_catalog(found, server), _table_columns(found, server, database, table)]
+    if sql and not form.get('fanout') and _select.match(sql):
+        try:
+            key = (server, 'sql', mdb.normalize_sql(mdb.validate_sql(sql)))
+        except mdb.ValidationError:
+            # the view reports it
+            key = None
+        if key:
+            fetches.append(_store(found, key, amdb.execute_adhoc_query_cached(server, sql)))
+    await asyncio.gather(*fetches)
+
+
+async def _adhoc_report(found, args, form, server):
+    if args.get('fanout') == '1':
+        return
+    await asyncio.gather(_catalog(found, server),
+                         _store(found, (server, 'adhoc_report'), amdb.execute_adhoc_report(server)))
+
+
+# endpoint -> prefetch coroutine, called with the view arguments
+prefetchers = {
+    'render_list_dbs': _list_dbs,
+    'render_show_table_content': _show_table_content,
+    'render_table_data': _table_data,
+    'render_change': _change,
+    'adhoc_report': _adhoc_report,
+}
+
+
+def _logged_in(headers):
+    request = flask_app.request_class({'HTTP_COOKIE': headers.get(b'cookie', b'').decode('latin-1')})
+    session = flask_app.session_interface.open_session(flask_app, request)
+    return bool(session and session.get('logged_in'))
+
+
+async def _read_body(receive, limit):
+    """Reads the request body, returns with (body, complete); stops early once it's longer than limit bytes"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        chunk = message.get('body', b'')
+        chunks.append(chunk)
+        size += len(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks), True
+        if size > limit:
+            # a chunked body has no Content-Length, don't buffer an unbounded one on the event loop
+            return b''.join(chunks), False
+
+
+def _replay(body, receive, more_body=False):
+    """A receive callable handing out the already read (part of the) body first"""
+    pending = [{'type': 'http.request', 'body': body, 'more_body': more_body}]
+
+    async def replayed():
+        if pending:
+            return pending.pop()
+        return await receive()
+    return replayed
+
+
+async def _http(scope, receive, send):
+    found = {}
+    try:
+        endpoint, view_args = flask_app.url_map.bind('localhost').match(scope['path'], scope['method'])
+    except (HTTPException, RequestRedirect):
+        endpoint = None
+    prefetch = prefetchers.get(endpoint)
+    headers = dict(scope['headers'])
+    # the session store may be a database, keep it off the event loop
+    if prefetch and not await asyncio.get_running_loop().run_in_executor(None, _logged_in, headers):
+        prefetch = None
+    if prefetch:
+        args = MultiDict(urllib.parse.parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True))
+        form = MultiDict()
+        content_type = headers.get(b'content-type', b'').decode('latin-1')
+        length = int(headers.get(b'content-length', b'0') or 0)
+        if (scope['method'] == 'POST' and content_type.startswith('application/x-www-form-urlencoded')
+                and length <= max_form_bytes):
+            body, complete = await _read_body(receive, max_form_bytes)
+            receive = _replay(body, receive, more_body=not complete)
+            if complete and len(body) <= max_form_bytes:
+                form = MultiDict(urllib.parse.parse_qsl(body.decode('utf-8', 'replace'), keep_blank_values=True))
+            else:
+                # too large to read ahead, the view runs the blocking way
+                prefetch = None
+    if prefetch:
+        started = time.perf_counter()
+        try:
+            await prefetch(found, args, form, **view_args)
+        except Exception as e:
+            # the view runs the blocking way and reports the error itself
+            logging.debug("prefetch of %s failed: %s", endpoint, e)
+            found = {}
+        metric_prefetch.observe(endpoint, value=time.perf_counter() - started)
+
+    token = mdb.prefetched.set(found)
+    try:
+        # the bridge copies the context into its thread, the views see the prefetched results
+        await wsgi(scope, receive, send)
+    finally:
+        mdb.prefetched.reset(token)
+
+
+async def _lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await amdb.close_pools()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'http':
+        await _http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await _lifespan(scope, receive, send)
@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# Reproducible benchmark of the main pages against the fake ProxySQL backend of the tests
+# (tests/fake_proxysql.py).
+#
+# The app runs in-process behind Flask's test client, so neither a network nor a ProxySQL is
+# needed and the numbers only depend on ProxyWeb's own code. Every scenario is sent `requests`
+# times by `concurrency` threads; latency percentiles, throughput and the peak RSS of the process
+# are printed (or written to --output) as JSON.
+#
+#   python3 benchmark/run.py --concurrency 4 --requests 200 --output bench_output.json
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import yaml
+
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, basedir)
+sys.path.insert(0, os.path.join(basedir, 'tests'))
+
+import fake_proxysql
+
+# name: (method, url, form data); {server} is the default server of the config
+scenarios = {
+    'list_dbs': ('GET', '/', None),
+    'table': ('GET', '/{server}/stats/stats_mysql_query_digest/', None),
+    'table_data': ('GET', '/{server}/stats/stats_mysql_query_digest/data/?draw=1&start=0&length=25'
+                          '&order[0][column]=9&order[0][dir]=desc&search[value]=', None),
+    'table_search': ('GET', '/{server}/main/mysql_query_rules/data/?draw=1&start=100&length=50'
+                            '&order[0][column]=0&order[0][dir]=asc&search[value]=SELECT', None),
+    'sql': ('POST', '/{server}/stats/stats_mysql_query_digest/sql/',
+            {'sql': 'SELECT hostgroup, digest, count_star, sum_time FROM stats_mysql_query_digest '
+                    'WHERE count_star > 500000 ORDER BY sum_time DESC LIMIT 500'}),
+    'adhoc': ('GET', '/{server}/adhoc/', None),
+}
+
+
+def percentile(values, pct):
+    """values has to be sorted"""
+    if not values:
+        return None
+    index = min(int(round(pct / 100.0 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def peak_rss_bytes():
+    # kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def write_config(workdir, cache):
+    """Copies config/config.yml into workdir with the sampler off and, unless cache is set, the result cache off"""
+    with open(os.path.join(basedir, 'config', 'config.yml')) as f:
+        config = yaml.safe_load(f)
+    config['sampler'] = {'enabled': False}
+    config['metrics'] = {'enabled': True}
+    if not cache:
+        config['cache'] = {'max_entries': 0, 'default_ttl': 0, 'sql_ttl': 0, 'ttls': {}}
+    os.makedirs(os.path.join(workdir, 'config'), exist_ok=True)
+    with open(os.path.join(workdir, 'config', 'config.yml'), 'w') as f:
+        yaml.safe_dump(config, f)
+    return config
+
+
+def new_client(app, config):
+    """A logged in test client; the / page also initializes the session"""
+    client = app.test_client()
+    client.post('/login', data={'username': config['auth']['admin_user'],
+                                'password': config['auth']['admin_password']})
+    client.get('/')
+    return client
+
+
+def run_scenario(app, config, method, url, data, requests, concurrency):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    remaining = [requests]
+    clients = [new_client(app, config) for _ in range(concurrency)]
+
+    def worker(client):
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            started = time.perf_counter()
+            if method == 'POST':
+                response = client.post(url, data=data)
+            else:
+                response = client.get(url)
+            response.get_data()
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+
+    threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'throughput_rps': round(len(latencies) / wall, 1),
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=basedir, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ProxyWeb benchmark against a fake ProxySQL admin backend")
+    parser.add_argument('--concurrency', type=int, default=4, help="client threads (default: 4)")
+    parser.add_argument('--requests', type=int, default=200, help="requests per scenario (default: 200)")
+    parser.add_argument('--warmup', type=int, default=10, help="unmeasured requests per scenario (default: 10)")
+    parser.add_argument('--scenarios', default=','.join(scenarios),
+                        help="comma separated subset of: %s" % ', '.join(scenarios))
+    parser.add_argument('--digests', type=int, default=fake_proxysql.default_sizes['digests'])
+    parser.add_argument('--query-rules', type=int, default=fake_proxysql.default_sizes['query_rules'])
+    parser.add_argument('--servers', type=int, default=fake_proxysql.default_sizes['servers'])
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="simulated ProxySQL latency per statement in milliseconds (default: 0)")
+    parser.add_argument('--cache', action='store_true', help="keep the cache: section of the config (default: off)")
+    parser.add_argument('--log-level', default='WARNING', help="log level of the app while running (default: WARNING)")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    selected = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = [s for s in selected if s not in scenarios]
+    if unknown:
+        parser.error("unknown scenario(s): %s" % ', '.join(unknown))
+
+    seeding = time.perf_counter()
+    sizes = fake_proxysql.install({'digests': args.digests, 'query_rules': args.query_rules,
+                                   'servers': args.servers})
+    seeding = time.perf_counter() - seeding
+    fake_proxysql.latency = args.latency / 1000.0
+
+    # the app reads config/config.yml relative to the working directory at import time
+    workdir = tempfile.mkdtemp(prefix='proxyweb_bench_')
+    config = write_config(workdir, args.cache)
+    output = os.path.abspath(args.output) if args.output else None
+    os.chdir(workdir)
+    import app as proxyweb
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    server = config['global']['default_server']
+    results = {}
+    for name in selected:
+        method, url, data = scenarios[name]
+        url = url.format(server=server)
+        if args.warmup:
+            run_scenario(proxyweb.app, config, method, url, data, args.warmup, 1)
+        results[name] = run_scenario(proxyweb.app, config, method, url, data, args.requests, args.concurrency)
+        results[name]['url'] = url
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {'concurrency': args.concurrency, 'requests': args.requests, 'warmup': args.warmup,
+                     'latency_ms': args.latency, 'cache': args.cache, 'sizes': sizes},
+        'seed_seconds': round(seeding, 3),
+        'scenarios': results,
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    failed = sum(r['errors'] for r in results.values())
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,239 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# Bulk import of mysql_servers, mysql_users, mysql_query_rules and mysql_replication_hostgroups
+# rows from CSV or YAML.
+#
+# The columns are checked against the table, then the rows are written with multi-row INSERT (or
+# REPLACE) statements of batch_size rows each, inside one transaction on one pooled connection.
+# A column left out of a row (an empty CSV cell, a missing YAML key) gets its default value; NULL
+# is \N in CSV and null in YAML. Rows leaving out different columns go into different statements.
+#
+# Also usable from the command line, with the config of the current directory:
+#   python3 bulk.py --server proxysql --table mysql_servers --load-to-runtime servers.csv
+
+import argparse
+import csv
+import io
+import logging
+import os
+import sys
+import time
+
+import yaml
+
+import mdb
+
+# table -> the module name of its LOAD ... TO RUNTIME / SAVE ... TO DISK commands
+tables = {
+    'mysql_servers': 'MYSQL SERVERS',
+    'mysql_replication_hostgroups': 'MYSQL SERVERS',
+    'mysql_users': 'MYSQL USERS',
+    'mysql_query_rules': 'MYSQL QUERY RULES',
+}
+formats = ('csv', 'yaml')
+modes = ('insert', 'replace')
+batch_size_default = 500
+
+# NULL in a CSV cell, like LOAD DATA INFILE
+csv_null = '\\N'
+
+
+def parse_csv(data):
+    """Returns with a list of {column: value} dicts, the first line is the header"""
+    reader = csv.reader(io.StringIO(data))
+    header = next(reader, None)
+    if not header:
+        raise mdb.ValidationError("The CSV file is empty")
+    header = [column.strip() for column in header]
+    rows = []
+    for line, values in enumerate(reader, start=2):
+        if not values:
+            continue
+        if len(values) != len(header):
+            raise mdb.ValidationError(f"CSV line {line}: {len(values)} value(s) for {len(header)} column(s)")
+        rows.append({column: (None if value == csv_null else value)
+                     for column, value in zip(header, values) if value != ''})
+    return rows
+
+
+def parse_yaml(data):
+    """A list of mappings, or a mapping with the list under "rows" """
+    try:
+        parsed = yaml.safe_load(data)
+    except yaml.YAMLError as e:
+        raise mdb.ValidationError(f"YAML parsing error: {e}")
+    if isinstance(parsed, dict):
+        parsed = parsed.get('rows')
+    if not isinstance(parsed, list) or not all(isinstance(row, dict) for row in parsed):
+        raise mdb.ValidationError("The YAML file has to be a list of column: value mappings")
+    return [{str(column): value for column, value in row.items()} for row in parsed]
+
+
+def parse(data, fmt):
+    if isinstance(data, bytes):
+        try:
+            data = data.decode('utf-8-sig')
+        except UnicodeDecodeError as e:
+            raise mdb.ValidationError(f"File is not UTF-8 encoded: {e}")
+    if fmt == 'csv':
+        return parse_csv(data)
+    if fmt in ('yaml', 'yml'):
+        return parse_yaml(data)
+    raise mdb.ValidationError(f"Unsupported format: {fmt}")
+
+
+def format_of(filename):
+    return os.path.splitext(filename or '')[1].lstrip('.').lower()
+
+
+def _check_columns(server, table, rows):
+    """Returns with the rows keyed by the table's own column names, case-insensitively"""
+    columns = {column.lower(): column for column in mdb.get_table_columns(None, server, 'main', table)}
+    unknown = sorted({column for row in rows for column in row if column.lower() not in columns})
+    if unknown:
+        raise mdb.ValidationError(f"Unknown column(s) for {table}: {', '.join(unknown)}")
+    return [{columns[column.lower()]: value for column, value in row.items()} for row in rows]
+
+
+def build_statements(table, rows, mode='insert', batch_size=batch_size_default):
+    """Returns with [(sql, params, row count)]: multi-row statements of rows having the same columns"""
+    verb = 'REPLACE' if mode == 'replace' else 'INSERT'
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row), []).append(row)
+    statements = []
+    for columns, group in groups.items():
+        if not columns:
+            raise mdb.ValidationError("A row has no values")
+        head = "%s INTO main.%s (%s) VALUES " % (verb, mdb.quote_identifier(table),
+                                                   ", ".join(mdb.quote_column(c) for c in columns))
+        placeholders = "(%s)" % ", ".join(["%s"] * len(columns))
+        for start in range(0, len(group), batch_size):
+            batch = group[start:start + batch_size]
+            params = [row[column] for row in batch for column in columns]
+            statements.append((head + ", ".join([placeholders] * len(batch)), params, len(batch)))
+    return statements
+
+
+def _result(sql):
+    return {'sql': sql, 'status': 'skipped', 'rowcount': None, 'error': None, 'elapsed': 0.0}
+
+
+def load(server, table, rows, mode='insert', batch_size=batch_size_default, load_to_runtime=False,
+         save_to_disk=False, transaction=True):
+    '''writes rows (a list of {column: value} dicts) into main.<table> of the server. Returns with a list of
+    dicts like execute_changes() does: "sql", "status", "rowcount", "error", "elapsed" per statement.
+    The first error rolls the transaction back and skips the rest.'''
+    if table not in tables:
+        raise mdb.ValidationError(f"Bulk import is supported for {', '.join(tables)} only")
+    if mode not in modes:
+        raise mdb.ValidationError(f"Invalid mode: {mode}")
+    if mdb.get_read_only(server):
+        raise mdb.ValidationError(f"Server {server} is read-only")
+    if not rows:
+        raise mdb.ValidationError("There are no rows to import")
+    batch_size = max(int(batch_size), 1)
+    statements = build_statements(table, _check_columns(server, table, rows), mode, batch_size)
+
+    steps = []
+    if transaction:
+        steps.append(('BEGIN', None, None))
+    steps.extend(statements)
+    if transaction:
+        steps.append(('COMMIT', None, None))
+    if load_to_runtime:
+        steps.append(('LOAD %s TO RUNTIME' % tables[table], None, None))
+    if save_to_disk:
+        steps.append(('SAVE %s TO DISK' % tables[table], None, None))
+    # the multi-row statements are shown shortened
+    results = [_result(sql if count is None else "%s ... (%d rows)" % (sql.split(' VALUES ')[0], count))
+               for sql, params, count in steps]
+    logging.debug("server: %s - bulk %s of %d row(s) into %s in %d statement(s)", server, mode, len(rows), table,
+                  len(statements))
+
+    in_transaction = False
+    try:
+        with mdb.pooled_cursor(server, dictionary=False, kind='write') as cur:
+            for (sql, params, count), result in zip(steps, results):
+                started = time.monotonic()
+                try:
+                    cur.execute(sql, params)
+                    if cur.with_rows:
+                        cur.fetchall()
+                    result['rowcount'] = cur.rowcount
+                    result['status'] = 'ok'
+                    if sql == 'BEGIN':
+                        in_transaction = True
+                    elif sql == 'COMMIT':
+                        in_transaction = False
+                except (mdb.mysql.connector.Error, mdb.mysql.connector.Warning) as e:
+                    result['status'] = 'error'
+                    result['error'] = str(e)
+                    break
+                finally:
+                    result['elapsed'] = time.monotonic() - started
+            if in_transaction:
+                rollback = _result('ROLLBACK')
+                try:
+                    cur.execute('ROLLBACK')
+                    rollback['status'] = 'ok'
+                except (mdb.mysql.connector.Error, mdb.mysql.connector.Warning) as e:
+                    rollback['status'] = 'error'
+                    rollback['error'] = str(e)
+                results.append(rollback)
+    except mdb.DatabaseError as e:
+        results[0]['status'] = 'error'
+        results[0]['error'] = str(e)
+    mdb.result_cache.invalidate(server)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import rows into a ProxySQL admin table")
+    parser.add_argument('file', help="CSV (header line first) or YAML (list of mappings) file")
+    parser.add_argument('--server', help="server name from the config, default: global: default_server")
+    parser.add_argument('--table', required=True, choices=sorted(tables))
+    parser.add_argument('--format', choices=formats, help="default: from the file extension")
+    parser.add_argument('--mode', choices=modes, default='insert')
+    parser.add_argument('--batch-size', type=int, default=batch_size_default)
+    parser.add_argument('--load-to-runtime', action='store_true')
+    parser.add_argument('--save-to-disk', action='store_true')
+    parser.add_argument('--no-transaction', action='store_true',
+                        help="don't wrap the statements in BEGIN/COMMIT")
+    args = parser.parse_args()
+
+    fmt = args.format or format_of(args.file)
+    try:
+        server = args.server or mdb.get_config()['global']['default_server']
+        with open(args.file, 'rb') as f:
+            rows = parse(f.read(), fmt)
+        results = load(server, args.table, rows, args.mode, args.batch_size, args.load_to_runtime,
+                       args.save_to_disk, not args.no_transaction)
+    except (mdb.ValidationError, mdb.ConfigError, OSError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 2
+    for result in results:
+        print("%-8s %8.1f ms  %s%s" % (result['status'], result['elapsed'] * 1000, result['sql'],
+                                       ": %s" % result['error'] if result['error'] else ""))
+    return 1 if any(result['status'] == 'error' for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# gzip/brotli compression of the responses, as per the compression: section of the config.
+#
+# Brotli is used when the browser accepts it and the brotli package is installed, gzip otherwise.
+# Streamed responses (exports) are compressed chunk by chunk and flushed after every chunk, so they
+# stay streamed. Server-Sent Events and small responses are left alone. The ETag of a compressed
+# response gets the encoding appended, etag_matches() takes care of that for conditional requests.
+
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import mdb
+import metrics
+
+defaults = {
+    'enabled': True,
+    'min_size': 1024,
+    'gzip_level': 6,
+    'brotli_quality': 4,
+    'mimetypes': ['text/html', 'text/plain', 'text/css', 'text/csv', 'text/javascript', 'application/javascript',
+                  'application/json', 'application/x-ndjson'],
+}
+
+metric_compressed = metrics.counter('proxyweb_compressed_responses_total', 'Responses sent compressed',
+                                    ['encoding'])
+
+
+def get_settings():
+    return mdb.get_section('compression', defaults)
+
+
+class _Gzip:
+
+    def __init__(self, settings):
+        self._compressor = zlib.compressobj(int(settings['gzip_level']), zlib.DEFLATED, 31)  # 31: gzip framing
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _Brotli:
+
+    def __init__(self, settings):
+        self._compressor = brotli.Compressor(quality=int(settings['brotli_quality']))
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+encoders = {'br': _Brotli, 'gzip': _Gzip}
+
+
+def _accepted_encoding():
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def etag_matches(etag):
+    """True if the If-None-Match of the request has etag, as it was sent with or without compression"""
+    return any(request.if_none_match.contains(etag + suffix) for suffix in ('', '-gzip', '-br'))
+
+
+def _stream(chunks, compressor, source):
+    try:
+        for chunk in chunks:
+            if chunk:
+                data = compressor.compress(chunk) + compressor.flush()
+                if data:
+                    yield data
+        yield compressor.finish()
+    finally:
+        # hands the pooled connection of an export back even if the client went away
+        if hasattr(source, 'close'):
+            source.close()
+
+
+def compress_response(response):
+    settings = get_settings()
+    if not settings['enabled'] or response.mimetype not in settings['mimetypes']:
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or request.method == 'HEAD' or 'Content-Encoding' in response.headers
+            or response.direct_passthrough):
+        return response
+    encoding = _accepted_encoding()
+    if encoding is None:
+        return response
+
+    compressor = encoders[encoding](settings)
+    if response.is_streamed:
+        response.response = _stream(response.iter_encoded(), compressor, response.response)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < int(settings['min_size']):
+            return response
+        response.set_data(compressor.compress(data) + compressor.finish())
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag("%s-%s" % (etag, encoding), weak)
+    metric_compressed.inc(encoding)
+    return response
+
+
+def install(app):
+    # registered first, so it runs after the other after_request functions
+    app.after_request(compress_response)
@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# Snapshots of stats_mysql_query_digest and the deltas between them.
+#
+# The counters of stats_mysql_query_digest are cumulative since the last reset, reading
+# stats_mysql_query_digest_reset would clear them for everybody. Instead we keep the last few
+# snapshots of every server and subtract them. A snapshot is three integer arrays (key id,
+# count_star, sum_time); the (hostgroup, schemaname, username, digest) keys and the digest texts
+# are stored once per server in a registry and referred to by their id. When a snapshot expires the
+# keys no kept snapshot refers to are dropped: the registry and the kept snapshots are replaced by
+# renumbered copies, the ones already handed out stay valid with their own registry.
+
+import heapq
+import threading
+import time
+from array import array
+from collections import deque
+
+import mdb
+
+sql_digest_snapshot = ("select hostgroup, schemaname, username, digest, count_star, sum_time, "
+                       "substr(digest_text, 1, 120) from stats.stats_mysql_query_digest;")
+
+# how many snapshots are kept per server and how old the last one can be to be reused instead of taking a new one
+snapshots_kept = 10
+min_snapshot_gap = 5
+
+# what the delta report can be ordered by
+orders = ('sum_time', 'count_star', 'avg_time')
+
+
+class _KeyRegistry:
+    """Maps (hostgroup, schemaname, username, digest) keys to dense integer ids"""
+
+    def __init__(self):
+        self.ids = {}
+        self.keys = []
+        self.texts = []
+
+    def get_id(self, key, text):
+        key_id = self.ids.get(key)
+        if key_id is None:
+            key_id = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+            self.texts.append(text)
+        return key_id
+
+
+class DigestSnapshot:
+    __slots__ = ('taken_at', 'registry', 'ids', 'count_star', 'sum_time')
+
+    def __init__(self, taken_at, registry):
+        self.taken_at = taken_at
+        self.registry = registry
+        self.ids = array('q')
+        self.count_star = array('q')
+        self.sum_time = array('q')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def renumbered(self, registry, remap):
+        """A copy referring to registry, remap[old id] is the new id. The counters are shared, they never change"""
+        snapshot = DigestSnapshot(self.taken_at, registry)
+        snapshot.ids = array('q', [remap[key_id] for key_id in self.ids])
+        snapshot.count_star, snapshot.sum_time = self.count_star, self.sum_time
+        return snapshot
+
+
+_registries = {}
+_snapshots = {}
+_lock = threading.Lock()
+
+
+def _compact(server):
+    """Drops the keys the kept snapshots of the server don't refer to, call it holding _lock"""
+    snapshots = _snapshots[server]
+    old = _registries[server]
+    live = set()
+    for snapshot in snapshots:
+        live.update(snapshot.ids)
+    if len(live) == len(old.keys):
+        return
+    registry = _registries[server] = _KeyRegistry()
+    remap = array('q', [-1]) * len(old.keys)
+    for key_id in sorted(live):
+        remap[key_id] = registry.get_id(old.keys[key_id], old.texts[key_id])
+    _snapshots[server] = deque((snapshot.renumbered(registry, remap) for snapshot in snapshots),
+                               maxlen=snapshots.maxlen)
+
+
+def take_snapshot(server):
+    """Reads stats_mysql_query_digest (without resetting it) and stores it as the newest snapshot of the server"""
+    column_names, rows = mdb.fetch_query(server, sql_digest_snapshot)
+    with _lock:
+        registry = _registries.setdefault(server, _KeyRegistry())
+        snapshot = DigestSnapshot(time.time(), registry)
+        for hostgroup, schemaname, username, digest, count_star, sum_time, text in rows:
+            snapshot.ids.append(registry.get_id((hostgroup, schemaname, username, digest), text))
+            snapshot.count_star.append(int(count_star))
+            snapshot.sum_time.append(int(sum_time))
+        snapshots = _snapshots.setdefault(server, deque(maxlen=snapshots_kept))
+        expiring = len(snapshots) == snapshots.maxlen
+        snapshots.append(snapshot)
+        if expiring:
+            _compact(server)
+        return _snapshots[server][-1]
+
+
+def get_snapshots(server):
+    with _lock:
+        return list(_snapshots.get(server, ()))
+
+
+def diff_snapshots(server, old, new, top=10, order='sum_time'):
+    """Returns with the top rows of new - old as dicts, ordered by the delta of `order`.
+
+    A key missing from old counts from zero; a counter that went backwards was reset, its delta is the new value.
+    """
+    registry = new.registry
+    with _lock:
+        keys, texts = registry.keys, registry.texts
+        size = len(keys)
+        old_ids = old.ids
+        if old.registry is not registry:
+            # renumbered in between, match the keys; the ones dropped since can't be in new either
+            old_ids = [registry.ids.get(key, -1) for key in map(old.registry.keys.__getitem__, old.ids)]
+    # scatter the old snapshot into arrays indexed by key id
+    old_count = array('q', [0]) * size
+    old_sum = array('q', [0]) * size
+    for key_id, count_star, sum_time in zip(old_ids, old.count_star, old.sum_time):
+        if key_id >= 0:
+            old_count[key_id] = count_star
+            old_sum[key_id] = sum_time
+
+    deltas = []
+    for key_id, count_star, sum_time in zip(new.ids, new.count_star, new.sum_time):
+        d_count = count_star - old_count[key_id]
+        d_sum = sum_time - old_sum[key_id]
+        if d_count < 0 or d_sum < 0:
+            d_count, d_sum = count_star, sum_time
+        if d_count:
+            deltas.append((key_id, d_count, d_sum))
+
+    if order == 'count_star':
+        sort_key = lambda d: d[1]
+    elif order == 'avg_time':
+        sort_key = lambda d: d[2] / d[1]
+    else:
+        sort_key = lambda d: d[2]
+    result = []
+    for key_id, d_count, d_sum in heapq.nlargest(int(top), deltas, key=sort_key):
+        hostgroup, schemaname, username, digest = keys[key_id]
+        result.append({'hostgroup': hostgroup, 'schemaname': schemaname, 'username': username, 'digest': digest,
+                       'digest_text': texts[key_id], 'count_star': d_count, 'sum_time': d_sum,
+                       'avg_time': d_sum // d_count})
+    return result
+
+
+def get_digest_delta(server, interval=60, top=10, order='sum_time'):
+    '''returns with a report dict like the adhoc_report items ("title", "column_names", "rows", ...) of the
+    top digests by their delta between now and the newest snapshot that is at least interval seconds old.
+    If there is no older snapshot yet, the oldest one is used; on the very first call there is nothing to
+    compare with, the snapshot taken becomes the baseline.'''
+    if order not in orders:
+        raise mdb.ValidationError(f"Invalid order: {order}")
+    started = time.monotonic()
+    snapshots = get_snapshots(server)
+    if snapshots and time.time() - snapshots[-1].taken_at < min_snapshot_gap:
+        new = snapshots[-1]
+        older = snapshots[:-1]
+    else:
+        new = take_snapshot(server)
+        older = snapshots
+
+    report = {'title': f"Top {top} digests by {order} delta", 'sql': sql_digest_snapshot,
+              'column_names': ['sum_time', 'count_star', 'avg_time', 'hostgroup', 'schemaname', 'username',
+                               'digest', 'digest_text'],
+              'rows': [], 'row_count': 0, 'error': None}
+    if not older:
+        report['info'] = "Baseline snapshot taken, reload the page to see the deltas."
+    else:
+        candidates = [s for s in older if new.taken_at - s.taken_at >= interval]
+        old = candidates[-1] if candidates else older[0]
+        report['info'] = "Changes in the last %d seconds, stats_mysql_query_digest is not reset." % round(
+            new.taken_at - old.taken_at)
+        for row in diff_snapshots(server, old, new, top, order):
+            report['rows'].append(tuple(row[c] for c in report['column_names']))
+        report['row_count'] = len(report['rows'])
+    report['elapsed'] = time.monotonic() - started
+    return report
@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# Config drift between the ProxySQL servers of the config.
+#
+# ProxySQL keeps a checksum of every runtime config module in runtime_checksums_values (that's
+# what ProxySQL Cluster syncs by), so comparing the fleet costs one tiny query per server. Only the
+# modules whose checksums disagree are read in full and diffed row by row. A module without a
+# usable checksum (the admin-checksum_* variable is off) falls back to a hash of its rows computed
+# here, on every server.
+
+import hashlib
+import time
+
+import mdb
+
+sql_checksums = "select name, checksum from main.runtime_checksums_values;"
+sql_module_table = "select * from main.%s;"
+
+# checksum module -> the runtime tables it covers
+module_tables = {
+    'mysql_servers': ('runtime_mysql_servers', 'runtime_mysql_replication_hostgroups',
+                      'runtime_mysql_group_replication_hostgroups', 'runtime_mysql_galera_hostgroups',
+                      'runtime_mysql_aws_aurora_hostgroups'),
+    'mysql_query_rules': ('runtime_mysql_query_rules', 'runtime_mysql_query_rules_fast_routing'),
+    'mysql_users': ('runtime_mysql_users',),
+    'proxysql_servers': ('runtime_proxysql_servers',),
+}
+
+# what runtime_checksums_values shows for a module that isn't checksummed
+_no_checksums = ('', '0x0000000000000000', None)
+
+
+def _fetch_checksums(server):
+    """Returns with {module: checksum} of the server, None for the modules without a checksum"""
+    column_names, rows = mdb.fetch_query(server, sql_checksums)
+    checksums = {name: (checksum if checksum not in _no_checksums else None) for name, checksum in rows}
+    return {module: checksums.get(module) for module in module_tables}
+
+
+def _module_tables(server, module):
+    # hide_tables only applies to the UI, a hidden runtime table is still compared
+    existing = set(mdb.get_full_catalog(server).get('main', ()))
+    return [table for table in module_tables[module] if table in existing]
+
+
+def _fetch_tables(server, modules):
+    """Returns with {table: (column_names, rows)} of every table of the modules that exists on the server"""
+    tables = {}
+    for module in modules:
+        for table in _module_tables(server, module):
+            tables[table] = mdb.fetch_query(server, sql_module_table % mdb.quote_identifier(table))
+    return tables
+
+
+def _local_checksums(server, modules):
+    """{module: hash of its rows} - the rows are sorted first, the order they come in doesn't matter"""
+    tables = _fetch_tables(server, modules)
+    checksums = {}
+    for module in modules:
+        digest = hashlib.sha1()
+        for table in module_tables[module]:
+            if table not in tables:
+                continue
+            column_names, rows = tables[table]
+            digest.update(repr((table, column_names)).encode())
+            for row in sorted(repr(tuple(row)) for row in rows):
+                digest.update(row.encode())
+        checksums[module] = 'local:' + digest.hexdigest()[:16]
+    return checksums
+
+
+def diff_rows(servers, results):
+    """results: {server: rows}. Returns with (row, [servers having it]) for every row not present on all servers"""
+    having = {}
+    for server in servers:
+        for row in set(tuple(row) for row in results[server]):
+            having.setdefault(row, []).append(server)
+    return sorted(((row, found) for row, found in having.items() if len(found) != len(servers)),
+                  key=lambda item: tuple(str(v) for v in item[0]))
+
+
+def _report(title, sql, info):
+    return {'title': title, 'sql': sql, 'info': info, 'column_names': [], 'rows': [], 'row_count': 0,
+            'elapsed': 0, 'error': None}
+
+
+def get_drift_report(servers=None):
+    '''compares the runtime config modules of servers (all of them if empty), returns with a list of
+    adhoc_report style dicts: the checksums of every module on every server first, then a row diff of
+    each table of the modules that differ.'''
+    started = time.monotonic()
+    servers = mdb.fanout_servers(servers)
+    concurrency, timeout = mdb.fanout_settings()
+
+    outcomes = mdb.run_concurrently(_fetch_checksums, [(server,) for server in servers], concurrency, timeout,
+                                    name="drift")
+    checksums = {}
+    errors = {}
+    for server, (result, error, elapsed) in zip(servers, outcomes):
+        if error:
+            errors[server] = error
+        else:
+            checksums[server] = result
+    answered = [server for server in servers if server in checksums]
+
+    # modules ProxySQL doesn't checksum somewhere are hashed locally, on all servers to keep them comparable
+    unsummed = [module for module in module_tables if any(checksums[s][module] is None for s in answered)]
+    if unsummed and answered:
+        outcomes = mdb.run_concurrently(_local_checksums, [(server, unsummed) for server in answered],
+                                        concurrency, timeout, name="drift")
+        for server, (result, error, elapsed) in zip(list(answered), outcomes):
+            if error:
+                errors[server] = error
+                answered.remove(server)
+            else:
+                checksums[server].update(result)
+
+    differing = [module for module in module_tables if len({checksums[s][module] for s in answered}) > 1]
+
+    summary = _report("Config checksums of %d server(s)" % len(servers), sql_checksums,
+                      "Modules marked with DRIFT differ between the servers, their tables are compared below. "
+                      "local: checksums are computed by ProxyWeb for the modules ProxySQL doesn't checksum.")
+    summary['column_names'] = ['module', 'status'] + answered
+    for module in module_tables:
+        status = 'DRIFT' if module in differing else 'in sync'
+        summary['rows'].append(tuple([module, status] + [checksums[s][module] for s in answered]))
+    summary['row_count'] = len(summary['rows'])
+    if errors:
+        summary['error'] = "; ".join("%s: %s" % (server, error) for server, error in errors.items())
+    summary['elapsed'] = time.monotonic() - started
+    reports = [summary]
+    if not differing:
+        return reports
+
+    # full reads only for the modules that differ
+    diff_started = time.monotonic()
+    outcomes = mdb.run_concurrently(_fetch_tables, [(server, differing) for server in answered], concurrency,
+                                    timeout, name="drift")
+    tables = {}
+    for server, (result, error, elapsed) in zip(answered, outcomes):
+        if error:
+            errors[server] = error
+        else:
+            tables[server] = result
+    compared = [server for server in answered if server in tables]
+
+    for module in differing:
+        for table in module_tables[module]:
+            present = [server for server in compared if table in tables[server]]
+            if not present:
+                continue
+            report = _report("%s: %s" % (module, table), sql_module_table % table,
+                             "Rows that are not the same on every server. A changed row shows up once per "
+                             "version, with the servers having that version.")
+            column_names = {tuple(tables[server][table][0]) for server in present}
+            if len(column_names) > 1:
+                report['error'] = "The servers have different columns, ProxySQL versions differ?"
+            else:
+                diff = diff_rows(compared, {server: tables[server][table][1] if server in present else []
+                                            for server in compared})
+                report['column_names'] = list(column_names.pop()) + ['present on', 'missing on']
+                for row, found in diff[:mdb.max_page_length]:
+                    missing = [server for server in compared if server not in found]
+                    report['rows'].append(row + (', '.join(found), ', '.join(missing)))
+                report['row_count'] = len(diff)
+                if len(diff) > mdb.max_page_length:
+                    report['info'] += " Only the first %d are shown." % mdb.max_page_length
+            report['elapsed'] = time.monotonic() - diff_started
+            reports.append(report)
+    failed = [server for server in answered if server not in tables]
+    if failed:
+        summary['error'] = "; ".join("%s: %s" % (server, errors[server]) for server in errors)
+    return reports
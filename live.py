@@ -0,0 +1,222 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# Live, auto-refreshing table views over Server-Sent Events.
+#
+# One Poller thread per (server, database, table, interval) reads the table and keeps the last
+# result keyed by the key columns of the table. Each poll is compared with the previous one and
+# only the changed/new rows and the keys of the removed rows are sent to the viewers; the event is
+# encoded once and put on the queue of every viewer. A new viewer (or one that fell behind) gets
+# the whole table first. The poller stops when its last viewer leaves.
+#
+# Every open stream keeps a web server thread busy: with gunicorn, --threads has to leave room
+# for them. Streams end after max_stream_seconds, the browser reconnects by itself.
+
+import json
+import logging
+import queue
+import threading
+import time
+
+import mdb
+import metrics
+
+defaults = {
+    'intervals': [1, 2, 5, 10, 30],
+    'max_stream_seconds': 300,
+    'keepalive': 15,
+}
+
+# the columns identifying a row; for other tables the whole row is the key
+key_columns = {
+    'stats_mysql_connection_pool': ('hostgroup', 'srv_host', 'srv_port'),
+    'stats_mysql_processlist': ('SessionID',),
+    'stats_mysql_global': ('Variable_Name',),
+    'stats_memory_metrics': ('Variable_Name',),
+    'stats_mysql_commands_counters': ('Command',),
+    'stats_mysql_users': ('username',),
+    'stats_mysql_query_digest': ('hostgroup', 'schemaname', 'username', 'digest'),
+    'stats_mysql_free_connections': ('fd',),
+    'stats_proxysql_servers_metrics': ('hostname', 'port'),
+    'global_variables': ('variable_name',),
+    'runtime_global_variables': ('variable_name',),
+}
+
+# events a viewer may have queued before it gets a fresh snapshot instead
+queue_size = 32
+
+metric_viewers = metrics.gauge('proxyweb_live_viewers', 'Open live table streams', ['server', 'table'])
+
+
+def get_settings():
+    settings = dict(defaults)
+    settings.update(mdb.get_config().get('live') or {})
+    return settings
+
+
+def _encode(event, data):
+    return "event: %s\ndata: %s\n\n" % (event, json.dumps(data, default=str))
+
+
+class Poller:
+
+    def __init__(self, key, interval):
+        self.key = key
+        server, database, table = key[:3]
+        self.server = server
+        self.table = table
+        self.sql = "select * from %s.%s;" % (mdb.quote_identifier(database), mdb.quote_identifier(table))
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.running = False
+        self.columns = None
+        self.key_index = None
+        self.rows = {}        # key string -> row
+
+    def _reset_event(self):
+        return _encode('reset', {'columns': self.columns, 'rows': list(self.rows.items())})
+
+    def subscribe(self):
+        """Returns with the queue of a new viewer; the poller thread is started if it isn't running"""
+        q = queue.Queue(maxsize=queue_size)
+        with self.lock:
+            self.subscribers.add(q)
+            if self.columns is not None:
+                q.put(self._reset_event())
+            if not self.running:
+                self.running = True
+                threading.Thread(target=self.run, name="live", daemon=True).start()
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.discard(q)
+
+    def _publish(self, event):
+        # called with the lock held
+        for q in self.subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # a slow viewer skips the diffs it missed and starts over from the current state
+                while True:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        break
+                q.put_nowait(self._reset_event())
+
+    def _keyed(self, columns, rows):
+        if self.key_index is None:
+            names = key_columns.get(self.table)
+            self.key_index = [columns.index(c) for c in names] if names and set(names) <= set(columns) else []
+        keyed = {}
+        for row in rows:
+            row = list(row)
+            key = [row[i] for i in self.key_index] if self.key_index else row
+            keyed[json.dumps(key, default=str)] = row
+        if self.key_index and len(keyed) < len(rows):
+            # the key columns aren't unique after all, use the whole row from now on
+            logging.debug("live: %s: key is not unique, using whole rows", self.table)
+            self.key_index = []
+            return self._keyed(columns, rows)
+        return keyed
+
+    def poll(self):
+        column_names, rows = mdb.fetch_query(self.server, self.sql)
+        rows = self._keyed(column_names, mdb.convert_time_columns(column_names, rows))
+        with self.lock:
+            if column_names != self.columns:
+                self.columns = column_names
+                self.rows = rows
+                self._publish(self._reset_event())
+                return
+            upsert = [[key, row] for key, row in rows.items() if self.rows.get(key) != row]
+            delete = [key for key in self.rows if key not in rows]
+            self.rows = rows
+            if upsert or delete:
+                self._publish(_encode('diff', {'upsert': upsert, 'delete': delete}))
+
+    def run(self):
+        while True:
+            with _pollers_lock:
+                with self.lock:
+                    if not self.subscribers:
+                        self.running = False
+                        _pollers.pop(self.key, None)
+                        return
+            started = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                with self.lock:
+                    self._publish(_encode('failure', {'error': str(e)}))
+            time.sleep(max(self.interval - (time.monotonic() - started), 0.1))
+
+
+_pollers = {}
+_pollers_lock = threading.Lock()
+
+
+def _collect():
+    viewers = {}
+    with _pollers_lock:
+        for poller in _pollers.values():
+            key = (poller.server, poller.table)
+            viewers[key] = viewers.get(key, 0) + len(poller.subscribers)
+    metric_viewers.clear()
+    for (server, table), count in viewers.items():
+        metric_viewers.set(server, table, value=count)
+
+
+metrics.add_collector(_collect)
+
+
+def subscribe(server, database, table, interval):
+    """Returns with (poller, queue) of a new viewer of the table, sharing the poller of the same table and interval"""
+    key = (server, database, table, interval)
+    with _pollers_lock:
+        poller = _pollers.get(key)
+        if poller is None:
+            poller = _pollers[key] = Poller(key, interval)
+        return poller, poller.subscribe()
+
+
+def stream(server, database, table, interval):
+    """Generator of the text/event-stream of the table: a "reset" event with every row, then "diff" events"""
+    settings = get_settings()
+    if interval not in settings['intervals']:
+        raise mdb.ValidationError(f"Invalid interval: {interval}, use one of {settings['intervals']}")
+    if server not in mdb.get_servers():
+        raise mdb.ValidationError(f"Unknown server: {server}")
+    poller, q = subscribe(server, database, table, interval)
+
+    def events():
+        try:
+            yield "retry: %d\n\n" % (interval * 1000)
+            deadline = time.monotonic() + float(settings['max_stream_seconds'])
+            while time.monotonic() < deadline:
+                try:
+                    yield q.get(timeout=float(settings['keepalive']))
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            poller.unsubscribe(q)
+    return events()
@@ -19,12 +19,28 @@ __license__ = "GPLv3"
 
 
 import mysql.connector
+import contextvars
+import csv
+import fnmatch
+import hashlib
+import io
+import json
 import logging
 import yaml
-import subprocess
 import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from functools import lru_cache
 from datetime import datetime
 
+import metrics
+import tracing
+
 # Custom exceptions for better error handling
 class ProxyWebError(Exception):
     """Base exception for ProxyWeb"""
@@ -42,11 +58,34 @@ class ValidationError(ProxyWebError):
     """Input validation errors"""
     pass
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+# DEBUG logs every query, turn it on with global: log_level: DEBUG in the config
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+metric_config_reloads = metrics.counter('proxyweb_config_reloads_total', 'Number of times the config file was parsed')
+metric_config_load = metrics.histogram('proxyweb_config_load_seconds', 'Time spent parsing the config file')
+metric_connect = metrics.histogram('proxyweb_connect_seconds', 'Time to open a ProxySQL admin connection', ['server'])
+metric_connect_errors = metrics.counter('proxyweb_connect_errors_total', 'Failed ProxySQL admin connection attempts',
+                                        ['server'])
+metric_query = metrics.histogram('proxyweb_query_seconds', 'ProxySQL query execution time', ['server'])
+metric_query_errors = metrics.counter('proxyweb_query_errors_total', 'Failed ProxySQL queries', ['server'])
+metric_fetch = metrics.histogram('proxyweb_fetch_seconds', 'Time spent fetching ProxySQL results', ['server'])
+metric_rows = metrics.counter('proxyweb_rows_fetched_total', 'Rows fetched from ProxySQL', ['server'])
+metric_process = metrics.histogram('proxyweb_process_table_content_seconds',
+                                   'Time spent converting the timestamp columns')
+metric_pool = metrics.gauge('proxyweb_pool_connections', 'Pooled ProxySQL connections',
+                            ['server', 'kind', 'state'])
+metric_pool_events = metrics.counter('proxyweb_pool_events_total', 'Connection pool events',
+                                     ['server', 'kind', 'event'])
 
 sql_get_databases = "show databases"
 sql_show_table_content = "select * from %s.%s order by 1;"
 sql_show_tables = "show tables from %s;"
+sql_show_table_columns = "select * from %s.%s limit 0;"
+sql_count_table_rows = "select count(*), sum(case when %s then 1 else 0 end) from %s.%s;"
+sql_show_table_page = "select * from %s.%s%s order by %s %s limit %d offset %d;"
+
+# upper limit of the rows returned by one get_table_page() call
+max_page_length = 1000
 
 def validate_sql(sql):
     """Basic SQL validation to prevent dangerous operations"""
@@ -72,23 +111,126 @@ def validate_sql(sql):
     
     return sql.strip()
 
-def get_config(config="config/config.yml"):
-    logging.debug("Using file: %s" % (config))
+class _LoadedConfig:
+    """A parsed config file together with the views derived from it.
+
+    Instances are shared by every thread of the worker and must be treated as
+    read-only; a reload replaces the whole object instead of mutating it.
+    """
+
+    def __init__(self, cfg, stamp):
+        self.cfg = cfg
+        self.stamp = stamp
+        self.sections = {}     # get_section() results, filled on first use
+        self.servers = list(cfg.get('servers') or {})
+        global_cfg = cfg.get('global') or {}
+        self.read_only = {}
+        self.hide_tables = {}
+        for server, server_cfg in (cfg.get('servers') or {}).items():
+            server_cfg = server_cfg or {}
+            if 'read_only' in server_cfg:
+                self.read_only[server] = server_cfg['read_only']
+            else:
+                self.read_only[server] = global_cfg.get('read_only', False)
+            # a per-server hide_tables list replaces the global one
+            if 'hide_tables' in server_cfg:
+                self.hide_tables[server] = frozenset(server_cfg['hide_tables'] or [])
+            else:
+                self.hide_tables[server] = frozenset(global_cfg.get('hide_tables') or [])
+
+
+_config_lock = threading.Lock()
+_config_cache = {}
+config_reloads = 0
+
+
+def _config_stamp(config):
+    st = os.stat(config)
+    return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+
+def _load_config(config):
+    """Returns with the cached _LoadedConfig, parsing the file only if it changed on disk"""
+    global config_reloads
     try:
-        with open(config, 'r') as yml:
-            cfg = yaml.safe_load(yml)
-        if not cfg:
-            raise ConfigError(f"Config file {config} is empty or invalid")
-        
-        # Override with environment variables
-        _apply_env_overrides(cfg)
-        return cfg
+        stamp = _config_stamp(config)
     except FileNotFoundError:
         raise ConfigError(f"Config file not found: {config}")
-    except yaml.YAMLError as e:
-        raise ConfigError(f"YAML parsing error in {config}: {str(e)}")
-    except Exception as e:
-        raise ConfigError(f"Error reading config file {config}: {str(e)}")
+
+    loaded = _config_cache.get(config)
+    if loaded is not None and loaded.stamp == stamp:
+        return loaded
+
+    with _config_lock:
+        # another thread may have reloaded it while we were waiting
+        loaded = _config_cache.get(config)
+        if loaded is not None and loaded.stamp == stamp:
+            return loaded
+
+        logging.debug("Loading config file: %s", config)
+        started = time.perf_counter()
+        try:
+            with open(config, 'r') as yml:
+                cfg = yaml.safe_load(yml)
+            if not cfg:
+                raise ConfigError(f"Config file {config} is empty or invalid")
+
+            # Override with environment variables
+            _apply_env_overrides(cfg)
+            loaded = _LoadedConfig(cfg, stamp)
+        except ConfigError:
+            raise
+        except FileNotFoundError:
+            raise ConfigError(f"Config file not found: {config}")
+        except yaml.YAMLError as e:
+            raise ConfigError(f"YAML parsing error in {config}: {str(e)}")
+        except Exception as e:
+            raise ConfigError(f"Error reading config file {config}: {str(e)}")
+
+        _config_cache[config] = loaded
+        config_reloads += 1
+        metric_config_reloads.inc()
+        metric_config_load.observe(value=time.perf_counter() - started)
+        tracing.record('config', started, config)
+        return loaded
+
+
+def get_config(config="config/config.yml"):
+    """Returns with the parsed config, shared between threads - do not modify it"""
+    return _load_config(config).cfg
+
+
+def get_section(section, defaults, config="config/config.yml"):
+    """Returns with a section of the config merged over defaults, cached until the file changes - do not modify it.
+
+    Used by the request hooks, so a config that can't be loaded gives the defaults instead of an error,
+    otherwise the settings editor couldn't be reached to fix it.
+    """
+    try:
+        loaded = _load_config(config)
+    except ConfigError as e:
+        logging.debug("%s: using the defaults, %s", section, e)
+        return defaults
+    settings = loaded.sections.get(section)
+    if settings is None:
+        settings = dict(defaults)
+        settings.update(loaded.cfg.get(section) or {})
+        loaded.sections[section] = settings
+    return settings
+
+
+def invalidate_config(config="config/config.yml"):
+    """Drops the cached copy so the next get_config() call re-reads the file"""
+    with _config_lock:
+        _config_cache.pop(config, None)
+
+
+def get_hide_tables(server, config="config/config.yml"):
+    """Returns with the set of tables to hide for the server (per-server list or the global one)"""
+    loaded = _load_config(config)
+    if server not in loaded.hide_tables:
+        raise ConfigError(f"Server '{server}' not found in configuration")
+    return loaded.hide_tables[server]
 
 def _apply_env_overrides(cfg):
     """Apply environment variable overrides to configuration"""
@@ -113,203 +255,1001 @@ def _apply_env_overrides(cfg):
         cfg['flask']['SECRET_KEY'] = os.environ['SECRET_KEY']
 
 
-def db_connect(db, server, autocommit=False, buffered=False, dictionary=True):
-    try:
-        db['cnf'] = get_config()
-        
-        if server not in db['cnf']['servers']:
-            raise DatabaseError(f"Server '{server}' not found in configuration")
-        
-        if 'dsn' not in db['cnf']['servers'][server] or not db['cnf']['servers'][server]['dsn']:
-            raise DatabaseError(f"No DSN configuration found for server '{server}'")
-
-        config = db['cnf']['servers'][server]['dsn'][0]
-        logging.debug(db['cnf']['servers'][server]['dsn'][0])
-        
-        db['cnf']['servers'][server]['conn'] = mysql.connector.connect(
-            **config, raise_on_warnings=True, get_warnings=True, connection_timeout=3
-        )
-
-        if db['cnf']['servers'][server]['conn'].is_connected():
-            logging.debug("Connected successfully to %s as %s db=%s" % (
-                config['host'], config['user'], config['db']))
-
-        db['cnf']['servers'][server]['conn'].autocommit = autocommit
-        db['cnf']['servers'][server]['conn'].get_warnings = True
-
-        db['cnf']['servers'][server]['cur'] = db['cnf']['servers'][server]['conn'].cursor(
-            buffered=buffered, dictionary=dictionary)
-        logging.debug("buffered: %s, dictionary: %s, autocommit: %s" % (buffered, dictionary, autocommit))
+# defaults for the per-server connection pools, can be overridden under global: pool: in the config
+pool_defaults = {
+    'size': 4,                # max connections per server (idle + in use)
+    'checkout_timeout': 5,    # seconds to wait for a free connection
+    'idle_timeout': 60,       # close connections idle for longer than this
+    'max_lifetime': 600,      # recycle connections older than this
+    'ping_after': 1,          # ping connections idle for longer than this before handing them out
+}
+
+# connection settings of the two kinds of pools. Reads keep the original behaviour; writes run
+# with autocommit on like the mysql client they replace (execute_changes() never commits), and
+# don't ask for warnings after every statement, as ProxySQL's admin module is not a MySQL server.
+# mysql.connector always sends its autocommit setting on connect, there is no "server default".
+pool_connect_options = {
+    'read': {'raise_on_warnings': True, 'get_warnings': True, 'autocommit': False},
+    'write': {'raise_on_warnings': False, 'get_warnings': False, 'autocommit': True},
+}
+
+
+class _PooledConnection:
+    __slots__ = ('conn', 'created', 'last_used')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created = self.last_used = time.monotonic()
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of ProxySQL admin connections for one server"""
+
+    def __init__(self, server, dsn, kind='read', size=4, checkout_timeout=5, idle_timeout=60, max_lifetime=600,
+                 ping_after=1):
+        self.server = server
+        self.dsn = dict(dsn)
+        self.kind = kind
+        self.size = int(size)
+        self.checkout_timeout = float(checkout_timeout)
+        self.idle_timeout = float(idle_timeout)
+        self.max_lifetime = float(max_lifetime)
+        self.ping_after = float(ping_after)
+        self.closed = False
+        self.settings = None
+
+        self._cond = threading.Condition()
+        self._idle = []      # LIFO, the most recently used connection is the likeliest to be alive
+        self._in_use = {}    # id(conn) -> _PooledConnection
+        self._connecting = 0
+        self._stats = {'created': 0, 'reused': 0, 'closed': 0, 'evicted_idle': 0,
+                       'evicted_lifetime': 0, 'failed_ping': 0, 'waits': 0, 'timeouts': 0}
+
+    def _connect(self):
+        logging.debug("pool %s/%s: new connection to %s:%s", self.server, self.kind, self.dsn.get('host'),
+                      self.dsn.get('port'))
+        options = pool_connect_options[self.kind]
+        started = time.perf_counter()
+        try:
+            conn = mysql.connector.connect(
+                **self.dsn, raise_on_warnings=options['raise_on_warnings'], get_warnings=options['get_warnings'],
+                autocommit=options['autocommit'], connection_timeout=3
+            )
+        except Exception:
+            metric_connect_errors.inc(self.server)
+            raise
+        finally:
+            metric_connect.observe(self.server, value=time.perf_counter() - started)
+            tracing.record('connect', started, self.server)
+        conn.get_warnings = options['get_warnings']
+        return conn
+
+    def _discard(self, pooled):
+        self._stats['closed'] += 1
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    def _evict_idle(self, now):
+        keep = []
+        for pooled in self._idle:
+            if now - pooled.last_used > self.idle_timeout:
+                self._stats['evicted_idle'] += 1
+                self._discard(pooled)
+            elif now - pooled.created > self.max_lifetime:
+                self._stats['evicted_lifetime'] += 1
+                self._discard(pooled)
+            else:
+                keep.append(pooled)
+        self._idle = keep
+
+    def _healthy(self, pooled, now):
+        if now - pooled.last_used < self.ping_after:
+            return True
+        try:
+            pooled.conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        """Returns with a live connection, waits up to checkout_timeout if the pool is exhausted"""
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._cond:
+            while True:
+                if self.closed:
+                    raise DatabaseError(f"Connection pool for server '{self.server}' is closed")
+                now = time.monotonic()
+                self._evict_idle(now)
+                if self._idle:
+                    pooled = self._idle.pop()
+                    self._in_use[id(pooled.conn)] = pooled
+                    break
+                if len(self._in_use) + len(self._idle) + self._connecting < self.size:
+                    # hold the slot while connecting outside of the lock
+                    pooled = None
+                    self._connecting += 1
+                    break
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise DatabaseError(f"Timed out waiting for a free connection to server '{self.server}'")
+                self._stats['waits'] += 1
+                self._cond.wait(remaining)
+
+        if pooled is not None:
+            # ping outside of the lock, it is a network round trip
+            healthy = self._healthy(pooled, now)
+            with self._cond:
+                if healthy:
+                    self._stats['reused'] += 1
+                    return pooled.conn
+                self._stats['failed_ping'] += 1
+                del self._in_use[id(pooled.conn)]
+                self._discard(pooled)
+                self._connecting += 1
+
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._connecting -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._connecting -= 1
+            self._in_use[id(conn)] = _PooledConnection(conn)
+            self._stats['created'] += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        """Hands a connection back; broken or expired ones are closed instead of reused"""
+        with self._cond:
+            pooled = self._in_use.pop(id(conn), None)
+            if pooled is None:
+                return
+            now = time.monotonic()
+            if not discard and getattr(conn, 'unread_result', False):
+                discard = True
+            if discard or self.closed or now - pooled.created > self.max_lifetime:
+                self._discard(pooled)
+            else:
+                pooled.last_used = now
+                self._idle.append(pooled)
+            self._cond.notify()
+
+    def close(self):
+        """Closes the idle connections; the ones in use are closed when released"""
+        with self._cond:
+            self.closed = True
+            for pooled in self._idle:
+                self._discard(pooled)
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['in_use'] = len(self._in_use) + self._connecting
+            stats['idle'] = len(self._idle)
+            return stats
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(server, kind='read'):
+    """Returns with the read or write pool of the server, (re)creating it if its DSN or pool settings changed"""
+    cnf = get_config()
+    if server not in cnf['servers']:
+        raise DatabaseError(f"Server '{server}' not found in configuration")
+    if 'dsn' not in cnf['servers'][server] or not cnf['servers'][server]['dsn']:
+        raise DatabaseError(f"No DSN configuration found for server '{server}'")
 
+    dsn = cnf['servers'][server]['dsn'][0]
+    settings = dict(pool_defaults)
+    settings.update((cnf.get('global') or {}).get('pool') or {})
+
+    key = (server, kind)
+    pool = _pools.get(key)
+    if pool is not None and pool.dsn == dsn and pool.settings == settings and not pool.closed:
+        return pool
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.dsn != dsn or pool.settings != settings or pool.closed:
+            if pool is not None:
+                pool.close()
+            try:
+                pool = ConnectionPool(server, dsn, kind=kind, **settings)
+            except (TypeError, ValueError) as e:
+                raise ConfigError(f"Invalid pool settings: {str(e)}")
+            pool.settings = settings
+            _pools[key] = pool
+        return pool
+
+
+def pool_stats():
+    """Returns with the stats of every pool as {server: {kind: stats}}"""
+    stats = {}
+    for (server, kind), pool in list(_pools.items()):
+        stats.setdefault(server, {})[kind] = pool.stats()
+    return stats
+
+
+def _collect_pool_metrics():
+    for (server, kind), pool in list(_pools.items()):
+        stats = pool.stats()
+        metric_pool.set(server, kind, 'in_use', value=stats['in_use'])
+        metric_pool.set(server, kind, 'idle', value=stats['idle'])
+        metric_pool.set(server, kind, 'max', value=stats['size'])
+        for event in ('created', 'reused', 'closed', 'waits', 'timeouts', 'failed_ping'):
+            metric_pool_events.set(server, kind, event, value=stats[event])
+
+
+metrics.add_collector(_collect_pool_metrics)
+
+
+class _InstrumentedCursor:
+    """Cursor wrapper timing execute/fetch and counting errors and rows per server"""
+    __slots__ = ('_cur', '_server')
+
+    def __init__(self, cur, server):
+        self._cur = cur
+        self._server = server
+
+    def execute(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cur.execute(*args, **kwargs)
+        except Exception:
+            metric_query_errors.inc(self._server)
+            raise
+        finally:
+            metric_query.observe(self._server, value=time.perf_counter() - started)
+            tracing.record('query', started, str(args[0])[:200] if args else None)
+
+    def _fetch(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        except Exception:
+            metric_query_errors.inc(self._server)
+            raise
+        finally:
+            metric_fetch.observe(self._server, value=time.perf_counter() - started)
+            tracing.record('fetch', started, self._server)
+
+    def fetchall(self):
+        rows = self._fetch(self._cur.fetchall)
+        metric_rows.inc(self._server, amount=len(rows))
+        return rows
+
+    def fetchmany(self, size=1):
+        rows = self._fetch(self._cur.fetchmany, size)
+        metric_rows.inc(self._server, amount=len(rows))
+        return rows
+
+    def fetchone(self):
+        row = self._fetch(self._cur.fetchone)
+        if row is not None:
+            metric_rows.inc(self._server)
+        return row
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+@contextmanager
+def pooled_cursor(server, buffered=False, dictionary=True, kind='read'):
+    """Borrows a connection from the server's pool and yields a cursor on it.
+
+    The connection goes back to the pool when the block exits; if the block
+    raised, the connection is closed instead as its state is unknown.
+    """
+    pool = get_pool(server, kind)
+    started = time.perf_counter()
+    try:
+        conn = pool.acquire()
     except mysql.connector.Error as e:
         raise DatabaseError(f"MySQL connection error for server '{server}': {str(e)}")
-    except KeyError as e:
-        raise ConfigError(f"Missing configuration key for server '{server}': {str(e)}")
+    finally:
+        tracing.record('pool', started, server)
+    failed = True
+    try:
+        cur = conn.cursor(buffered=buffered, dictionary=dictionary)
+        try:
+            yield _InstrumentedCursor(cur, server)
+        finally:
+            try:
+                cur.close()
+            except Exception:
+                pass
+        failed = False
+    finally:
+        pool.release(conn, discard=failed)
 
 
-def get_all_dbs_and_tables(db, server):
-    all_dbs = {server: {}}
-    try:
+# seconds a server's database/table list is kept, can be overridden with global: catalog_ttl: in the config
+catalog_ttl_default = 300
 
-        db_connect(db, server=server)
-        db['cnf']['servers'][server]['cur'].execute(sql_get_databases)
-        table_exception_list = []
+catalog_cache = {}
+_catalog_lock = threading.Lock()
 
-        if 'hide_tables' not in db['cnf']['servers'][server]:
-            #it there is a global hide_tables defined and there is no local one:
-            if len(db['cnf']['global']['hide_tables']) > 0:
-                table_exception_list = db['cnf']['global']['hide_tables']
-        else:
-                table_exception_list = db['cnf']['servers'][server]['hide_tables']
 
-        for i in db['cnf']['servers'][server]['cur'].fetchall():
+class _Catalog:
+    __slots__ = ('tables', 'expires', 'hidden', 'visible')
 
-            all_dbs[server][i['name']] = []
+    def __init__(self, tables, expires):
+        self.tables = tables      # {database: [table, ...]} as reported by the server
+        self.expires = expires
+        self.hidden = None        # the hide_tables set 'visible' was filtered with
+        self.visible = None
 
-            db['cnf']['servers'][server]['cur'].execute(sql_show_tables % i['name'])
-            for table in db['cnf']['servers'][server]['cur'].fetchall():
-                # hide tables as per global or per server config
-                if table['tables'] not in table_exception_list:
-                    all_dbs[server][i['name']].append(table['tables'])
-        db['cnf']['servers'][server]['cur'].close()
-        return all_dbs
-    except (mysql.connector.Error, mysql.connector.Warning) as e:
-        raise DatabaseError(f"Database error: {str(e)}")
-    finally:
+
+def catalog_union_sql(databases):
+    # this is what "show tables from X" is rewritten to by ProxySQL, for all databases at once
+    return " union all ".join(
+        "select '%s', name from %s.sqlite_master where type='table' and name != 'sqlite_sequence'"
+        % (database, quote_identifier(database)) for database in databases) + " order by 1, 2;"
+
+
+def _fetch_catalog(server):
+    """Reads every database and table of the server in two round trips"""
+    with pooled_cursor(server, dictionary=False) as cur:
+        cur.execute(sql_get_databases)
+        name = [i[0] for i in cur.description].index('name')
+        databases = [row[name] for row in cur.fetchall()]
+        tables = {database: [] for database in databases}
+        if not databases:
+            return tables
         try:
-            if 'cur' in db['cnf']['servers'][server]:
-                db['cnf']['servers'][server]['cur'].close()
-        except:
-            pass
+            cur.execute(catalog_union_sql(databases))
+            rows = cur.fetchall()
+        except (mysql.connector.Error, mysql.connector.Warning, ValidationError) as e:
+            logging.debug("catalog union query failed, falling back to show tables: %s", e)
+            rows = []
+            for database in databases:
+                cur.execute(sql_show_tables % database)
+                rows.extend((database, row[0]) for row in cur.fetchall())
+    for database, table in rows:
+        tables[database].append(table)
+    return tables
 
 
-def get_table_content(db, server, database, table):
-    '''returns with a dict with two keys "column_names" = list and  rows = tuples '''
-    content = {}
+def store_catalog(server, tables):
+    ttl = (get_config().get('global') or {}).get('catalog_ttl', catalog_ttl_default)
+    catalog = _Catalog(tables, time.monotonic() + float(ttl))
+    catalog_cache[server] = catalog
+    return catalog
+
+
+def _cached_catalog(server, refresh=False):
+    """Returns with the _Catalog of the server, reading it if it's missing, stale or refresh is set"""
+    if _prefetched((server, 'catalog')):
+        # asgi.py has (re)read it for this request already
+        refresh = False
+    now = time.monotonic()
+    catalog = catalog_cache.get(server)
+    if refresh or catalog is None or catalog.expires < now:
+        with _catalog_lock:
+            catalog = catalog_cache.get(server)
+            if refresh or catalog is None or catalog.expires < now:
+                try:
+                    tables = _fetch_catalog(server)
+                except (mysql.connector.Error, mysql.connector.Warning) as e:
+                    raise DatabaseError(f"Database error: {str(e)}")
+                catalog = store_catalog(server, tables)
+    return catalog
+
+
+def get_catalog(server, refresh=False):
+    """Returns with {database: [tables]} of the server with the hidden tables removed.
+
+    The list is shared by every user and kept for catalog_ttl seconds; refresh=True re-reads it.
+    """
+    hidden = get_hide_tables(server)
+    catalog = _cached_catalog(server, refresh)
+    if catalog.hidden is not hidden:
+        # hide tables as per global or per server config
+        catalog.visible = {database: [t for t in tables if t not in hidden]
+                           for database, tables in catalog.tables.items()}
+        catalog.hidden = hidden
+    return catalog.visible
+
+
+def get_full_catalog(server, refresh=False):
+    """get_catalog() without hiding anything, for the checks that have to see every table - do not modify it"""
+    return _cached_catalog(server, refresh).tables
+
+
+def quote_identifier(name):
+    """Quotes a database/table/column name, rejecting anything that is not a plain identifier"""
+    if not name or not re.match(r'^[A-Za-z0-9_]+$', str(name)):
+        raise ValidationError(f"Invalid identifier: {name}")
+    return "`%s`" % name
+
+
+def quote_column(name):
+    """Quotes a column name reported by the server"""
+    return "`%s`" % str(name).replace('`', '``')
+
+
+def _quote_like(value):
+    """Returns with a LIKE '%value%' expression body; ProxySQL's admin is SQLite so only '' escaping applies"""
+    value = str(value).replace('!', '!!').replace('%', '!%').replace('_', '!_').replace("'", "''")
+    return "'%%%s%%' escape '!'" % value
+
+
+class _CacheEntry:
+    __slots__ = ('value', '_etag', 'expires')
+
+    def __init__(self, value, expires):
+        self.value = value
+        self._etag = None
+        self.expires = expires
+
+    @property
+    def etag(self):
+        # hashing a whole result is not free, only the responses answering conditional requests need it
+        if self._etag is None:
+            self._etag = content_etag(self.value)
+        return self._etag
+
+
+def content_etag(value):
+    """A strong ETag (without the quotes) made of the hash of the JSON encoded value"""
+    return hashlib.sha1(json.dumps(value, default=str, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Bounded LRU cache of query results with a TTL per entry. Keys are tuples starting with the server name"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns with the entry if it's still fresh, None otherwise"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, value, ttl):
+        entry = _CacheEntry(value, time.monotonic() + ttl)
+        if ttl > 0:
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, server=None):
+        """Drops every entry of the server (or all of them)"""
+        with self._lock:
+            if server is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0] == server]:
+                    del self._entries[key]
+
+
+result_cache = ResultCache()
+
+# defaults of the cache: section of the config. ttls maps table name patterns (fnmatch) to seconds,
+# sql_ttl applies to adhoc SELECTs, 0 disables caching.
+cache_defaults = {'max_entries': 256, 'default_ttl': 0, 'sql_ttl': 0, 'ttls': {}}
+
+
+def cache_settings():
+    settings = dict(cache_defaults)
+    settings.update(get_config().get('cache') or {})
+    result_cache.max_entries = int(settings['max_entries'])
+    return settings
+
+
+def cache_ttl(table):
+    """Seconds the results of the table are cached for: the first matching pattern of cache: ttls: wins"""
+    settings = cache_settings()
+    for pattern, ttl in (settings['ttls'] or {}).items():
+        if fnmatch.fnmatchcase(table, pattern):
+            return float(ttl)
+    return float(settings['default_ttl'])
+
+
+def normalize_sql(sql):
+    """Whitespace-insensitive form of a query used as a cache key; the literals are left alone"""
+    return ' '.join(sql.split()).rstrip(';').strip()
+
+
+# results fetched ahead of the view by the async front end (asgi.py), {key: cache entry or exception}.
+# Set per request, the views find them instead of querying ProxySQL with the blocking driver.
+prefetched = contextvars.ContextVar('prefetched', default=None)
+
+
+def _prefetched(key):
+    found = prefetched.get()
+    if found is None:
+        return None
+    value = found.get(key)
+    if isinstance(value, Exception):
+        raise value
+    return value
+
+
+def cached_result(key, ttl, func, *args):
+    """Returns with the fresh cache entry of key, or calls func(*args) and caches its result for ttl seconds"""
+    entry = _prefetched(key)
+    if entry is not None:
+        return entry
+    entry = result_cache.get(key) if ttl > 0 else None
+    if entry is None:
+        entry = result_cache.put(key, func(*args), ttl)
+    return entry
+
+
+def get_table_page_cached(db, server, database, table, **paging):
+    """get_table_page() + process_table_content() through the result cache, returns with the cache entry"""
+    def fetch():
+        return process_table_content(table, get_table_page(db, server, database, table, **paging))
+    return cached_result(table_page_key(server, database, table, paging), cache_ttl(table), fetch)
+
+
+def table_page_key(server, database, table, paging):
+    return (server, 'page', database, table) + tuple(sorted(paging.items()))
+
+
+def execute_adhoc_query_cached(db, server, sql):
+    """execute_adhoc_query() through the result cache (cache: sql_ttl), returns with the cache entry"""
+    sql = validate_sql(sql)
+    key = (server, 'sql', normalize_sql(sql))
+    return cached_result(key, float(cache_settings()['sql_ttl']), execute_adhoc_query, db, server, sql)
+
+
+def _fetch_table_columns(server, database, table):
+    try:
+        string = sql_show_table_columns % (quote_identifier(database), quote_identifier(table))
+        logging.debug("query: %s", string)
+        with pooled_cursor(server, dictionary=False) as cur:
+            cur.execute(string)
+            cur.fetchall()
+            return [i[0] for i in cur.description]
+    except (mysql.connector.Error, mysql.connector.Warning) as e:
+        raise DatabaseError(f"Database error getting table columns: {str(e)}")
+
+
+def get_table_columns(db, server, database, table):
+    """returns with the column names of the table without reading its rows, cached like the table list"""
+    ttl = float((get_config().get('global') or {}).get('catalog_ttl', catalog_ttl_default))
+    return cached_result((server, 'columns', database, table), ttl, _fetch_table_columns, server, database, table).value
+
+
+def table_page_sql(database, table, column_names, start, length, order_column, order_dir, search):
+    """Returns with the (count, page) queries of get_table_page()"""
     try:
-        logging.debug("server: {} - db: {} - table:{}".format(server, database, table))
-        db_connect(db, server=server, dictionary=False)
-        data = (database, table)
+        start = max(int(start), 0)
+        length = int(length)
+        if length < 0 or length > max_page_length:
+            length = max_page_length
+        order_column = int(order_column)
+    except (TypeError, ValueError):
+        raise ValidationError("Invalid paging parameters")
+    order_dir = 'desc' if str(order_dir).lower() == 'desc' else 'asc'
+
+    database_q = quote_identifier(database)
+    table_q = quote_identifier(table)
+    if not 0 <= order_column < len(column_names):
+        order_column = 0
+
+    search = (search or '').strip()
+    if search:
+        like = _quote_like(search)
+        condition = " or ".join("%s like %s" % (quote_column(c), like) for c in column_names)
+    else:
+        condition = "1"
+    where = " where %s" % condition if search else ""
+    return (sql_count_table_rows % (condition, database_q, table_q),
+            sql_show_table_page % (database_q, table_q, where, quote_column(column_names[order_column]),
+                                   order_dir, length, start))
+
 
-        string = (sql_show_table_content % data)
-        logging.debug("query: {}".format(string))
+def get_table_page(db, server, database, table, start=0, length=25, order_column=0, order_dir='asc', search=''):
+    '''returns with one page of the table: a dict with "column_names", "rows", "records_total" and "records_filtered"
 
-        db['cnf']['servers'][server]['cur'].execute(string)
+    start/length are the offset and the page size, order_column is an index into the column list and
+    search is matched against every column with LIKE. Follows the DataTables server-side semantics.
+    '''
+    content = {}
+    column_names = get_table_columns(db, server, database, table)
+    sql_count, sql_page = table_page_sql(database, table, column_names, start, length, order_column, order_dir,
+                                         search)
+    try:
+        with pooled_cursor(server, dictionary=False) as cur:
+            logging.debug("query: %s", sql_count)
+            cur.execute(sql_count)
+            total, filtered = cur.fetchone()
 
-        content['rows'] = db['cnf']['servers'][server]['cur'].fetchall()
-        content['column_names'] = [i[0] for i in db['cnf']['servers'][server]['cur'].description]
-        content['misc'] = get_config()['misc']
+            logging.debug("query: %s", sql_page)
+            cur.execute(sql_page)
+            content['rows'] = cur.fetchall()
+        content['column_names'] = column_names
+        content['records_total'] = int(total or 0)
+        content['records_filtered'] = int(filtered or 0)
         return content
     except (mysql.connector.Error, mysql.connector.Warning) as e:
-        raise DatabaseError(f"Database error getting table content: {str(e)}")
-    finally:
+        raise DatabaseError(f"Database error getting table page: {str(e)}")
+
+
+# columns holding epoch timestamps and their unit, extended/overridden by global: time_columns: in the config
+time_columns_default = {
+    'first_seen': 's',
+    'last_seen': 's',
+    'time_start_us': 'us',
+    'success_time_us': 'us'
+}
+time_units = {'s': 1, 'ms': 1_000, 'us': 1_000_000}
+
+
+@lru_cache(maxsize=65536)
+def _format_epoch(seconds):
+    # many rows share the same second (last_seen of a busy digest table), format each one once
+    return datetime.utcfromtimestamp(seconds).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _convert_time_column(values, divisor):
+    converted = []
+    append = converted.append
+    for value in values:
         try:
-            if 'conn' in db['cnf']['servers'][server]:
-                db['cnf']['servers'][server]['conn'].close()
-        except:
-            pass
+            append(_format_epoch(int(value) // divisor))
+        except (ValueError, TypeError, OverflowError, OSError):
+            # Leave the value as is if it's invalid
+            append(value)
+    return converted
+
+
+def get_time_columns():
+    time_columns = dict(time_columns_default)
+    time_columns.update((get_config().get('global') or {}).get('time_columns') or {})
+    return time_columns
+
+
+def _time_column_divisors(column_names):
+    """Returns with [(column index, divisor to seconds)] of the timestamp columns"""
+    time_columns = get_time_columns()
+    divisors = []
+    for idx, name in enumerate(column_names):
+        unit = time_columns.get(name)
+        if unit is not None:
+            if unit not in time_units:
+                raise ConfigError(f"Unknown time unit '{unit}' for column '{name}', use one of {', '.join(time_units)}")
+            divisors.append((idx, time_units[unit]))
+    return divisors
+
+
+def convert_time_columns(column_names, rows, divisors=None):
+    """Converts the timestamp columns of rows to UTC datetime strings, a whole column at a time"""
+    if divisors is None:
+        divisors = _time_column_divisors(column_names)
+    if not divisors or not rows:
+        return rows
+    columns = list(zip(*rows))
+    for idx, divisor in divisors:
+        columns[idx] = _convert_time_column(columns[idx], divisor)
+    return list(zip(*columns))
+
 
 def process_table_content(table, content):
     """
     Processes content rows by converting time-based fields to UTC datetime strings.
     """
-    # Define time-based fields and their units
-    time_fields = {
-        'first_seen': 's',
-        'last_seen': 's',
-        'time_start_us': 'us',
-        'success_time_us': 'us'
-    }
-
-    # Get indices for the target columns
-    col_names = content.get('column_names', [])
-    field_indices = {field: idx for field, unit in time_fields.items() if field in col_names for idx, name in enumerate(col_names) if name == field}
-
-    if field_indices:
-        new_rows = []
-        for row in content.get('rows', []):
-            row = list(row)  # Convert tuple to list for mutation
-            for field, idx in field_indices.items():
-                try:
-                    value = int(row[idx])
-                    if time_fields[field] == 'us':
-                        # Convert microseconds to seconds
-                        value /= 1_000_000
-                    row[idx] = datetime.utcfromtimestamp(value).strftime('%Y-%m-%d %H:%M:%S')
-                except (ValueError, TypeError, OverflowError):
-                    # Leave the value as is if it's invalid
-                    pass
-            new_rows.append(tuple(row))  # Convert back to tuple
-        content['rows'] = new_rows
-
+    started = time.perf_counter()
+    with metric_process.time():
+        content['rows'] = convert_time_columns(content.get('column_names', []), content.get('rows', []))
+    tracing.record('process', started, table)
     return content
 
+
 def execute_adhoc_query(db, server, sql):
     '''returns with a dict with two keys "column_names" = list and  rows = tuples '''
     content = {}
     try:
         sql = validate_sql(sql)
-        logging.debug("server: {} - sql: {}".format(server, sql))
-        db_connect(db, server=server, dictionary=False)
+        logging.debug("server: %s - sql: %s", server, sql)
 
-        logging.debug("query: {}".format(sql))
+        with pooled_cursor(server, dictionary=False) as cur:
+            cur.execute(sql)
 
-        db['cnf']['servers'][server]['cur'].execute(sql)
-
-        content['rows'] = db['cnf']['servers'][server]['cur'].fetchall()
-        content['column_names'] = [i[0] for i in db['cnf']['servers'][server]['cur'].description]
+            content['rows'] = cur.fetchall()
+            content['column_names'] = [i[0] for i in cur.description]
 
         return content
     except (mysql.connector.Error, mysql.connector.Warning) as e:
         raise DatabaseError(f"Database error executing query: {str(e)}")
     except ValidationError:
         raise
-    finally:
+
+
+# rows fetched from the server per round trip when streaming
+stream_chunk_size = 1000
+export_formats = ('csv', 'ndjson')
+
+
+def stream_query(server, sql, chunk_size=stream_chunk_size):
+    """Generator running sql on an unbuffered pooled cursor: yields the column names first, then lists of rows.
+    The connection is held until the generator is exhausted or closed."""
+    try:
+        with pooled_cursor(server, buffered=False, dictionary=False) as cur:
+            cur.execute(sql)
+            yield [i[0] for i in cur.description]
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+    except (mysql.connector.Error, mysql.connector.Warning) as e:
+        raise DatabaseError(f"Database error streaming query: {str(e)}")
+
+
+def _encode_csv(column_names, chunks):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(column_names)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buf.getvalue().encode('utf-8')
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue().encode('utf-8')
+
+
+def _encode_ndjson(column_names, chunks):
+    for rows in chunks:
+        yield ''.join(json.dumps(dict(zip(column_names, row)), default=str) + '\n' for row in rows).encode('utf-8')
+
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31: gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_query(server, sql, fmt, compress=False):
+    '''returns with a generator of the encoded (csv or ndjson, optionally gzipped) result of sql.
+    Rows are streamed from the server chunk by chunk and the timestamp columns are converted like
+    process_table_content() does, so memory use doesn't depend on the size of the result.'''
+    if fmt not in export_formats:
+        raise ValidationError(f"Unknown export format: {fmt}")
+    stream = stream_query(server, sql)
+    try:
+        # run the query now so that errors are raised before the response starts
+        column_names = next(stream)
+        divisors = _time_column_divisors(column_names)
+    except BaseException:
+        stream.close()
+        raise
+    chunks = (convert_time_columns(column_names, rows, divisors) for rows in stream)
+    encoded = _encode_csv(column_names, chunks) if fmt == 'csv' else _encode_ndjson(column_names, chunks)
+    if compress:
+        encoded = _gzip_stream(encoded)
+
+    def generate():
         try:
-            if 'conn' in db['cnf']['servers'][server]:
-                db['cnf']['servers'][server]['conn'].close()
-        except:
-            pass
+            yield from encoded
+        finally:
+            # hands the connection back even if the client went away mid-stream
+            stream.close()
+    return generate()
 
-def execute_adhoc_report(db, server):
-    '''returns with a dict with two keys "column_names" = list and  rows = tuples '''
-    adhoc_results = []
-    result = {}
+
+def export_table(db, server, database, table, fmt, compress=False):
+    """export_query() of the whole table"""
+    sql = sql_show_table_content % (quote_identifier(database), quote_identifier(table))
+    return export_query(server, sql, fmt, compress)
+
+
+# how many adhoc report queries run at once and how long one may take, overridable under global: in the config
+adhoc_concurrency_default = 4
+adhoc_timeout_default = 10
+
+# the same for queries fanned out to several servers: fanout_concurrency / fanout_timeout
+fanout_concurrency_default = 8
+fanout_timeout_default = 5
+
+
+def run_concurrently(func, args_list, concurrency, timeout, name="worker"):
+    """Calls func(*args) for every item of args_list in a thread pool.
+
+    Returns with a list of (result, error, elapsed) tuples in the order of args_list. A call that raises
+    gets the exception text as error, one running for longer than timeout seconds gets a timeout error
+    and is abandoned: its thread finishes in the background.
+    """
+    if not args_list:
+        return []
+    started = [None] * len(args_list)
+
+    def call(i):
+        started[i] = time.monotonic()
+        with tracing.thread():
+            return func(*args_list[i])
+
+    executor = ThreadPoolExecutor(max_workers=max(min(concurrency, len(args_list)), 1), thread_name_prefix=name)
     try:
-        db_connect(db, server=server, dictionary=False)
-
-        config = get_config()
-        if 'adhoc_report' in config['misc']:
-            for item in config['misc']['adhoc_report']:
-                logging.debug("query: {}".format(item))
-                db['cnf']['servers'][server]['cur'].execute(item['sql'])
-
-                result['rows'] = db['cnf']['servers'][server]['cur'].fetchall()
-                result['title'] = item['title']
-                result['sql'] = item['sql']
-                result['info'] = item['info']
-                result['column_names'] = [i[0] for i in db['cnf']['servers'][server]['cur'].description]
-                adhoc_results.append(result.copy())
-        else:
-            pass
+        # each call runs in a copy of the caller's context, its spans go to the trace of the request
+        futures = [executor.submit(contextvars.copy_context().run, call, i) for i in range(len(args_list))]
+        results = [None] * len(args_list)
+        pending = set(range(len(args_list)))
+        while pending:
+            # wait for the first completion or for the earliest running call to hit its timeout
+            now = time.monotonic()
+            deadlines = [started[i] + timeout for i in pending if started[i] is not None]
+            wait_for = max(min(deadlines) - now, 0) if deadlines else timeout
+            wait([futures[i] for i in pending], timeout=min(wait_for, 0.5), return_when=FIRST_COMPLETED)
 
-        return adhoc_results
-    except (mysql.connector.Error, mysql.connector.Warning) as e:
-        raise DatabaseError(f"Database error executing report: {str(e)}")
+            now = time.monotonic()
+            for i in list(pending):
+                if futures[i].done():
+                    elapsed = now - started[i]
+                    try:
+                        results[i] = (futures[i].result(), None, elapsed)
+                    except Exception as e:
+                        results[i] = (None, str(e), elapsed)
+                    pending.discard(i)
+                elif started[i] is not None and now - started[i] >= timeout:
+                    results[i] = (None, f"Timed out after {timeout:g} seconds", now - started[i])
+                    pending.discard(i)
+        return results
     finally:
-        try:
-            if 'conn' in db['cnf']['servers'][server]:
-                db['cnf']['servers'][server]['conn'].close()
-        except:
-            pass
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def fetch_query(server, sql):
+    """Runs a query on a pooled connection, returns with (column_names, rows)"""
+    try:
+        with pooled_cursor(server, dictionary=False) as cur:
+            cur.execute(sql)
+            rows = cur.fetchall()
+            return [i[0] for i in cur.description], rows
+    except (mysql.connector.Error, mysql.connector.Warning) as e:
+        raise DatabaseError(str(e))
+
+
+def execute_adhoc_report(db, server):
+    '''returns with a list of dicts, one per adhoc_report item: "title", "sql", "info", "column_names",
+    "rows" = tuples, "row_count", "elapsed" (seconds) and "error" (None if the query succeeded).
+
+    The queries run in parallel, each on its own pooled connection. A query that fails or runs longer
+    than adhoc_timeout seconds only sets the "error" of its own item.
+    '''
+    adhoc_results = _prefetched((server, 'adhoc_report'))
+    if adhoc_results is not None:
+        return adhoc_results
+    items, concurrency, timeout = adhoc_settings()
+    outcomes = run_concurrently(fetch_query, [(server, item.get('sql', '')) for item in items],
+                                concurrency, timeout, name="adhoc")
+    return [adhoc_result(item, *outcome) for item, outcome in zip(items, outcomes)]
+
+
+def adhoc_settings():
+    """Returns with (adhoc_report items, adhoc_concurrency, adhoc_timeout)"""
+    config = get_config()
+    global_cfg = config.get('global') or {}
+    return (config['misc'].get('adhoc_report') or [],
+            int(global_cfg.get('adhoc_concurrency', adhoc_concurrency_default)),
+            float(global_cfg.get('adhoc_timeout', adhoc_timeout_default)))
+
+
+def adhoc_result(item, fetched, error, elapsed):
+    column_names, rows = fetched if fetched else ([], [])
+    return {'title': item.get('title', ''), 'sql': item.get('sql', ''), 'info': item.get('info', ''),
+            'column_names': column_names, 'rows': rows, 'row_count': len(rows), 'elapsed': elapsed, 'error': error}
+
+
+def validate_read_only_sql(sql):
+    """validate_sql() plus: only SELECT/SHOW statements, one at a time, that don't write files"""
+    sql = validate_sql(sql).rstrip(';').strip()
+    if not re.match(r'^(SELECT|SHOW)\b', sql, re.I):
+        raise ValidationError("Only SELECT and SHOW queries can be run on several servers")
+    if len(split_statements(sql)) != 1:
+        raise ValidationError("Only a single statement can be run on several servers")
+    if re.search(r'\bINTO\s+OUTFILE\b', sql, re.I):
+        raise ValidationError("INTO OUTFILE is not allowed here")
+    return sql
+
+
+def _merge_fanout(servers, outcomes):
+    """Merges per-server (column_names, rows) into one table with a trailing "server" column.
+    Columns are matched by name, a column missing on a server is filled with None."""
+    column_names = []
+    for fetched, error, elapsed in outcomes:
+        if fetched:
+            column_names.extend(c for c in fetched[0] if c not in column_names)
+    rows = []
+    statuses = []
+    for server, (fetched, error, elapsed) in zip(servers, outcomes):
+        row_count = 0
+        if fetched:
+            positions = [fetched[0].index(c) if c in fetched[0] else None for c in column_names]
+            for row in fetched[1]:
+                rows.append(tuple(None if p is None else row[p] for p in positions) + (server,))
+            row_count = len(fetched[1])
+        statuses.append({'server': server, 'row_count': row_count, 'elapsed': elapsed, 'error': error})
+    return {'column_names': column_names + ['server'], 'rows': rows, 'servers': statuses}
+
+
+def fanout_settings():
+    global_cfg = get_config().get('global') or {}
+    return (int(global_cfg.get('fanout_concurrency', fanout_concurrency_default)),
+            float(global_cfg.get('fanout_timeout', fanout_timeout_default)))
+
+
+def fanout_servers(servers):
+    configured = get_servers()
+    if not servers:
+        return configured
+    unknown = [s for s in servers if s not in configured]
+    if unknown:
+        raise ValidationError(f"Unknown server(s): {', '.join(unknown)}")
+    return list(servers)
+
+
+def execute_fanout_query(db, servers, sql):
+    '''runs a read-only query on several servers (all of them if servers is empty) at the same time.
+
+    returns with a dict: "column_names", "rows" = tuples of all servers with the server name in the
+    last column, and "servers" = a list of {"server", "row_count", "elapsed", "error"}. A server that fails
+    or doesn't answer within fanout_timeout seconds only shows up with an error in "servers".
+    '''
+    sql = validate_read_only_sql(sql)
+    servers = fanout_servers(servers)
+    concurrency, timeout = fanout_settings()
+    logging.debug("fanout to %s: %s", servers, sql)
+    outcomes = run_concurrently(fetch_query, [(server, sql) for server in servers], concurrency, timeout,
+                                name="fanout")
+    return _merge_fanout(servers, outcomes)
+
+
+def execute_adhoc_report_fanout(db, servers):
+    '''the adhoc report run on several servers (all of them if servers is empty), every item merged
+    across servers like execute_fanout_query() does, with the per-server status in "servers"'''
+    config = get_config()
+    items = config['misc'].get('adhoc_report') or []
+    servers = fanout_servers(servers)
+    concurrency, timeout = fanout_settings()
+
+    calls = [(server, item.get('sql', '')) for item in items for server in servers]
+    outcomes = run_concurrently(fetch_query, calls, concurrency, timeout, name="fanout")
+    adhoc_results = []
+    for n, item in enumerate(items):
+        merged = _merge_fanout(servers, outcomes[n * len(servers):(n + 1) * len(servers)])
+        errors = ["%s: %s" % (s['server'], s['error']) for s in merged['servers'] if s['error']]
+        merged.update({'title': item.get('title', ''), 'sql': item.get('sql', ''), 'info': item.get('info', ''),
+                       'row_count': len(merged['rows']),
+                       'elapsed': max([s['elapsed'] for s in merged['servers']] or [0.0]),
+                       'error': "; ".join(errors) or None})
+        adhoc_results.append(merged)
+    return adhoc_results
 
 
 def get_servers():
     try:
-        servers_dict = get_config()
-        if 'servers' not in servers_dict:
+        loaded = _load_config("config/config.yml")
+        if 'servers' not in loaded.cfg:
             raise ConfigError("No 'servers' section found in configuration")
-        return list(servers_dict['servers'].keys())
+        return list(loaded.servers)
     except ConfigError:
         raise
     except Exception as e:
@@ -317,17 +1257,10 @@ def get_servers():
 
 def get_read_only(server):
     try:
-        config = get_config()
-        if server not in config['servers']:
+        read_only = _load_config("config/config.yml").read_only
+        if server not in read_only:
             raise ConfigError(f"Server '{server}' not found in configuration")
-        
-        if 'read_only' not in config['servers'][server]:
-            if 'global' in config and 'read_only' in config['global']:
-                return config['global']['read_only']
-            else:
-                return False  # Default to read-write
-        else:
-            return config['servers'][server]['read_only']
+        return read_only[server]
     except ConfigError:
         raise
     except Exception as e:
@@ -335,34 +1268,63 @@ def get_read_only(server):
 
 
 
-def execute_change(db, server, sql):
+def split_statements(sql):
+    """Splits a ;-separated SQL script into statements, ignoring semicolons inside quotes"""
+    statements = []
+    current = []
+    quote = None
+    for char in sql:
+        if quote:
+            # a doubled quote inside a string is an escaped quote; it toggles twice and ends up unchanged
+            if char == quote:
+                quote = None
+        elif char in ("'", '"', '`'):
+            quote = char
+        elif char == ';':
+            statement = ''.join(current).strip()
+            if statement:
+                statements.append(statement)
+            current = []
+            continue
+        current.append(char)
+    statement = ''.join(current).strip()
+    if statement:
+        statements.append(statement)
+    return statements
+
+
+def execute_changes(db, server, sql):
+    '''runs a ;-separated list of statements over one pooled connection and returns with a list of dicts:
+    "sql", "status" (ok/error/skipped), "rowcount", "error" and "elapsed" (seconds) for each statement.
+    Like the mysql client it stops at the first error, the rest of the statements are reported as skipped.
+    '''
+    sql = validate_sql(sql)
+    statements = split_statements(sql)
+    results = [{'sql': statement, 'status': 'skipped', 'rowcount': None, 'error': None, 'elapsed': 0.0}
+               for statement in statements]
+    logging.debug("server: %s - %d statement(s)", server, len(statements))
     try:
-        sql = validate_sql(sql)
-        # this is a temporary solution as using the  mysql.connector for certain writes ended up with weird results, ProxySQL
-        # is not a MySQL server after all. We're investigating the issue.
-        db_connect(db, server=server, dictionary=False)
-        logging.debug(sql)
-        logging.debug(server)
-        dsn = get_config()['servers'][server]['dsn'][0]
-        cmd = ('mysql -h{} -P{} -u{} -p{} -e "{}"'.format(
-            dsn['host'], dsn['port'], dsn['user'], dsn['passwd'], sql))
-        
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            return "ERROR: " + result.stderr
-        else:
-            return result.stdout
-            
-    except ValidationError as e:
-        return f"VALIDATION ERROR: {str(e)}"
+        with pooled_cursor(server, dictionary=False, kind='write') as cur:
+            for result in results:
+                started = time.monotonic()
+                try:
+                    cur.execute(result['sql'])
+                    if cur.with_rows:
+                        cur.fetchall()
+                    result['rowcount'] = cur.rowcount
+                    result['status'] = 'ok'
+                except (mysql.connector.Error, mysql.connector.Warning) as e:
+                    result['status'] = 'error'
+                    result['error'] = str(e)
+                    break
+                finally:
+                    result['elapsed'] = time.monotonic() - started
     except DatabaseError as e:
-        return f"DATABASE ERROR: {str(e)}"
-    except Exception as e:
-        return f"ERROR: {str(e)}"
-    finally:
-        try:
-            db['cnf']['servers'][server]['conn'].close()
-        except:
-            pass
+        # could not even get a connection
+        if results:
+            results[0]['status'] = 'error'
+            results[0]['error'] = str(e)
+    # whatever was cached for this server may be stale now
+    result_cache.invalidate(server)
+    return results
 
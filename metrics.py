@@ -0,0 +1,277 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# Minimal Prometheus-style metrics registry.
+#
+# Counters, gauges and histograms keep their values per label set in a dict guarded by one lock
+# per metric. Every gunicorn worker has its own registry; when a shared directory is configured
+# each worker dumps its values there every few seconds and /metrics adds up the dumps of all
+# workers, so it doesn't matter which worker answers the scrape.
+
+import json
+import logging
+import os
+import threading
+import time
+
+default_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# dumps of workers that haven't written for this long are ignored
+stale_after = 300
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def samples(self):
+        """Returns with {label values tuple: value} - a copy"""
+        with self._lock:
+            return {labels: (list(value) if isinstance(value, list) else value)
+                    for labels, value in self._values.items()}
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, *labels, value=0):
+        # for counters maintained elsewhere and mirrored here by a collector
+        with self._lock:
+            self._values[labels] = value
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, *labels, value=0):
+        with self._lock:
+            self._values[labels] = value
+
+    def clear(self):
+        # for collectors that rebuild every label set on each run
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=default_buckets):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labels, value):
+        # stored as [count per bucket..., +Inf count, sum], the buckets are not cumulative here
+        with self._lock:
+            values = self._values.get(labels)
+            if values is None:
+                values = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+                    break
+            else:
+                values[len(self.buckets)] += 1
+            values[-1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(*self.labels, value=time.perf_counter() - self.started)
+        return False
+
+
+_registry = {}
+_collectors = []
+_registry_lock = threading.Lock()
+
+
+def _register(metric):
+    with _registry_lock:
+        existing = _registry.get(metric.name)
+        if existing is not None:
+            return existing
+        _registry[metric.name] = metric
+        return metric
+
+
+def counter(name, documentation, labelnames=()):
+    return _register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()):
+    return _register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=default_buckets):
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+
+def add_collector(func):
+    """func() is called before every dump/scrape, it can set gauges from values kept elsewhere"""
+    _collectors.append(func)
+
+
+def collect():
+    """Returns with this process' metrics as a JSON friendly dict"""
+    for func in _collectors:
+        try:
+            func()
+        except Exception as e:
+            logging.debug("metrics collector failed: %s", e)
+    with _registry_lock:
+        metrics = list(_registry.values())
+    dump = {}
+    for metric in metrics:
+        dump[metric.name] = {
+            'kind': metric.kind, 'help': metric.documentation, 'labelnames': list(metric.labelnames),
+            'buckets': list(getattr(metric, 'buckets', ())),
+            'samples': [[list(labels), value] for labels, value in metric.samples().items()],
+        }
+    return dump
+
+
+def _merge(dumps):
+    merged = {}
+    for dump in dumps:
+        for name, metric in dump.items():
+            target = merged.setdefault(name, dict(metric, samples={}))
+            for labels, value in metric['samples']:
+                key = tuple(labels)
+                current = target['samples'].get(key)
+                if current is None:
+                    target['samples'][key] = value
+                elif isinstance(value, list):
+                    target['samples'][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target['samples'][key] = current + value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs) + '}'
+
+
+def render(dumps):
+    """Returns with the dumps added up, in the Prometheus text exposition format"""
+    lines = []
+    for name, metric in sorted(_merge(dumps).items()):
+        lines.append('# HELP %s %s' % (name, metric['help']))
+        lines.append('# TYPE %s %s' % (name, metric['kind']))
+        names = metric['labelnames']
+        for labels, value in sorted(metric['samples'].items()):
+            if metric['kind'] == 'histogram':
+                cumulative = 0
+                for bound, count in zip(metric['buckets'] + ['+Inf'], value[:-1]):
+                    cumulative += count
+                    lines.append('%s_bucket%s %s' % (name, _labels(names, labels, ('le', bound)), cumulative))
+                lines.append('%s_sum%s %s' % (name, _labels(names, labels), value[-1]))
+                lines.append('%s_count%s %s' % (name, _labels(names, labels), cumulative))
+            else:
+                lines.append('%s%s %s' % (name, _labels(names, labels), value))
+    return '\n'.join(lines) + '\n'
+
+
+_directory = None
+
+
+def _dump_path(directory):
+    return os.path.join(directory, 'worker_%d.json' % os.getpid())
+
+
+def write_dump(directory):
+    path = _dump_path(directory)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(collect(), f)
+    os.replace(path + '.tmp', path)
+
+
+def read_dumps(directory):
+    dumps = []
+    now = time.time()
+    for entry in os.scandir(directory):
+        if not entry.name.endswith('.json'):
+            continue
+        try:
+            if now - entry.stat().st_mtime > stale_after:
+                continue
+            with open(entry.path) as f:
+                dumps.append(json.load(f))
+        except (OSError, ValueError):
+            pass
+    return dumps
+
+
+def start(directory=None, interval=5):
+    """Enables the cross-worker aggregation: this process dumps its metrics into directory every interval seconds"""
+    global _directory
+    if not directory or _directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    _directory = directory
+
+    def run():
+        while True:
+            try:
+                write_dump(directory)
+            except OSError as e:
+                logging.debug("metrics dump failed: %s", e)
+            time.sleep(interval)
+    threading.Thread(target=run, name="metrics", daemon=True).start()
+
+
+def exposition():
+    """The text served on /metrics: all workers' metrics when a directory is set, this process' otherwise"""
+    if not _directory:
+        return render([collect()])
+    # our own values are fresher than our last dump
+    write_dump(_directory)
+    return render(read_dumps(_directory))
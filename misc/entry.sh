@@ -20,5 +20,10 @@ if [ -n "${WEBSERVER_THREADS}" ]; then
     GUNICORN_THREADS=${WEBSERVER_THREADS}
 fi
 
+# WEBSERVER_MODE=async: uvicorn + asgi.py, the read paths query ProxySQL without blocking a thread
+if [ "${WEBSERVER_MODE}" = "async" ]; then
+    exec uvicorn --app-dir /app asgi:app --workers ${GUNICORN_WORKERS} --host 0.0.0.0 --port ${GUNICORN_PORT}
+fi
+
 gunicorn --chdir /app wsgi:app -w ${GUNICORN_WORKERS} --threads ${GUNICORN_THREADS} -b 0.0.0.0:${GUNICORN_PORT}
 
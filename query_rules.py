@@ -0,0 +1,297 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# Offline simulation of mysql_query_rules against the current query digests.
+#
+# The rules of a server are compiled into a RuleIndex: the regexes are compiled once, the rules are
+# grouped by flagIN and the candidates of a (flagIN, username, schemaname) combination are worked
+# out once. Every stats_mysql_query_digest row is then run through the rules the way ProxySQL does:
+# in rule_id order, following the flagOUT -> flagIN chains, until a rule with apply=1 matches.
+# An index is cached by the checksum of the rules (and users) it was built from, together with
+# the outcome of every digest it has evaluated, so a re-run only evaluates the new digests.
+#
+# Offline there is no query text, match_pattern is tested against digest_text just like
+# match_digest; proxy_addr/proxy_port and the other non-routing columns are ignored.
+
+import hashlib
+import re
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+
+import mdb
+
+sql_rules = ("select rule_id, username, schemaname, flagIN, client_addr, digest, match_digest, match_pattern, "
+             "negate_match_pattern, re_modifiers, flagOUT, destination_hostgroup, apply from main.%s "
+             "where active = 1 order by rule_id;")
+sql_users = "select username, default_hostgroup from main.%s where frontend = 1;"
+sql_digests = ("select hostgroup, schemaname, username, client_address, digest, digest_text, count_star, sum_time "
+               "from stats.stats_mysql_query_digest;")
+
+# where the rules and users are read from: the config being edited or what ProxySQL runs
+sources = {'main': ('mysql_query_rules', 'mysql_users'),
+           'runtime': ('runtime_mysql_query_rules', 'runtime_mysql_users')}
+
+# compiled rule sets kept, and the digest outcomes remembered per rule set
+indexes_kept = 8
+memo_size = 200000
+
+# a leading literal of an anchored regex: checked with startswith() before running the regex
+_literal_prefix = re.compile(r'\^((?:[A-Za-z0-9_ ,=]|\\[.*+?()\[\]{}|^$\\ ])+)(?![*+?{])')
+
+
+def _prefix(pattern, caseless):
+    # an alternation may not be anchored at all
+    m = _literal_prefix.match(pattern) if '|' not in pattern else None
+    if not m:
+        return None
+    literal = re.sub(r'\\(.)', r'\1', m.group(1))
+    return literal.upper() if caseless else literal
+
+
+class _Rule:
+    __slots__ = ('rule_id', 'position', 'username', 'schemaname', 'flag_in', 'client_addr', 'digest',
+                 'match_digest', 'match_pattern', 'prefixes', 'caseless', 'negate', 'flag_out', 'destination',
+                 'apply', 'error')
+
+    def __init__(self, position, row):
+        (self.rule_id, self.username, self.schemaname, flag_in, self.client_addr, digest, match_digest,
+         match_pattern, negate, re_modifiers, flag_out, destination, apply) = row
+        self.position = position
+        self.flag_in = int(flag_in or 0)
+        self.flag_out = None if flag_out is None else int(flag_out)
+        self.destination = None if destination is None else int(destination)
+        self.apply = bool(int(apply or 0))
+        self.negate = bool(int(negate or 0))
+        self.digest = str(digest).upper() if digest not in (None, '') else None
+        self.caseless = 'CASELESS' in (re_modifiers or '').upper()
+        self.error = None
+        self.match_digest = self.match_pattern = None
+        self.prefixes = []
+        flags = re.IGNORECASE if self.caseless else 0
+        try:
+            if match_digest:
+                self.match_digest = re.compile(match_digest, flags)
+            if match_pattern:
+                self.match_pattern = re.compile(match_pattern, flags)
+        except re.error as e:
+            self.error = f"rule {self.rule_id}: invalid regex: {e}"
+        if not self.negate:
+            # cheap pre-check, only valid when a miss means no match
+            self.prefixes = [p for p in (_prefix(match_digest or '', self.caseless),
+                                         _prefix(match_pattern or '', self.caseless)) if p]
+
+    def _regex(self, regex, text):
+        found = regex.search(text) is not None
+        return not found if self.negate else found
+
+    def matches(self, client, digest, text, text_upper):
+        if self.error:
+            return False
+        if self.client_addr:
+            if self.client_addr.endswith('%'):
+                if not client.startswith(self.client_addr[:-1]):
+                    return False
+            elif client != self.client_addr:
+                return False
+        if self.digest is not None and self.digest != digest:
+            return False
+        for prefix in self.prefixes:
+            if not (text_upper if self.caseless else text).startswith(prefix):
+                return False
+        if self.match_digest is not None and not self._regex(self.match_digest, text):
+            return False
+        if self.match_pattern is not None and not self._regex(self.match_pattern, text):
+            return False
+        return True
+
+
+class RuleIndex:
+    """A compiled rule set, see the top of the file"""
+
+    def __init__(self, rule_rows, user_rows):
+        self.rules = [_Rule(position, row) for position, row in enumerate(rule_rows)]
+        self.by_id = {rule.rule_id: rule for rule in self.rules}
+        self.by_flag = {}
+        for rule in self.rules:
+            self.by_flag.setdefault(rule.flag_in, []).append(rule)
+        self.default_hostgroups = {username: default_hostgroup for username, default_hostgroup in user_rows}
+        self.errors = [rule.error for rule in self.rules if rule.error]
+        self.uses_client = any(rule.client_addr for rule in self.rules)
+        self.uses_digest = any(rule.digest for rule in self.rules)
+        self._candidates = {}
+        self._memo = {}
+
+    def candidates(self, flag, username, schemaname):
+        """(positions, rules) of the rules that can match (flag, username, schemaname), in rule_id order"""
+        key = (flag, username, schemaname)
+        found = self._candidates.get(key)
+        if found is None:
+            rules = [rule for rule in self.by_flag.get(flag, ())
+                     if (not rule.username or rule.username == username)
+                     and (not rule.schemaname or rule.schemaname == schemaname)]
+            found = self._candidates[key] = ([rule.position for rule in rules], rules)
+        return found
+
+    def evaluate(self, username, schemaname, client, digest, text):
+        """Returns with (rule_ids matched in order, destination hostgroup or None)"""
+        client = client or ''
+        digest = str(digest).upper() if digest else ''
+        key = (username, schemaname, client if self.uses_client else None, digest if self.uses_digest else None,
+               text)
+        outcome = self._memo.get(key)
+        if outcome is not None:
+            return outcome
+
+        text = text or ''
+        text_upper = text.upper()
+        chain = []
+        destination = None
+        flag = 0
+        position = -1
+        done = False
+        while not done:
+            positions, rules = self.candidates(flag, username, schemaname)
+            for rule in rules[bisect_right(positions, position):]:
+                if not rule.matches(client, digest, text, text_upper):
+                    continue
+                chain.append(rule.rule_id)
+                position = rule.position
+                if rule.destination is not None:
+                    destination = rule.destination
+                if rule.apply:
+                    done = True
+                    break
+                if rule.flag_out is not None and rule.flag_out != flag:
+                    # continue after this rule with the rules of the new flagIN
+                    flag = rule.flag_out
+                    break
+            else:
+                done = True
+
+        outcome = (tuple(chain), destination)
+        if len(self._memo) >= memo_size:
+            self._memo.clear()
+        self._memo[key] = outcome
+        return outcome
+
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+def rules_checksum(rule_rows, user_rows):
+    return hashlib.sha1(repr((list(rule_rows), sorted(user_rows))).encode()).hexdigest()
+
+
+def get_rule_index(server, source='main'):
+    """Returns with (RuleIndex, cached) of the current rules of the server"""
+    if source not in sources:
+        raise mdb.ValidationError(f"Invalid source: {source}")
+    rules_table, users_table = sources[source]
+    rule_rows = [tuple(row) for row in mdb.fetch_query(server, sql_rules % rules_table)[1]]
+    user_rows = [tuple(row) for row in mdb.fetch_query(server, sql_users % users_table)[1]]
+    checksum = rules_checksum(rule_rows, user_rows)
+    with _lock:
+        index = _indexes.get(checksum)
+        if index is not None:
+            _indexes.move_to_end(checksum)
+            return index, True
+    index = RuleIndex(rule_rows, user_rows)
+    with _lock:
+        _indexes[checksum] = index
+        while len(_indexes) > indexes_kept:
+            _indexes.popitem(last=False)
+    return index, False
+
+
+def _percent(part, total):
+    return round(100.0 * part / total, 2) if total else 0
+
+
+def simulate(server, source='main', top=50):
+    '''replays stats_mysql_query_digest through the mysql_query_rules of source ("main" or "runtime").
+    Returns with adhoc_report style dicts: the load per deciding rule and destination hostgroup, then
+    the top digests by sum_time with the rules they hit.'''
+    started = time.monotonic()
+    index, cached = get_rule_index(server, source)
+    compiled = time.monotonic()
+    column_names, rows = mdb.fetch_query(server, sql_digests)
+    fetched = time.monotonic()
+
+    per_rule = {}
+    digests = []
+    total_count = total_time = 0
+    for hostgroup, schemaname, username, client, digest, text, count_star, sum_time in rows:
+        chain, destination = index.evaluate(username, schemaname, client, digest, text)
+        if destination is None:
+            destination = index.default_hostgroups.get(username)
+        count_star, sum_time = int(count_star or 0), int(sum_time or 0)
+        total_count += count_star
+        total_time += sum_time
+        key = (chain[-1] if chain else None, destination)
+        load = per_rule.get(key)
+        if load is None:
+            load = per_rule[key] = [0, 0, 0]
+        load[0] += 1
+        load[1] += count_star
+        load[2] += sum_time
+        digests.append((sum_time, count_star, username, schemaname, hostgroup, destination, chain, text))
+    evaluated = time.monotonic()
+
+    timing = "Rules %s in %.1f ms, %d digests read in %.1f ms and evaluated in %.1f ms." % (
+        "loaded from cache" if cached else "compiled", (compiled - started) * 1000, len(rows),
+        (fetched - compiled) * 1000, (evaluated - fetched) * 1000)
+    if index.errors:
+        timing += " Skipped: " + "; ".join(index.errors)
+
+    summary = {'title': f"Load per query rule ({source} rules, {len(index.rules)} active)",
+               'sql': sql_rules % sources[source][0],
+               'info': "The last rule each digest matches and the hostgroup it's routed to, weighted by the digest "
+                       "counters. Digests no rule matches go to the default_hostgroup of their user. "
+                       "match_pattern is tested against digest_text. " + timing,
+               'column_names': ['rule_id', 'destination_hostgroup', 'digests', 'count_star', 'count_star %',
+                                'sum_time', 'sum_time %', 'match_digest', 'match_pattern', 'username',
+                                'schemaname', 'flagIN', 'apply'],
+               'rows': [], 'error': None}
+    for (rule_id, destination), (hits, count_star, sum_time) in sorted(per_rule.items(), key=lambda i: -i[1][2]):
+        rule = index.by_id.get(rule_id)
+        summary['rows'].append((
+            rule_id if rule else 'no match', destination, hits, count_star, _percent(count_star, total_count),
+            sum_time, _percent(sum_time, total_time),
+            rule.match_digest.pattern if rule and rule.match_digest else None,
+            rule.match_pattern.pattern if rule and rule.match_pattern else None,
+            rule.username if rule else None, rule.schemaname if rule else None,
+            rule.flag_in if rule else None, rule.apply if rule else None))
+    summary['row_count'] = len(summary['rows'])
+    summary['elapsed'] = evaluated - started
+
+    report = {'title': f"Top {top} digests by sum_time", 'sql': sql_digests,
+              'info': "hostgroup is where the digest ran, destination_hostgroup where these rules would send it.",
+              'column_names': ['sum_time', 'count_star', 'username', 'schemaname', 'hostgroup',
+                               'destination_hostgroup', 'rules', 'digest_text'],
+              'rows': [], 'error': None}
+    for sum_time, count_star, username, schemaname, hostgroup, destination, chain, text in sorted(
+            digests, key=lambda d: d[0], reverse=True)[:int(top)]:
+        report['rows'].append((sum_time, count_star, username, schemaname, hostgroup, destination,
+                               ' > '.join(str(rule_id) for rule_id in chain), text))
+    report['row_count'] = len(report['rows'])
+    report['elapsed'] = time.monotonic() - started
+    return [summary, report]
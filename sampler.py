@@ -0,0 +1,286 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# Background sampler of the ProxySQL stats_* tables.
+#
+# Every `interval` seconds the configured stats tables of every server are read and the numeric
+# columns are written to a local SQLite file. Only the values that changed since the previous
+# sample are stored, together with their delta, so idle counters cost nothing. Samples older than
+# `downsample_after` seconds are rolled up into `downsample_step` second buckets and everything
+# older than `retention` seconds is dropped. The rate/history views read this file only.
+#
+# The values are counters unless a table's spec lists them as gauges: by column ("gauges") or, for
+# tables keeping one variable per row, by key ("gauge_keys", shell-style patterns, case-insensitive).
+# Rates are computed for the counters only.
+
+import fcntl
+import fnmatch
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import mdb
+
+defaults = {
+    'enabled': False,
+    'interval': 10,
+    'path': 'config/stats.sqlite',
+    'retention': 7 * 86400,
+    'downsample_after': 3600,
+    'downsample_step': 60,
+    'tables': {
+        'stats_mysql_global': {
+            'key': ['Variable_Name'], 'values': ['Variable_Value'],
+            'gauge_keys': ['Active_Transactions', 'Client_Connections_connected', 'Client_Connections_non_idle',
+                           'Server_Connections_connected', 'MySQL_Thread_Workers', 'MySQL_Monitor_Workers',
+                           'Stmt_*_Active_*', 'Stmt_Cached', 'Query_Cache_Entries', '*_memory*',
+                           'mysql_*_buffers_bytes', 'mysql_session_internal_bytes', 'jemalloc_*',
+                           'Servers_table_version']},
+        'stats_mysql_connection_pool': {
+            'key': ['hostgroup', 'srv_host', 'srv_port'],
+            'values': ['ConnUsed', 'ConnFree', 'ConnOK', 'ConnERR', 'Queries', 'Bytes_data_sent',
+                       'Bytes_data_recv', 'Latency_us'],
+            'gauges': ['ConnUsed', 'ConnFree', 'Latency_us']},
+        'stats_mysql_query_digest': {
+            'key': ['hostgroup', 'schemaname', 'username', 'digest'],
+            'values': ['count_star', 'sum_time']},
+    },
+}
+
+schema = """
+CREATE TABLE IF NOT EXISTS series (
+    id INTEGER PRIMARY KEY, server TEXT NOT NULL, tbl TEXT NOT NULL, key TEXT NOT NULL, metric TEXT NOT NULL,
+    UNIQUE (server, tbl, key, metric));
+CREATE TABLE IF NOT EXISTS samples (series_id INTEGER NOT NULL, ts INTEGER NOT NULL, value REAL, delta REAL);
+CREATE INDEX IF NOT EXISTS samples_series_ts ON samples (series_id, ts);
+CREATE TABLE IF NOT EXISTS rollup (series_id INTEGER NOT NULL, ts INTEGER NOT NULL, value REAL, delta REAL);
+CREATE INDEX IF NOT EXISTS rollup_series_ts ON rollup (series_id, ts);
+"""
+
+# the key columns of a row are joined with this into the series key
+key_separator = '|'
+
+
+def get_settings():
+    """Returns with the sampler: section of the config merged over the defaults"""
+    settings = dict(defaults)
+    settings.update(mdb.get_config().get('sampler') or {})
+    return settings
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(schema)
+    return conn
+
+
+def is_gauge(spec, key, metric):
+    """True if the metric of the row with key is a gauge as per the table's spec, False for a counter"""
+    if metric in (spec.get('gauges') or ()):
+        return True
+    return any(fnmatch.fnmatchcase(key.lower(), pattern.lower()) for pattern in spec.get('gauge_keys') or ())
+
+
+def _to_number(value):
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Sampler:
+    """Polls the stats tables of every configured server and stores the changed values"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.conn = connect(settings['path'])
+        self.series = {}      # (server, table, key, metric) -> series id
+        self.last = {}        # series id -> last stored value
+        self.seen = {}        # (server, table) -> the series ids of its previous sample
+        self.last_rollup = 0
+        self._stop = threading.Event()
+
+    def _series_id(self, server, table, key, metric):
+        ident = (server, table, key, metric)
+        series_id = self.series.get(ident)
+        if series_id is None:
+            self.conn.execute("INSERT OR IGNORE INTO series (server, tbl, key, metric) VALUES (?, ?, ?, ?)", ident)
+            series_id = self.conn.execute(
+                "SELECT id FROM series WHERE server = ? AND tbl = ? AND key = ? AND metric = ?", ident).fetchone()[0]
+            self.series[ident] = series_id
+        return series_id
+
+    def sample_table(self, server, table, spec, now):
+        columns = list(spec['key']) + list(spec['values'])
+        sql = "select %s from stats.%s" % (", ".join(mdb.quote_column(c) for c in columns), mdb.quote_identifier(table))
+        column_names, rows = mdb.fetch_query(server, sql)
+        nkey = len(spec['key'])
+        changed = []
+        seen = {}
+        for row in rows:
+            key = key_separator.join(str(v) for v in row[:nkey])
+            for metric, value in zip(spec['values'], row[nkey:]):
+                value = _to_number(value)
+                if value is None:
+                    continue
+                series_id = self._series_id(server, table, key, metric)
+                seen[series_id] = (server, table, key, metric)
+                previous = self.last.get(series_id)
+                if previous == value:
+                    continue
+                self.last[series_id] = value
+                changed.append((series_id, now, value, None if previous is None else value - previous))
+        self.conn.executemany("INSERT INTO samples (series_id, ts, value, delta) VALUES (?, ?, ?, ?)", changed)
+        # rows gone from the table (digests, backends) are forgotten, a returning one starts over
+        self._forget({series_id: ident for series_id, ident in self.seen.get((server, table), {}).items()
+                      if series_id not in seen})
+        self.seen[(server, table)] = seen
+        return len(changed)
+
+    def _forget(self, series):
+        """Drops the cached ids and last values of {series id: (server, table, key, metric)}"""
+        for series_id, ident in series.items():
+            self.last.pop(series_id, None)
+            self.series.pop(ident, None)
+
+    def sample(self):
+        now = int(time.time())
+        servers = mdb.get_servers()
+        tables = self.settings.get('tables') or {}
+        for server in servers:
+            for table, spec in tables.items():
+                try:
+                    stored = self.sample_table(server, table, spec, now)
+                    logging.debug("sampler: %s %s: %d changed value(s)", server, table, stored)
+                except Exception as e:
+                    logging.warning("sampler: %s %s: %s", server, table, e)
+        # servers removed from the config
+        for server, table in [found for found in self.seen if found[0] not in servers or found[1] not in tables]:
+            self._forget(self.seen.pop((server, table)))
+        self.conn.commit()
+        if now - self.last_rollup >= self.settings['downsample_step']:
+            self.rollup(now)
+            self.last_rollup = now
+
+    def rollup(self, now):
+        """Moves the samples older than downsample_after into downsample_step buckets, drops the expired ones"""
+        step = int(self.settings['downsample_step'])
+        cutoff = now - int(self.settings['downsample_after'])
+        cutoff -= cutoff % step
+        with self.conn:
+            # the bare "value" column comes from the row with max(ts): the last value of the bucket
+            self.conn.execute(
+                "INSERT INTO rollup (series_id, ts, value, delta) SELECT series_id, bucket, value, delta FROM "
+                "(SELECT series_id, (ts / ?) * ? AS bucket, max(ts), value, sum(delta) AS delta FROM samples "
+                " WHERE ts < ? GROUP BY series_id, ts / ?)", (step, step, cutoff, step))
+            self.conn.execute("DELETE FROM samples WHERE ts < ?", (cutoff,))
+            self.conn.execute("DELETE FROM rollup WHERE ts < ?", (now - int(self.settings['retention']),))
+            expired = {series_id: (server, table, key, metric) for series_id, server, table, key, metric in
+                       self.conn.execute("SELECT id, server, tbl, key, metric FROM series "
+                                         "WHERE id NOT IN (SELECT series_id FROM samples) "
+                                         "AND id NOT IN (SELECT series_id FROM rollup)")}
+            self.conn.executemany("DELETE FROM series WHERE id = ?", [(series_id,) for series_id in expired])
+        # an unchanged value outliving the retention is stored again on the next sample, under a new id
+        self._forget(expired)
+        for seen in self.seen.values():
+            for series_id in expired:
+                seen.pop(series_id, None)
+
+    def run(self):
+        interval = float(self.settings['interval'])
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.sample()
+            except Exception as e:
+                logging.warning("sampler: %s", e)
+            self._stop.wait(max(interval - (time.monotonic() - started), 0))
+
+    def stop(self):
+        self._stop.set()
+
+
+_sampler = None
+_lock_file = None
+
+
+def start():
+    """Starts the sampler thread if it's enabled; with several workers only the one holding the lock samples"""
+    global _sampler, _lock_file
+    settings = get_settings()
+    if not settings['enabled'] or _sampler is not None:
+        return None
+    _lock_file = open(settings['path'] + '.lock', 'w')
+    try:
+        fcntl.flock(_lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        logging.debug("sampler: another process is sampling, this one only reads")
+        return None
+    _sampler = Sampler(settings)
+    threading.Thread(target=_sampler.run, name="sampler", daemon=True).start()
+    return _sampler
+
+
+_readers = threading.local()
+
+
+def _reader():
+    settings = get_settings()
+    if not os.path.exists(settings['path']):
+        raise mdb.ConfigError("The stats sampler is not enabled or has not run yet")
+    conn = getattr(_readers, 'conn', None)
+    if conn is None or getattr(_readers, 'path', None) != settings['path']:
+        conn = connect(settings['path'])
+        _readers.conn, _readers.path = conn, settings['path']
+    return conn
+
+
+def get_rates(server, table, window=60):
+    """Returns with {key: {metric: per second rate}} of the counters over the last window seconds, read from the
+    local store. Gauges have no rate, see get_history() for their values."""
+    window = max(int(window), 1)
+    since = int(time.time()) - window
+    spec = (get_settings().get('tables') or {}).get(table) or {}
+    rates = {}
+    # a negative delta on a counter means it was reset, the increase since then is the value itself
+    for key, metric, total in _reader().execute(
+            "SELECT s.key, s.metric, sum(CASE WHEN d.delta < 0 THEN d.value ELSE d.delta END) FROM series s "
+            "JOIN (SELECT series_id, value, delta FROM samples WHERE ts > ? AND delta IS NOT NULL "
+            "      UNION ALL SELECT series_id, value, delta FROM rollup WHERE ts > ? AND delta IS NOT NULL) d "
+            "ON d.series_id = s.id WHERE s.server = ? AND s.tbl = ? GROUP BY s.key, s.metric",
+            (since, since, server, table)):
+        if not is_gauge(spec, key, metric):
+            rates.setdefault(key, {})[metric] = (total or 0) / window
+    return rates
+
+
+def get_history(server, table, key, metric, since=3600):
+    """Returns with [[ts, value, delta], ...] of one series; only the points where the value changed"""
+    since = int(time.time()) - max(int(since), 1)
+    return [list(row) for row in _reader().execute(
+        "SELECT ts, value, delta FROM (SELECT series_id, ts, value, delta FROM rollup UNION ALL "
+        "SELECT series_id, ts, value, delta FROM samples) d JOIN series s ON d.series_id = s.id "
+        "WHERE s.server = ? AND s.tbl = ? AND s.key = ? AND s.metric = ? AND d.ts > ? ORDER BY d.ts",
+        (server, table, key, metric, since))]
@@ -0,0 +1,259 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# Server side sessions and the query history.
+#
+# The session cookie only carries a signed random id, the data lives in a store: "memory" keeps it
+# in the worker process (LRU, fine with a single worker), "sqlite" in a file shared by the workers
+# of the host. A session is written back only if it changed or half of its ttl is gone. Clearing a
+# session (login, logout) gives it a new id.
+#
+# The query history is kept in the same SQLite file, shared by every login: the most recent
+# history_size queries, searchable with /history/?q=.
+
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+import mdb
+
+defaults = {
+    'backend': 'sqlite',
+    'path': 'config/state.sqlite',
+    'ttl': 86400,
+    'max_entries': 1000,
+    'history_size': 1000,
+}
+backends = ('memory', 'sqlite')
+
+schema = """
+CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS history (sql TEXT PRIMARY KEY, server TEXT, runs INTEGER NOT NULL, last_run REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS history_last_run ON history (last_run);
+"""
+
+# expired sessions are deleted from the SQLite store every this many writes
+purge_every = 100
+
+
+def get_settings():
+    """Returns with the sessions: section of the config merged over the defaults"""
+    settings = dict(defaults)
+    settings.update(mdb.get_config().get('sessions') or {})
+    return settings
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(schema)
+    return conn
+
+
+class _Connections:
+    """One connection to the SQLite file per thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        connect(path).close()
+
+    def get(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = connect(self.path)
+        return conn
+
+
+class MemoryStore:
+    """Sessions of this worker process, the least recently used ones are dropped above max_entries"""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = int(max_entries)
+        self._entries = OrderedDict()    # sid -> (data, expires)
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                del self._entries[sid]
+                return None
+            self._entries.move_to_end(sid)
+            return entry
+
+    def put(self, sid, data, expires):
+        with self._lock:
+            self._entries[sid] = (data, expires)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+
+class SQLiteStore:
+    """Sessions in the SQLite file, shared by the worker processes of the host"""
+
+    def __init__(self, path):
+        self.connections = _Connections(path)
+        self._writes = 0
+
+    def get(self, sid):
+        return self.connections.get().execute("select data, expires from sessions where sid = ? and expires >= ?",
+                                              (sid, time.time())).fetchone()
+
+    def put(self, sid, data, expires):
+        conn = self.connections.get()
+        conn.execute("insert or replace into sessions (sid, data, expires) values (?, ?, ?)", (sid, data, expires))
+        self._writes += 1
+        if self._writes % purge_every == 0:
+            conn.execute("delete from sessions where expires < ?", (time.time(),))
+
+    def delete(self, sid):
+        self.connections.get().execute("delete from sessions where sid = ?", (sid,))
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, sid=None, data=None, expires=0.0):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.data = data          # the serialized form it was loaded from
+        self.expires = expires
+        self.modified = False
+        self.rotate = False
+
+    def clear(self):
+        # logging in or out: the old id may have been seen by someone else
+        super().clear()
+        self.rotate = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+    salt = 'proxyweb-session'
+
+    def __init__(self, store, ttl):
+        self.store = store
+        self.ttl = float(ttl)
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt=self.salt)
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode('ascii')
+            except BadSignature:
+                sid = None
+            found = self.store.get(sid) if sid else None
+            if found:
+                data, expires = found
+                return ServerSideSession(self.serializer.loads(data), sid, data, expires)
+        return ServerSideSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.rotate and session.sid:
+            self.store.delete(session.sid)
+            session.sid = None
+        if not session:
+            if session.modified:
+                response.delete_cookie(name, domain=domain, path=path, secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app), httponly=self.get_cookie_httponly(app))
+            return
+
+        response.vary.add('Cookie')
+        data = self.serializer.dumps(dict(session))
+        now = time.time()
+        if session.sid and data == session.data and session.expires - now > self.ttl / 2:
+            return
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(32)
+        session.data, session.expires = data, now + self.ttl
+        self.store.put(session.sid, data, session.expires)
+        response.set_cookie(name, self._signer(app).sign(session.sid).decode('ascii'),
+                            expires=self.get_expiration_time(app, session), httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path, secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+
+class QueryHistory:
+    """The queries run from the SQL editor, the most recent size of them, newest first"""
+
+    def __init__(self, path, size=1000):
+        self.connections = _Connections(path)
+        self.size = int(size)
+
+    def add(self, server, sql):
+        conn = self.connections.get()
+        conn.execute("insert into history (sql, server, runs, last_run) values (?, ?, 1, ?) "
+                     "on conflict (sql) do update set server = excluded.server, runs = runs + 1, "
+                     "last_run = excluded.last_run", (sql, server, time.time()))
+        conn.execute("delete from history where sql not in (select sql from history order by last_run desc limit ?)",
+                     (self.size,))
+
+    def recent(self, limit=25):
+        return [row[0] for row in self.connections.get().execute(
+            "select sql from history order by last_run desc limit ?", (int(limit),))]
+
+    def search(self, term, limit=25):
+        """Returns with a list of {"sql", "server", "runs", "last_run"} of the queries containing term"""
+        term = str(term).replace('!', '!!').replace('%', '!%').replace('_', '!_')
+        rows = self.connections.get().execute(
+            "select sql, server, runs, last_run from history where sql like ? escape '!' "
+            "order by last_run desc limit ?", ('%' + term + '%', int(limit)))
+        return [{'sql': sql, 'server': server, 'runs': runs, 'last_run': last_run}
+                for sql, server, runs, last_run in rows]
+
+
+def install(app):
+    """Switches app to server side sessions as per the sessions: section of the config, returns with the history"""
+    settings = get_settings()
+    if settings['backend'] not in backends:
+        raise mdb.ConfigError(f"Unknown session backend: {settings['backend']}, use one of {', '.join(backends)}")
+    try:
+        if settings['backend'] == 'memory':
+            store = MemoryStore(settings['max_entries'])
+        else:
+            store = SQLiteStore(settings['path'])
+        app.session_interface = ServerSideSessionInterface(store, settings['ttl'])
+        return QueryHistory(settings['path'], settings['history_size'])
+    except (TypeError, ValueError, sqlite3.Error) as e:
+        raise mdb.ConfigError(f"Invalid sessions settings: {str(e)}")
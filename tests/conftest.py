@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# The app runs in-process on fake_proxysql.py, with a copy of config/config.yml in a temporary
+# working directory (the modules read config/config.yml relative to it).
+
+import os
+import sys
+
+import pytest
+import yaml
+
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [basedir, os.path.join(basedir, 'tests')]
+
+import fake_proxysql  # noqa: E402
+
+sizes = {'digests': 200, 'query_rules': 20, 'servers': 10, 'users': 10, 'variables': 20}
+
+
+def write_config(workdir):
+    with open(os.path.join(basedir, 'config', 'config.yml')) as f:
+        config = yaml.safe_load(f)
+    # a second server for the fan-out views; the fake backend ignores the DSN, both see the same tables
+    config['servers']['replica'] = dict(config['servers'][config['global']['default_server']])
+    config['sampler'] = {'enabled': False}
+    config['sessions'] = {'backend': 'memory'}
+    config['cache'] = {'max_entries': 256, 'default_ttl': 0, 'sql_ttl': 0, 'ttls': {}}
+    config['tracing'] = {'slow_ms': 60000}
+    os.makedirs(os.path.join(workdir, 'config'), exist_ok=True)
+    with open(os.path.join(workdir, 'config', 'config.yml'), 'w') as f:
+        yaml.safe_dump(config, f)
+    return config
+
+
+@pytest.fixture(scope='session')
+def config(tmp_path_factory):
+    """The config the app runs with; the working directory is its temporary directory for the whole session"""
+    fake_proxysql.install(sizes)
+    workdir = str(tmp_path_factory.mktemp('proxyweb'))
+    config = write_config(workdir)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    yield config
+    os.chdir(cwd)
+
+
+@pytest.fixture(scope='session')
+def proxyweb(config):
+    """The app module"""
+    import app
+    return app
+
+
+@pytest.fixture
+def server(config):
+    return config['global']['default_server']
+
+
+@pytest.fixture
+def client(proxyweb):
+    """A logged in test client; the / page initializes the rest of the session"""
+    client = proxyweb.app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+    client.get('/')
+    return client
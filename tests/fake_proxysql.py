@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# A stand-in for the ProxySQL admin interface, for the tests and the benchmark.
+#
+# ProxySQL's admin module is SQLite behind the MySQL protocol, so this is a drop-in for
+# mysql.connector.connect() whose connections run the queries on shared in-memory SQLite databases
+# (main, disk, stats, monitor) seeded with ProxySQL-like tables. The handful of admin-only
+# statements ProxyWeb sends (show databases/tables, LOAD/SAVE ..., SET ...) are emulated.
+
+import random
+import re
+import sqlite3
+import threading
+import time
+
+import mysql.connector
+
+databases = ('main', 'disk', 'stats', 'monitor')
+
+# default table sizes, see seed()
+default_sizes = {'digests': 50000, 'query_rules': 2000, 'servers': 200, 'users': 100, 'variables': 300}
+
+schemas = {
+    'mysql_servers': "hostgroup_id INT, hostname VARCHAR, port INT, gtid_port INT, status VARCHAR, weight INT, "
+                     "compression INT, max_connections INT, max_replication_lag INT, use_ssl INT, "
+                     "max_latency_ms INT, comment VARCHAR",
+    'mysql_users': "username VARCHAR, password VARCHAR, active INT, use_ssl INT, default_hostgroup INT, "
+                   "default_schema VARCHAR, schema_locked INT, transaction_persistent INT, fast_forward INT, "
+                   "backend INT, frontend INT, max_connections INT, comment VARCHAR",
+    'mysql_query_rules': "rule_id INT PRIMARY KEY, active INT, username VARCHAR, schemaname VARCHAR, flagIN INT, "
+                         "client_addr VARCHAR, digest VARCHAR, match_digest VARCHAR, match_pattern VARCHAR, "
+                         "negate_match_pattern INT, re_modifiers VARCHAR, flagOUT INT, replace_pattern VARCHAR, "
+                         "destination_hostgroup INT, cache_ttl INT, multiplex INT, apply INT, comment VARCHAR",
+    'global_variables': "variable_name VARCHAR PRIMARY KEY, variable_value VARCHAR",
+    'mysql_replication_hostgroups': "writer_hostgroup INT, reader_hostgroup INT, check_type VARCHAR, comment VARCHAR",
+    'runtime_checksums_values': "name VARCHAR, version INT, epoch INT, checksum VARCHAR",
+}
+stats_schemas = {
+    'stats_mysql_query_digest': "hostgroup INT, schemaname VARCHAR, username VARCHAR, client_address VARCHAR, "
+                                "digest VARCHAR, digest_text VARCHAR, count_star INTEGER, first_seen INTEGER, "
+                                "last_seen INTEGER, sum_time INTEGER, min_time INTEGER, max_time INTEGER, "
+                                "sum_rows_affected INTEGER, sum_rows_sent INTEGER",
+    'stats_mysql_connection_pool': "hostgroup INT, srv_host VARCHAR, srv_port INT, status VARCHAR, ConnUsed INT, "
+                                   "ConnFree INT, ConnOK INT, ConnERR INT, MaxConnUsed INT, Queries INT, "
+                                   "Queries_GTID_sync INT, Bytes_data_sent INT, Bytes_data_recv INT, Latency_us INT",
+    'stats_mysql_global': "Variable_Name VARCHAR, Variable_Value VARCHAR",
+    'stats_mysql_processlist': "ThreadID INT, SessionID INTEGER, user VARCHAR, db VARCHAR, cli_host VARCHAR, "
+                               "cli_port INT, hostgroup INT, l_srv_host VARCHAR, l_srv_port INT, srv_host VARCHAR, "
+                               "srv_port INT, command VARCHAR, time_ms INT, info VARCHAR",
+}
+
+_keeper = None
+_lock = threading.Lock()
+_uri = "file:proxyweb_fake_%s?mode=memory&cache=shared"
+
+# simulated server side latency per statement, seconds
+latency = 0.0
+
+
+def _open():
+    conn = sqlite3.connect(_uri % 'main', uri=True, check_same_thread=False, isolation_level=None)
+    for database in databases[1:]:
+        conn.execute("ATTACH DATABASE ? AS %s" % database, (_uri % database,))
+    return conn
+
+
+def seed(sizes=None, rng_seed=42):
+    """Creates and fills the shared in-memory databases; they live as long as this module"""
+    global _keeper
+    sizes = dict(default_sizes, **(sizes or {}))
+    rng = random.Random(rng_seed)
+    with _lock:
+        _keeper = _open()
+        c = _keeper
+        for database in ('main', 'disk'):
+            for table, columns in schemas.items():
+                c.execute("DROP TABLE IF EXISTS %s.%s" % (database, table))
+                c.execute("CREATE TABLE %s.%s (%s)" % (database, table, columns))
+                if database == 'main' and table != 'runtime_checksums_values' and not table.startswith('global'):
+                    c.execute("DROP TABLE IF EXISTS main.runtime_%s" % table)
+                    c.execute("CREATE TABLE main.runtime_%s (%s)" % (table, columns))
+        for table, columns in stats_schemas.items():
+            c.execute("DROP TABLE IF EXISTS stats.%s" % table)
+            c.execute("CREATE TABLE stats.%s (%s)" % (table, columns))
+        c.execute("DROP TABLE IF EXISTS monitor.mysql_server_ping_log")
+        c.execute("CREATE TABLE monitor.mysql_server_ping_log (hostname VARCHAR, port INT, time_start_us INT, "
+                  "ping_success_time_us INT, ping_error VARCHAR)")
+
+        now = int(time.time())
+        servers = [(rng.choice((1, 2, 3)), "db%d.example.com" % i, 3306, 0, 'ONLINE', 1000, 0, 1000, 0, 0, 0,
+                    "server %d" % i) for i in range(sizes['servers'])]
+        users = [("user%d" % i, "*PW%d" % i, 1, 0, 1, "schema%d" % (i % 20), 0, 0, 0, 1, 1, 10000, "")
+                 for i in range(sizes['users'])]
+        rules = [(i, 1, rng.choice((None, "user%d" % (i % 50))), rng.choice((None, "schema%d" % (i % 20))), 0, None,
+                  None, rng.choice(("^SELECT .* FOR UPDATE", "^SELECT", "^INSERT", "^UPDATE t%d " % i,
+                                    "^SELECT .* FROM t%d" % i)),
+                  None, 0, 'CASELESS', None, None, rng.choice((1, 2, 3)), None, None, 1, "rule %d" % i)
+                 for i in range(1, sizes['query_rules'] + 1)]
+        variables = [("mysql-variable_%d" % i, str(i)) for i in range(sizes['variables'])]
+        for table, rows in (('mysql_servers', servers), ('mysql_users', users), ('mysql_query_rules', rules)):
+            placeholders = ",".join("?" * len(rows[0])) if rows else ""
+            for name in ('main.%s' % table, 'main.runtime_%s' % table, 'disk.%s' % table):
+                if rows:
+                    c.executemany("INSERT INTO %s VALUES (%s)" % (name, placeholders), rows)
+        c.executemany("INSERT INTO main.global_variables VALUES (?, ?)", variables)
+        c.executemany("INSERT INTO main.runtime_checksums_values VALUES (?, ?, ?, ?)",
+                      [(name, 1, now, "0x%016X" % rng.getrandbits(64)) for name in
+                       ('admin_variables', 'mysql_query_rules', 'mysql_servers', 'mysql_users', 'mysql_variables',
+                        'proxysql_servers')])
+
+        verbs = ("SELECT * FROM t%d WHERE id = ?", "SELECT a, b FROM t%d WHERE c IN (...)",
+                 "INSERT INTO t%d VALUES (...)", "UPDATE t%d SET a = ? WHERE id = ?", "DELETE FROM t%d WHERE id = ?")
+        digests = []
+        for i in range(sizes['digests']):
+            count = rng.randint(1, 1000000)
+            digests.append((rng.choice((1, 2, 3)), "schema%d" % (i % 20), "user%d" % (i % 50), "",
+                            "0x%016X" % rng.getrandbits(64), rng.choice(verbs) % (i % 500), count,
+                            now - rng.randint(3600, 86400 * 30), now - rng.randint(0, 3600),
+                            count * rng.randint(100, 5000), 50, 100000, 0, count))
+        c.executemany("INSERT INTO stats.stats_mysql_query_digest VALUES (%s)" % ",".join("?" * 14), digests)
+        c.executemany("INSERT INTO stats.stats_mysql_connection_pool VALUES (%s)" % ",".join("?" * 14),
+                      [(s[0], s[1], s[2], 'ONLINE', rng.randint(0, 50), rng.randint(0, 50), rng.randint(0, 10 ** 6),
+                        rng.randint(0, 100), 100, rng.randint(0, 10 ** 8), 0, rng.randint(0, 10 ** 10),
+                        rng.randint(0, 10 ** 10), rng.randint(100, 5000)) for s in servers])
+        c.executemany("INSERT INTO stats.stats_mysql_global VALUES (?, ?)",
+                      [("Global_Variable_%d" % i, str(rng.randint(0, 10 ** 9))) for i in range(150)])
+    return sizes
+
+
+class FakeCursor:
+
+    def __init__(self, conn, dictionary=False):
+        self._conn = conn
+        self._dictionary = dictionary
+        self._rows = []
+        self.description = None
+        self.rowcount = -1
+        self.with_rows = False
+
+    def _emulate(self, sql):
+        """Returns with (column_names, rows) for the statements only ProxySQL's admin understands, None otherwise"""
+        stripped = sql.strip().rstrip(';').strip()
+        if re.match(r'(?i)^show\s+databases$', stripped):
+            return ['seq', 'name', 'file'], [(i, name, '') for i, name in enumerate(databases)]
+        m = re.match(r'(?i)^show\s+tables\s+from\s+`?(\w+)`?$', stripped)
+        if m:
+            rows = self._conn.execute("SELECT name FROM %s.sqlite_master WHERE type='table' ORDER BY name"
+                                      % m.group(1)).fetchall()
+            return ['tables'], rows
+        if re.match(r'(?i)^(load|save|set|select\s+config)\b', stripped):
+            return [], []
+        return None
+
+    def execute(self, sql, params=None):
+        if latency:
+            time.sleep(latency)
+        try:
+            emulated = self._emulate(sql)
+            if emulated is None:
+                # the connector's %s placeholders are sqlite's ?
+                cur = self._conn.execute(sql.strip().rstrip(';').replace('%s', '?') if params else
+                                         sql.strip().rstrip(';'), params or ())
+                column_names = [d[0] for d in cur.description] if cur.description else []
+                rows = cur.fetchall() if cur.description else []
+                self.rowcount = cur.rowcount
+            else:
+                column_names, rows = emulated
+                self.rowcount = 0
+        except sqlite3.Error as e:
+            raise mysql.connector.errors.ProgrammingError(msg=str(e))
+        self.description = [(name, None, None, None, None, None, True) for name in column_names] or None
+        self.with_rows = bool(column_names)
+        if self._dictionary:
+            rows = [dict(zip(column_names, row)) for row in rows]
+        self._rows = rows
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchmany(self, size=1):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def close(self):
+        self._rows = []
+
+
+class FakeConnection:
+    unread_result = False
+
+    def __init__(self):
+        self._conn = _open()
+        self.autocommit = True
+        self.get_warnings = False
+
+    def cursor(self, buffered=False, dictionary=False):
+        return FakeCursor(self._conn, dictionary=dictionary)
+
+    def ping(self, reconnect=False):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self._conn.close()
+
+
+def connect(**kwargs):
+    """Same signature as mysql.connector.connect(), the DSN is ignored"""
+    if _keeper is None:
+        raise mysql.connector.errors.InterfaceError(msg="fake_proxysql.seed() has not been called")
+    return FakeConnection()
+
+
+def install(sizes=None):
+    """Seeds the fake backend and routes every mysql.connector.connect() call to it"""
+    sizes = seed(sizes)
+    mysql.connector.connect = connect
+    return sizes
@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# The adhoc report, its queries running in parallel on pooled connections.
+
+import threading
+import time
+
+import pytest
+
+import mdb
+
+
+def _sleep_and_return(seconds, value):
+    time.sleep(seconds)
+    if isinstance(value, Exception):
+        raise value
+    return value
+
+
+def test_results_come_back_in_the_order_of_the_calls():
+    calls = [(0.05, 'slow'), (0.0, 'fast'), (0.0, ValueError("broken"))]
+    outcomes = mdb.run_concurrently(_sleep_and_return, calls, concurrency=3, timeout=5)
+    assert [(result, error) for result, error, elapsed in outcomes] == [('slow', None), ('fast', None),
+                                                                       (None, 'broken')]
+    assert outcomes[0][2] >= 0.05
+    assert mdb.run_concurrently(_sleep_and_return, [], concurrency=3, timeout=5) == []
+
+
+def test_concurrency_limits_the_threads():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def call(n):
+        with lock:
+            running.append(n)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(n)
+        return n
+    outcomes = mdb.run_concurrently(call, [(n,) for n in range(6)], concurrency=2, timeout=5)
+    assert [result for result, error, elapsed in outcomes] == list(range(6))
+    assert max(peak) == 2
+
+
+def test_a_call_over_the_timeout_is_abandoned():
+    started = time.monotonic()
+    outcomes = mdb.run_concurrently(_sleep_and_return, [(1, 'late'), (0, 'early')], concurrency=2, timeout=0.1)
+    assert time.monotonic() - started < 0.8
+    assert outcomes[0][0] is None and outcomes[0][1] == "Timed out after 0.1 seconds"
+    assert outcomes[1][:2] == ('early', None)
+
+
+def test_the_timeout_counts_from_the_start_of_each_call():
+    # with one thread the second call starts after the first one, it gets its own full timeout
+    outcomes = mdb.run_concurrently(_sleep_and_return, [(0.1, 'first'), (0.1, 'second')], concurrency=1,
+                                    timeout=0.15)
+    assert [error for result, error, elapsed in outcomes] == [None, None]
+
+
+@pytest.fixture
+def adhoc_items(config, monkeypatch):
+    """Replaces the adhoc_report items of the loaded config"""
+    def replace(items):
+        monkeypatch.setitem(mdb.get_config()['misc'], 'adhoc_report', items)
+    return replace
+
+
+def test_report_runs_every_item(config, server):
+    results = mdb.execute_adhoc_report(None, server)
+    assert [r['title'] for r in results] == [item['title'] for item in config['misc']['adhoc_report']]
+    for result in results:
+        assert result['error'] is None
+        assert result['row_count'] == len(result['rows'])
+        assert result['column_names']
+
+
+def test_a_failing_item_only_breaks_itself(config, server, adhoc_items):
+    adhoc_items([{'title': 'broken', 'sql': 'SELECT * FROM stats.no_such_table'},
+                 {'title': 'fine', 'sql': 'SELECT count(*) AS n FROM stats.stats_mysql_query_digest'}])
+    broken, fine = mdb.execute_adhoc_report(None, server)
+    assert 'no_such_table' in broken['error'] and broken['rows'] == []
+    assert fine['error'] is None and fine['column_names'] == ['n']
+
+
+def test_report_page(client, server, adhoc_items):
+    adhoc_items([{'title': 'Digest count', 'sql': 'SELECT count(*) FROM stats.stats_mysql_query_digest'},
+                 {'title': 'Broken item', 'sql': 'SELECT * FROM stats.no_such_table'}])
+    response = client.get('/%s/adhoc/' % server)
+    assert response.status_code == 200
+    assert b'Digest count' in response.data and b'Broken item' in response.data
+    assert b'no_such_table' in response.data
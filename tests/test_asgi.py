@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# The async serving mode: the read paths are fetched on aiomysql before the Flask view runs.
+
+import asyncio
+import threading
+import urllib.parse
+
+import pytest
+
+pytest.importorskip('a2wsgi')
+aiomysql = pytest.importorskip('aiomysql')
+import pymysql  # noqa: E402
+
+import fake_proxysql  # noqa: E402
+import mdb  # noqa: E402
+
+digest_page = ('/%s/stats/stats_mysql_query_digest/data/?draw=1&start=0&length=10'
+               '&order[0][column]=6&order[0][dir]=desc&search[value]=')
+
+
+class FakeCursor:
+    """aiomysql's cursor over a fake_proxysql connection"""
+
+    def __init__(self, conn, queries):
+        self.cursor = conn.cursor()
+        self.queries = queries
+        self.description = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, sql):
+        self.queries.append(sql)
+        try:
+            self.cursor.execute(sql)
+        except mdb.mysql.connector.Error as e:
+            raise pymysql.err.ProgrammingError(1064, str(e))
+        self.description = self.cursor.description
+
+    async def fetchall(self):
+        return tuple(tuple(row) for row in self.cursor.fetchall())
+
+
+class FakeConnection:
+
+    def __init__(self, queries):
+        self.conn = fake_proxysql.connect()
+        self.queries = queries
+
+    def cursor(self):
+        return FakeCursor(self.conn, self.queries)
+
+    def close(self):
+        self.conn.close()
+
+
+class FakePool:
+
+    def __init__(self, queries):
+        self.queries = queries
+
+    async def acquire(self):
+        return FakeConnection(self.queries)
+
+    def release(self, conn):
+        pass
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+@pytest.fixture
+def asgi(proxyweb, monkeypatch):
+    """The asgi module on a fake aiomysql; asgi.queries has the SQL the async side ran"""
+    import amdb
+    import asgi
+    queries = []
+
+    async def create_pool(**kwargs):
+        return FakePool(queries)
+    monkeypatch.setattr(aiomysql, 'create_pool', create_pool)
+    monkeypatch.setattr(asgi, 'queries', queries, raising=False)
+    asyncio.run(amdb.close_pools())
+    yield asgi
+    asyncio.run(amdb.close_pools())
+
+
+@pytest.fixture
+def cookie(proxyweb, client):
+    """The Cookie header of the logged in test client"""
+    name = proxyweb.app.config['SESSION_COOKIE_NAME']
+    return ('%s=%s' % (name, client.get_cookie(name).value)).encode('latin-1')
+
+
+def _call(asgi, method, path, cookie=None, chunks=(), headers=()):
+    """Runs one request through the ASGI app, returns with (status, headers, body)"""
+    path, _, query = path.partition('?')
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+             'path': path, 'raw_path': path.encode(), 'query_string': query.encode('latin-1'), 'root_path': '',
+             'headers': [(b'host', b'localhost')] + list(headers) + ([(b'cookie', cookie)] if cookie else []),
+             'client': ('127.0.0.1', 50000), 'server': ('localhost', 80)}
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': n < len(chunks) - 1}
+                for n, chunk in enumerate(chunks)] or [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi.app(scope, receive, send))
+    start = sent[0]
+    return start['status'], dict(start['headers']), b''.join(m.get('body', b'') for m in sent[1:])
+
+
+def test_table_page_is_prefetched(asgi, server, cookie, monkeypatch):
+    def blocking(*args, **kwargs):
+        raise AssertionError("the view queried the blocking way")
+    monkeypatch.setattr(mdb, 'get_table_page', blocking)
+    status, headers, body = _call(asgi, 'GET', digest_page % server, cookie)
+    assert status == 200
+    assert b'"recordsTotal"' in body
+    assert any('stats_mysql_query_digest' in sql for sql in asgi.queries)
+
+
+def test_anonymous_requests_are_not_prefetched(asgi, server):
+    status, headers, body = _call(asgi, 'GET', digest_page % server)
+    assert status == 302
+    assert asgi.queries == []
+
+
+def test_the_session_is_read_off_the_event_loop(asgi, server, cookie, monkeypatch):
+    threads = []
+    logged_in = asgi._logged_in
+
+    def recording(headers):
+        threads.append(threading.current_thread())
+        return logged_in(headers)
+    monkeypatch.setattr(asgi, '_logged_in', recording)
+    _call(asgi, 'GET', digest_page % server, cookie)
+    assert threads and threads[0] is not threading.main_thread()
+
+
+def _sql_form(sql):
+    return urllib.parse.urlencode({'sql': sql}).encode()
+
+
+def test_select_form_is_read_ahead(asgi, server, cookie):
+    sql = "SELECT variable_name FROM main.global_variables WHERE variable_name = 'mysql-variable_7'"
+    body = _sql_form(sql)
+    status, headers, page = _call(asgi, 'POST', '/%s/main/global_variables/sql/' % server, cookie,
+                                  chunks=[body[:10], body[10:]],
+                                  headers=[(b'content-type', b'application/x-www-form-urlencoded'),
+                                           (b'content-length', str(len(body)).encode())])
+    assert status == 200
+    assert b'mysql-variable_7' in page
+    assert sql in asgi.queries
+
+
+def test_large_chunked_form_is_left_to_the_view(asgi, server, cookie, monkeypatch):
+    monkeypatch.setattr(asgi, 'max_form_bytes', 64)
+    sql = "SELECT variable_name FROM main.global_variables WHERE variable_name = 'mysql-variable_8'"
+    body = _sql_form(sql)
+    # no Content-Length: the body is only read until it passes max_form_bytes, the view runs without prefetching
+    chunks = [body[i:i + 16] for i in range(0, len(body), 16)]
+    status, headers, page = _call(asgi, 'POST', '/%s/main/global_variables/sql/' % server, cookie, chunks=chunks,
+                                  headers=[(b'content-type', b'application/x-www-form-urlencoded')])
+    assert status == 200
+    assert not any('mysql-variable_8' in sql for sql in asgi.queries)
+
+
+def test_read_body_stops_past_the_limit(asgi):
+    async def read(chunks, limit):
+        messages = [{'type': 'http.request', 'body': chunk, 'more_body': n < len(chunks) - 1}
+                    for n, chunk in enumerate(chunks)]
+
+        async def receive():
+            return messages.pop(0)
+        body, complete = await asgi._read_body(receive, limit)
+        replayed = asgi._replay(body, receive, more_body=not complete)
+        rest = [await replayed()]
+        while rest[-1]['more_body']:
+            rest.append(await replayed())
+        return body, complete, b''.join(m['body'] for m in rest), len(messages)
+
+    assert asyncio.run(read([b'ab', b'cd'], 10)) == (b'abcd', True, b'abcd', 0)
+    # stops reading after the chunk passing the limit, the replay hands out the rest
+    assert asyncio.run(read([b'abc', b'def', b'ghi', b'jkl'], 5)) == (b'abcdef', False, b'abcdefghijkl', 0)
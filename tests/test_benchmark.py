@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# The benchmark runs against the fake backend and reports every scenario.
+
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+
+from conftest import basedir
+
+script = os.path.join(basedir, 'benchmark', 'run.py')
+
+
+def _load_benchmark():
+    spec = importlib.util.spec_from_file_location('benchmark_run', script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_percentile():
+    run = _load_benchmark()
+    values = [float(n) for n in range(1, 101)]
+    assert run.percentile(values, 50) == 51
+    assert run.percentile(values, 99) == 99
+    assert run.percentile(values, 100) == 100
+    assert run.percentile([], 50) is None
+
+
+def test_every_scenario_runs_without_errors(tmp_path):
+    output = tmp_path / 'bench.json'
+    finished = subprocess.run([sys.executable, script, '--requests', '4', '--warmup', '1', '--concurrency', '2',
+                               '--digests', '300', '--query-rules', '50', '--servers', '10',
+                               '--output', str(output)], cwd=str(tmp_path), capture_output=True, text=True,
+                              timeout=300)
+    assert finished.returncode == 0, finished.stderr
+    report = json.loads(output.read_text())
+    assert report['settings']['sizes']['digests'] == 300
+    for name, result in report['scenarios'].items():
+        assert result['requests'] == 4, name
+        assert result['errors'] == 0, name
+        assert result['p50_ms'] <= result['p99_ms'] <= result['max_ms']
+
+
+def test_unknown_scenario_is_rejected(tmp_path):
+    finished = subprocess.run([sys.executable, script, '--scenarios', 'no_such_page'], cwd=str(tmp_path),
+                              capture_output=True, text=True, timeout=60)
+    assert finished.returncode == 2
+    assert 'no_such_page' in finished.stderr
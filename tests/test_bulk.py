@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# Bulk import: parsing and validating the files, the statements built from them, loading them.
+
+import io
+
+import pytest
+
+import bulk
+import mdb
+
+
+def test_parse_csv():
+    rows = bulk.parse(b"\xef\xbb\xbfhostgroup_id, hostname,comment\n10,db1,\\N\n20,db2,\n\n", 'csv')
+    assert rows == [{'hostgroup_id': '10', 'hostname': 'db1', 'comment': None},
+                    {'hostgroup_id': '20', 'hostname': 'db2'}]
+
+
+def test_parse_yaml():
+    assert bulk.parse("- {hostgroup_id: 10, hostname: db1, comment: null}", 'yml') == \
+        [{'hostgroup_id': 10, 'hostname': 'db1', 'comment': None}]
+    assert bulk.parse("rows:\n  - {hostname: db1}\n", 'yaml') == [{'hostname': 'db1'}]
+
+
+@pytest.mark.parametrize('data, fmt, message', [
+    (b"", 'csv', "empty"),
+    (b"hostgroup_id,hostname\n10\n", 'csv', "line 2"),
+    (b"[unclosed", 'yaml', "YAML"),
+    (b"hostname: db1", 'yaml', "list"),
+    (b"- db1\n- db2", 'yaml', "list"),
+    (b"hostname\n", 'json', "Unsupported format"),
+    ("hostname\ndb\xe9\n".encode('latin-1'), 'csv', "UTF-8"),
+])
+def test_invalid_files(data, fmt, message):
+    with pytest.raises(mdb.ValidationError, match=message):
+        bulk.parse(data, fmt)
+
+
+def test_rows_with_the_same_columns_share_statements():
+    rows = [{'hostname': 'a', 'port': 1}, {'hostname': 'b'}, {'hostname': 'c', 'port': 3}]
+    statements = bulk.build_statements('mysql_servers', rows, mode='replace', batch_size=1)
+    assert [(sql.split(' VALUES ')[0], params, count) for sql, params, count in statements] == [
+        ("REPLACE INTO main.`mysql_servers` (`hostname`, `port`)", ['a', 1], 1),
+        ("REPLACE INTO main.`mysql_servers` (`hostname`, `port`)", ['c', 3], 1),
+        ("REPLACE INTO main.`mysql_servers` (`hostname`)", ['b'], 1)]
+    statements = bulk.build_statements('mysql_servers', rows)
+    assert [count for sql, params, count in statements] == [2, 1]
+    assert statements[0][0].endswith("VALUES (%s, %s), (%s, %s)")
+    with pytest.raises(mdb.ValidationError):
+        bulk.build_statements('mysql_servers', [{}])
+
+
+def test_load_validates_before_writing(config, server, monkeypatch):
+    rows = [{'hostgroup_id': 10, 'hostname': 'bulk-test'}]
+    with pytest.raises(mdb.ValidationError, match="supported"):
+        bulk.load(server, 'global_variables', rows)
+    with pytest.raises(mdb.ValidationError, match="mode"):
+        bulk.load(server, 'mysql_servers', rows, mode='upsert')
+    with pytest.raises(mdb.ValidationError, match="no rows"):
+        bulk.load(server, 'mysql_servers', [])
+    with pytest.raises(mdb.ValidationError, match="Unknown column"):
+        bulk.load(server, 'mysql_servers', [{'hostname': 'bulk-test', 'no_such_column': 1}])
+    monkeypatch.setattr(mdb, 'get_read_only', lambda server: True)
+    with pytest.raises(mdb.ValidationError, match="read-only"):
+        bulk.load(server, 'mysql_servers', rows)
+
+
+def _servers(server, hostname):
+    return mdb.fetch_query(server, "SELECT hostgroup_id, hostname, port FROM main.mysql_servers "
+                                    "WHERE hostname LIKE '%s%%' ORDER BY hostname" % hostname)[1]
+
+
+def test_load_writes_the_rows_in_one_transaction(config, server):
+    rows = bulk.parse(b"HOSTGROUP_ID,hostname,port\n10,bulk-ok-1,3306\n10,bulk-ok-2,\n", 'csv')
+    results = bulk.load(server, 'mysql_servers', rows, load_to_runtime=True)
+    assert [result['status'] for result in results] == ['ok', 'ok', 'ok', 'ok', 'ok']
+    assert [result['sql'] for result in results][-1] == "LOAD MYSQL SERVERS TO RUNTIME"
+    assert [tuple(row[:2]) for row in _servers(server, 'bulk-ok')] == [(10, 'bulk-ok-1'), (10, 'bulk-ok-2')]
+
+
+def test_a_failing_statement_rolls_the_import_back(config, server, monkeypatch):
+    build_statements = bulk.build_statements
+
+    def failing(*args, **kwargs):
+        return build_statements(*args, **kwargs) + [("INSERT INTO main.no_such_table (a) VALUES (%s)", [1], 1)]
+    monkeypatch.setattr(bulk, 'build_statements', failing)
+    results = bulk.load(server, 'mysql_servers', [{'hostgroup_id': 10, 'hostname': 'bulk-rollback'}],
+                        load_to_runtime=True)
+    assert [result['status'] for result in results] == ['ok', 'ok', 'error', 'skipped', 'skipped', 'ok']
+    assert results[-1]['sql'] == 'ROLLBACK'
+    assert _servers(server, 'bulk-rollback') == []
+
+
+def test_upload_through_the_import_page(client, server):
+    data = {'file': (io.BytesIO("hostname\ndb\xe9\n".encode('latin-1')), 'servers.csv')}
+    response = client.post('/%s/main/mysql_servers/import/' % server, data=data,
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert b'VALIDATION ERROR' in response.data and b'UTF-8' in response.data
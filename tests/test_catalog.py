@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# The shared, TTL-cached list of the databases and tables of a server.
+
+import time
+
+import pytest
+
+import mdb
+
+
+def test_catalog_lists_every_database(config, server):
+    catalog = mdb.get_catalog(server, refresh=True)
+    assert sorted(catalog) == ['disk', 'main', 'monitor', 'stats']
+    assert 'mysql_query_rules' in catalog['main']
+    assert 'stats_mysql_query_digest' in catalog['stats']
+
+
+def test_catalog_is_cached_until_refreshed_or_expired(config, server):
+    mdb.get_catalog(server, refresh=True)
+    cached = mdb.catalog_cache[server]
+    mdb.get_catalog(server)
+    assert mdb.catalog_cache[server] is cached
+    mdb.get_catalog(server, refresh=True)
+    assert mdb.catalog_cache[server] is not cached
+
+    cached = mdb.catalog_cache[server]
+    cached.expires = time.monotonic() - 1
+    mdb.get_catalog(server)
+    assert mdb.catalog_cache[server] is not cached
+
+
+def test_hidden_tables_are_left_out(config, server, monkeypatch):
+    monkeypatch.setattr(mdb, 'get_hide_tables', lambda server, config="config/config.yml": {'mysql_users'})
+    visible = mdb.get_catalog(server, refresh=True)
+    assert 'mysql_users' not in visible['main']
+    assert 'mysql_servers' in visible['main']
+    assert 'mysql_users' in mdb.get_full_catalog(server)['main']
+
+
+def test_union_query_falls_back_to_show_tables(config, server, monkeypatch):
+    expected = mdb.get_catalog(server, refresh=True)
+    monkeypatch.setattr(mdb, 'catalog_union_sql', lambda databases: "select * from no_such_table")
+    assert mdb.get_catalog(server, refresh=True) == expected
+
+
+def test_unreachable_server_raises_a_database_error(config, server, monkeypatch):
+    def fail(server):
+        raise mdb.mysql.connector.errors.InterfaceError(msg="connection refused")
+    monkeypatch.setattr(mdb, '_fetch_catalog', fail)
+    with pytest.raises(mdb.DatabaseError, match='connection refused'):
+        mdb.get_catalog(server, refresh=True)
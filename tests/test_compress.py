@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# gzip/brotli compression of the responses and the ETags of the compressed ones.
+
+import gzip
+
+from flask import Response
+
+import compress
+
+gzip_only = {'Accept-Encoding': 'gzip'}
+data_url = '/%s/stats/stats_mysql_query_digest/data/?draw=1&start=0&length=50'
+
+
+def test_pages_are_gzipped(client, server):
+    plain = client.get(data_url % server)
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    gzipped = client.get(data_url % server, headers=gzip_only)
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in gzipped.headers['Vary']
+    assert gzip.decompress(gzipped.data) == plain.data
+    assert len(gzipped.data) < len(plain.data)
+
+
+def test_brotli_is_preferred_when_installed(client, server):
+    response = client.get(data_url % server, headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == ('br' if compress.brotli else 'gzip')
+
+
+def test_the_etag_of_a_compressed_response_still_matches(client, server):
+    plain_etag = client.get(data_url % server).headers['ETag']
+    gzipped = client.get(data_url % server, headers=gzip_only)
+    assert gzipped.headers['ETag'] == plain_etag[:-1] + '-gzip"'
+    # the browser sends back what it got, with either encoding
+    for etag in (gzipped.headers['ETag'], plain_etag):
+        response = client.get(data_url % server, headers=dict(gzip_only, **{'If-None-Match': etag}))
+        assert response.status_code == 304
+        assert 'Content-Encoding' not in response.headers
+
+
+def test_streamed_exports_stay_streamed(client, server):
+    response = client.get('/%s/stats/stats_mysql_query_digest/export.csv' % server, headers=gzip_only)
+    assert response.is_streamed
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    lines = gzip.decompress(response.data).decode('utf-8').splitlines()
+    assert lines[0].startswith('hostgroup,')
+    assert len(lines) > 100
+
+
+def test_gzipped_exports_are_not_compressed_twice(client, server):
+    response = client.get('/%s/stats/stats_mysql_query_digest/export.csv?gzip=1' % server, headers=gzip_only)
+    assert 'Content-Encoding' not in response.headers
+    assert gzip.decompress(response.data).decode('utf-8').startswith('hostgroup,')
+
+
+def _compressed(proxyweb, response, headers=gzip_only, method='GET'):
+    with proxyweb.app.test_request_context('/', method=method, headers=headers):
+        return compress.compress_response(response)
+
+
+def test_what_is_left_alone(proxyweb):
+    assert 'Content-Encoding' not in _compressed(proxyweb, Response('x' * 100, mimetype='text/html')).headers
+    assert 'Content-Encoding' not in _compressed(proxyweb, Response('x' * 5000, mimetype='image/png')).headers
+    assert 'Content-Encoding' not in _compressed(
+        proxyweb, Response('data: x\n\n' * 1000, mimetype='text/event-stream')).headers
+    assert 'Content-Encoding' not in _compressed(
+        proxyweb, Response('x' * 5000, mimetype='text/html', status=500)).headers
+    assert 'Content-Encoding' not in _compressed(proxyweb, Response('x' * 5000, mimetype='text/html'),
+                                                 headers={}).headers
+    assert 'Content-Encoding' not in _compressed(proxyweb, Response('x' * 5000, mimetype='text/html'),
+                                                 method='HEAD').headers
+    assert _compressed(proxyweb, Response('x' * 5000, mimetype='text/html')).headers['Content-Encoding'] == 'gzip'
+
+
+def test_a_broken_config_falls_back_to_the_defaults(proxyweb, monkeypatch):
+    def broken():
+        raise compress.mdb.ConfigError("YAML parsing error")
+    monkeypatch.setattr(compress.mdb, '_load_config', lambda config: broken())
+    assert compress.get_settings() is compress.defaults
+    assert _compressed(proxyweb, Response('x' * 5000, mimetype='text/html')).headers['Content-Encoding'] == 'gzip'
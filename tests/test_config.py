@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# The parsed config cache of mdb.py: reloaded when the file changes, or when it's invalidated.
+
+import os
+
+import pytest
+
+import mdb
+
+base_config = """
+global:
+  read_only: false
+  hide_tables: ['scheduler']
+servers:
+  proxysql:
+    dsn: [{host: localhost, user: admin, passwd: admin, port: 6032}]
+  replica:
+    read_only: true
+    hide_tables: []
+    dsn: [{host: replica, user: admin, passwd: admin, port: 6032}]
+"""
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    for name in ('PROXYSQL_HOST', 'PROXYSQL_PORT', 'PROXYSQL_USER', 'PROXYSQL_PASSWORD', 'ADMIN_USER',
+                 'ADMIN_PASSWORD', 'SECRET_KEY'):
+        monkeypatch.delenv(name, raising=False)
+    path = tmp_path / 'config.yml'
+    path.write_text(base_config)
+    yield str(path)
+    mdb.invalidate_config(str(path))
+
+
+def test_unchanged_file_is_parsed_once(config_file):
+    reloads = mdb.config_reloads
+    first = mdb.get_config(config_file)
+    assert mdb.get_config(config_file) is first
+    assert mdb.config_reloads == reloads + 1
+
+
+def test_changed_file_is_reloaded(config_file):
+    assert mdb.get_config(config_file)['global']['read_only'] is False
+    with open(config_file, 'w') as f:
+        f.write(base_config.replace('read_only: false', 'read_only: true'))
+    assert mdb.get_config(config_file)['global']['read_only'] is True
+
+
+def test_invalidate_rereads_a_file_with_the_same_stamp(config_file):
+    first = mdb.get_config(config_file)
+    st = os.stat(config_file)
+    # same size and mtime: the stat based check can't see the change
+    with open(config_file, 'w') as f:
+        f.write(base_config.replace('localhost', 'otherhost'))
+    os.utime(config_file, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert mdb.get_config(config_file) is first
+    mdb.invalidate_config(config_file)
+    assert mdb.get_config(config_file)['servers']['proxysql']['dsn'][0]['host'] == 'otherhost'
+
+
+def test_derived_views_follow_the_reload(config_file):
+    loaded = mdb._load_config(config_file)
+    assert loaded.servers == ['proxysql', 'replica']
+    assert loaded.read_only == {'proxysql': False, 'replica': True}
+    assert mdb.get_hide_tables('proxysql', config_file) == {'scheduler'}
+    assert mdb.get_hide_tables('replica', config_file) == frozenset()
+    with open(config_file, 'w') as f:
+        f.write(base_config.replace("hide_tables: ['scheduler']", "hide_tables: ['scheduler', 'restapi_routes']"))
+    assert mdb.get_hide_tables('proxysql', config_file) == {'scheduler', 'restapi_routes'}
+    with pytest.raises(mdb.ConfigError):
+        mdb.get_hide_tables('missing', config_file)
+
+
+def test_broken_file_raises_instead_of_serving_the_old_copy(config_file):
+    mdb.get_config(config_file)
+    with open(config_file, 'w') as f:
+        f.write("servers: [unclosed")
+    with pytest.raises(mdb.ConfigError):
+        mdb.get_config(config_file)
+    with open(config_file, 'w') as f:
+        f.write("")
+    with pytest.raises(mdb.ConfigError):
+        mdb.get_config(config_file)
+
+
+def test_missing_file(tmp_path):
+    with pytest.raises(mdb.ConfigError):
+        mdb.get_config(str(tmp_path / 'missing.yml'))
+
+
+def test_sections_are_cached_per_load_and_fall_back_to_the_defaults(config_file):
+    defaults = {'enabled': True, 'level': 1}
+    with open(config_file, 'a') as f:
+        f.write("tracing:\n  level: 2\n")
+    section = mdb.get_section('tracing', defaults, config_file)
+    assert section == {'enabled': True, 'level': 2}
+    assert mdb.get_section('tracing', defaults, config_file) is section
+    with open(config_file, 'a') as f:
+        f.write("  enabled: false\n")
+    assert mdb.get_section('tracing', defaults, config_file) == {'enabled': False, 'level': 2}
+    with open(config_file, 'w') as f:
+        f.write("tracing: [unclosed")
+    assert mdb.get_section('tracing', defaults, config_file) == defaults
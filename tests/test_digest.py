@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# The digest snapshots and the deltas between them.
+
+import pytest
+
+import digest
+import mdb
+
+server = 'digest_test'
+
+
+@pytest.fixture
+def counters(config, monkeypatch):
+    """{digest: (count_star, sum_time)} the snapshots of the digest_test server read"""
+    current = {}
+
+    def fetch_query(name, sql):
+        assert name == server
+        return [], [(0, 'db', 'user', key, count_star, sum_time, 'SELECT %s' % key)
+                    for key, (count_star, sum_time) in current.items()]
+    monkeypatch.setattr(mdb, 'fetch_query', fetch_query)
+    yield current
+    digest._snapshots.pop(server, None)
+    digest._registries.pop(server, None)
+
+
+def _delta(old, new, **kwargs):
+    return {row['digest']: (row['count_star'], row['sum_time']) for row in
+            digest.diff_snapshots(server, old, new, **kwargs)}
+
+
+def test_delta_between_snapshots(counters):
+    counters.update({'a': (10, 100), 'b': (5, 500), 'idle': (7, 70)})
+    old = digest.take_snapshot(server)
+    counters.update({'a': (12, 130), 'b': (2, 20), 'new': (1, 9)})
+    new = digest.take_snapshot(server)
+    # b went backwards: reset in between, its delta is the new value; idle didn't change
+    assert _delta(old, new) == {'a': (2, 30), 'b': (2, 20), 'new': (1, 9)}
+
+
+@pytest.mark.parametrize('order, expected', [('sum_time', ['a', 'b']), ('count_star', ['b', 'c']),
+                                             ('avg_time', ['a', 'c'])])
+def test_order_and_top(counters, order, expected):
+    counters.update({'a': (0, 0), 'b': (0, 0), 'c': (0, 0)})
+    old = digest.take_snapshot(server)
+    counters.update({'a': (1, 1000), 'b': (10, 500), 'c': (5, 400)})
+    new = digest.take_snapshot(server)
+    rows = digest.diff_snapshots(server, old, new, top=2, order=order)
+    assert [row['digest'] for row in rows] == expected
+    assert rows[0]['digest_text'] == 'SELECT %s' % expected[0]
+
+
+def test_expired_keys_are_dropped_and_old_snapshots_stay_valid(counters, monkeypatch):
+    monkeypatch.setattr(digest, 'snapshots_kept', 2)
+    counters.update({'gone': (1, 1), 'kept': (1, 1)})
+    first = digest.take_snapshot(server)
+    del counters['gone']
+    second = digest.take_snapshot(server)
+    counters['kept'] = (3, 3)
+    third = digest.take_snapshot(server)
+    registry = digest._registries[server]
+    assert registry.keys == [(0, 'db', 'user', 'kept')]
+    assert third.registry is registry and first.registry is not registry
+    assert len(digest.get_snapshots(server)) == 2
+    # the snapshots handed out before the compaction still diff against the new ones
+    assert _delta(first, third) == {'kept': (2, 2)}
+    assert _delta(second, third) == {'kept': (2, 2)}
+
+
+def test_first_call_takes_the_baseline(counters, monkeypatch):
+    monkeypatch.setattr(digest, 'min_snapshot_gap', 0)
+    counters['a'] = (1, 10)
+    report = digest.get_digest_delta(server, interval=0)
+    assert report['rows'] == [] and 'Baseline' in report['info']
+    counters['a'] = (4, 40)
+    report = digest.get_digest_delta(server, interval=0)
+    assert report['column_names'][:3] == ['sum_time', 'count_star', 'avg_time']
+    assert report['rows'] == [(30, 3, 10, 0, 'db', 'user', 'a', 'SELECT a')]
+
+
+def test_recent_snapshot_is_reused(counters):
+    counters['a'] = (1, 10)
+    digest.get_digest_delta(server)
+    digest.get_digest_delta(server)
+    assert len(digest.get_snapshots(server)) == 1
+
+
+def test_invalid_order(counters):
+    with pytest.raises(mdb.ValidationError):
+        digest.get_digest_delta(server, order='digest')
+
+
+def test_delta_page(client, config):
+    response = client.get('/%s/digest/delta/?interval=10' % config['global']['default_server'])
+    assert response.status_code == 200
+    assert b'digests by sum_time delta' in response.data
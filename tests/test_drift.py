@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# Config drift between the servers: checksums first, row diffs of the modules that differ.
+
+import pytest
+
+import drift
+import mdb
+
+
+@pytest.fixture
+def replica(config, monkeypatch):
+    """What the replica server reports differently: {'checksums': {module: checksum}, table: extra rows}"""
+    changes = {'checksums': {}}
+    fetch_query = mdb.fetch_query
+
+    def fetch(server, sql):
+        column_names, rows = fetch_query(server, sql)
+        if server == 'replica':
+            if sql == drift.sql_checksums:
+                rows = [(name, changes['checksums'].get(name, checksum)) for name, checksum in rows]
+            for table, extra in changes.items():
+                if sql == drift.sql_module_table % mdb.quote_identifier(table):
+                    rows = list(rows) + extra
+        return column_names, rows
+    monkeypatch.setattr(mdb, 'fetch_query', fetch)
+    return changes
+
+
+def _statuses(summary):
+    return {row[0]: row[1] for row in summary['rows']}
+
+
+def test_servers_in_sync(server, replica):
+    reports = drift.get_drift_report([server, 'replica'])
+    assert len(reports) == 1
+    assert set(_statuses(reports[0]).values()) == {'in sync'}
+    assert reports[0]['column_names'] == ['module', 'status', server, 'replica']
+    assert reports[0]['error'] is None
+
+
+def test_differing_module_is_diffed_row_by_row(server, replica):
+    column_names, rows = mdb.fetch_query(server, "select * from main.runtime_mysql_users")
+    extra = ('extra_user',) + tuple(rows[0][1:])
+    replica['checksums']['mysql_users'] = '0x00000000DEADBEEF'
+    replica['runtime_mysql_users'] = [extra]
+    summary, users = drift.get_drift_report([server, 'replica'])
+    assert _statuses(summary)['mysql_users'] == 'DRIFT'
+    assert _statuses(summary)['mysql_servers'] == 'in sync'
+    assert users['title'] == 'mysql_users: runtime_mysql_users'
+    assert users['column_names'] == column_names + ['present on', 'missing on']
+    assert users['rows'] == [extra + ('replica', server)]
+
+
+def test_modules_without_checksums_are_hashed_locally(server, replica):
+    replica['checksums']['mysql_query_rules'] = '0x0000000000000000'
+    summary, = drift.get_drift_report([server, 'replica'])
+    rules = [row for row in summary['rows'] if row[0] == 'mysql_query_rules'][0]
+    assert rules[1] == 'in sync'
+    assert rules[2] == rules[3] and rules[2].startswith('local:')
+
+
+def test_row_diff_ignores_the_row_order(server):
+    column_names, rows = mdb.fetch_query(server, "select * from main.runtime_mysql_servers")
+    assert drift.diff_rows(['a', 'b'], {'a': rows, 'b': list(reversed(rows))}) == []
+    assert drift.diff_rows(['a', 'b'], {'a': rows, 'b': rows[1:]}) == [(tuple(rows[0]), ['a'])]
+
+
+def test_unknown_server(config):
+    with pytest.raises(mdb.ValidationError):
+        drift.get_drift_report(['no_such_server'])
+
+
+def test_drift_page(client, server):
+    response = client.get('/%s/drift/' % server)
+    assert response.status_code == 200
+    assert b'Config checksums of 2 server(s)' in response.data
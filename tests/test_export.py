@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# Streaming exports of tables and queries as CSV / NDJSON, optionally gzipped.
+
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+import mdb
+
+sql = "SELECT digest, first_seen, count_star FROM stats.stats_mysql_query_digest ORDER BY digest"
+
+
+def _expected(server):
+    column_names, rows = mdb.fetch_query(server, sql)
+    return column_names, mdb.convert_time_columns(column_names, rows)
+
+
+def test_csv_with_time_columns(config, server):
+    column_names, rows = _expected(server)
+    exported = list(csv.reader(io.StringIO(b''.join(mdb.export_query(server, sql, 'csv')).decode('utf-8'))))
+    assert exported[0] == column_names
+    assert exported[1:] == [[str(value) for value in row] for row in rows]
+    assert exported[1][1].count(':') == 2
+
+
+def test_ndjson_with_time_columns(config, server):
+    column_names, rows = _expected(server)
+    lines = b''.join(mdb.export_query(server, sql, 'ndjson')).decode('utf-8').splitlines()
+    assert [json.loads(line) for line in lines] == [dict(zip(column_names, row)) for row in rows]
+
+
+def test_gzip(config, server):
+    plain = b''.join(mdb.export_query(server, sql, 'ndjson'))
+    assert gzip.decompress(b''.join(mdb.export_query(server, sql, 'ndjson', compress=True))) == plain
+
+
+def test_rows_are_streamed_in_chunks(config, server):
+    stream = mdb.stream_query(server, sql, chunk_size=50)
+    column_names = next(stream)
+    chunks = list(stream)
+    assert column_names == ['digest', 'first_seen', 'count_star']
+    assert len(chunks) > 1 and max(len(chunk) for chunk in chunks) == 50
+
+
+def test_connection_is_returned_when_the_client_goes_away(config, server):
+    pool = mdb.get_pool(server)
+    chunks = mdb.export_query(server, sql, 'csv')
+    next(chunks)
+    assert pool.stats()['in_use'] == 1
+    chunks.close()
+    assert pool.stats()['in_use'] == 0
+
+
+def test_errors_are_raised_before_the_response_starts(config, server):
+    with pytest.raises(mdb.ValidationError):
+        mdb.export_query(server, sql, 'xml')
+    with pytest.raises(mdb.DatabaseError):
+        mdb.export_query(server, "SELECT * FROM stats.no_such_table", 'csv')
+    assert mdb.get_pool(server).stats()['in_use'] == 0
+
+
+def test_export_endpoints(client, server):
+    response = client.get('/%s/main/global_variables/export.csv' % server)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert 'global_variables.csv' in response.headers['Content-Disposition']
+    assert response.data.decode('utf-8').splitlines()[0] == 'variable_name,variable_value'
+
+    response = client.post('/%s/export.ndjson' % server, data={'sql': sql, 'gzip': '1'})
+    assert response.mimetype == 'application/gzip'
+    assert 'query.ndjson.gz' in response.headers['Content-Disposition']
+    assert json.loads(gzip.decompress(response.data).splitlines()[0])['digest']
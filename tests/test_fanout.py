@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# Read-only queries and the adhoc report run on several servers at once.
+
+import time
+
+import pytest
+
+import mdb
+
+count_sql = "SELECT count(*) AS n FROM stats.stats_mysql_query_digest"
+
+
+def test_rows_of_every_server_are_merged(config, server):
+    result = mdb.execute_fanout_query(None, [], count_sql)
+    assert result['column_names'] == ['n', 'server']
+    assert [row[1] for row in result['rows']] == list(config['servers'])
+    assert result['rows'][0][0] == result['rows'][1][0] > 0
+    assert [s['error'] for s in result['servers']] == [None, None]
+
+
+def test_columns_are_matched_by_name():
+    outcomes = [((['a', 'b'], [(1, 2)]), None, 0.1),
+                ((['b', 'c'], [(3, 4)]), None, 0.2),
+                (None, "connection refused", 0.3)]
+    merged = mdb._merge_fanout(['one', 'two', 'three'], outcomes)
+    assert merged['column_names'] == ['a', 'b', 'c', 'server']
+    assert merged['rows'] == [(1, 2, None, 'one'), (None, 3, 4, 'two')]
+    assert [s['row_count'] for s in merged['servers']] == [1, 1, 0]
+    assert merged['servers'][2]['error'] == "connection refused"
+
+
+@pytest.mark.parametrize('sql', ["UPDATE main.global_variables SET variable_value = 1",
+                                 "SELECT 1; SELECT 2",
+                                 "SELECT * FROM stats.stats_mysql_query_digest INTO OUTFILE '/tmp/x'"])
+def test_only_single_reads_are_fanned_out(config, sql):
+    with pytest.raises(mdb.ValidationError):
+        mdb.execute_fanout_query(None, [], sql)
+
+
+def test_unknown_servers_are_rejected(config):
+    with pytest.raises(mdb.ValidationError, match='no_such_server'):
+        mdb.execute_fanout_query(None, ['no_such_server'], count_sql)
+
+
+def test_a_slow_server_times_out_alone(config, server, monkeypatch):
+    fetch_query = mdb.fetch_query
+
+    def slow_replica(name, sql):
+        if name == 'replica':
+            time.sleep(0.5)
+        return fetch_query(name, sql)
+    monkeypatch.setattr(mdb, 'fetch_query', slow_replica)
+    monkeypatch.setattr(mdb, 'fanout_settings', lambda: (8, 0.1))
+    result = mdb.execute_fanout_query(None, [server, 'replica'], count_sql)
+    assert [row[1] for row in result['rows']] == [server]
+    assert result['servers'][1]['error'] == "Timed out after 0.1 seconds"
+
+
+def test_adhoc_report_fanout(config, server):
+    results = mdb.execute_adhoc_report_fanout(None, [server, 'replica'])
+    assert len(results) == len(config['misc']['adhoc_report'])
+    for result in results:
+        assert result['error'] is None
+        assert result['column_names'][-1] == 'server'
+        assert {row[-1] for row in result['rows']} <= {server, 'replica'}
+
+
+def test_fanout_form_and_page(client, server):
+    response = client.post('/%s/stats/stats_mysql_query_digest/sql/' % server,
+                           data={'sql': count_sql, 'fanout': '1', 'servers': [server, 'replica']})
+    assert response.status_code == 200
+    assert b'replica' in response.data
+    assert client.get('/%s/adhoc/?fanout=1' % server).status_code == 200
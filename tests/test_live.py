@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# The live table views: one poller per table and interval, diffs of the keyed rows to every viewer.
+
+import json
+import queue
+
+import pytest
+
+import live
+import mdb
+
+
+@pytest.fixture
+def run(config, server):
+    """Runs a statement on the fake backend"""
+    def run(sql):
+        with mdb.pooled_cursor(server, kind='write') as cur:
+            cur.execute(sql)
+    return run
+
+
+@pytest.fixture
+def variables(run):
+    yield run
+    run("DELETE FROM main.global_variables WHERE variable_name LIKE 'live-test-%'")
+
+
+def _poller(server, table, viewer, database='main'):
+    poller = live.Poller((server, database, table, 2), 2)
+    poller.subscribers.add(viewer)
+    return poller
+
+
+def _events(viewer):
+    events = []
+    while not viewer.empty():
+        event, data = viewer.get_nowait().split('\n', 2)[:2]
+        events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return events
+
+
+def test_first_poll_resets_then_only_the_changes_are_sent(server, variables):
+    viewer = queue.Queue()
+    poller = _poller(server, 'global_variables', viewer)
+    variables("INSERT INTO main.global_variables VALUES ('live-test-a', '1'), ('live-test-b', '2')")
+    poller.poll()
+    (event, data), = _events(viewer)
+    assert event == 'reset'
+    assert data['columns'] == ['variable_name', 'variable_value']
+    assert ['["live-test-a"]', ['live-test-a', '1']] in data['rows']
+
+    poller.poll()
+    assert _events(viewer) == []
+
+    variables("UPDATE main.global_variables SET variable_value = '3' WHERE variable_name = 'live-test-a'")
+    variables("DELETE FROM main.global_variables WHERE variable_name = 'live-test-b'")
+    variables("INSERT INTO main.global_variables VALUES ('live-test-c', '4')")
+    poller.poll()
+    assert _events(viewer) == [('diff', {'upsert': [['["live-test-a"]', ['live-test-a', '3']],
+                                                    ['["live-test-c"]', ['live-test-c', '4']]],
+                                         'delete': ['["live-test-b"]']})]
+
+
+def test_a_viewer_falling_behind_gets_a_reset(server, variables):
+    slow = queue.Queue(maxsize=2)
+    poller = _poller(server, 'global_variables', slow)
+    variables("INSERT INTO main.global_variables VALUES ('live-test-a', '0')")
+    poller.poll()
+    for value in range(1, 4):
+        variables("UPDATE main.global_variables SET variable_value = '%d' WHERE variable_name = 'live-test-a'"
+                  % value)
+        poller.poll()
+    # reset, diff 1, then the queue was full: diff 2 is replaced by the current state, diff 3 follows it
+    (reset, data), diff = _events(slow)
+    assert reset == 'reset'
+    assert ['["live-test-a"]', ['live-test-a', '2']] in data['rows']
+    assert diff == ('diff', {'upsert': [['["live-test-a"]', ['live-test-a', '3']]], 'delete': []})
+
+
+def test_rows_are_keyed_by_the_whole_row_if_the_key_is_not_unique(server, run, monkeypatch):
+    monkeypatch.setitem(live.key_columns, 'live_test', ('name',))
+    run("CREATE TABLE stats.live_test (name VARCHAR, value INT)")
+    try:
+        run("INSERT INTO stats.live_test VALUES ('a', 1), ('a', 2)")
+        viewer = queue.Queue()
+        poller = _poller(server, 'live_test', viewer, database='stats')
+        poller.poll()
+        assert poller.key_index == []
+        assert sorted(poller.rows) == ['["a", 1]', '["a", 2]']
+        run("UPDATE stats.live_test SET value = 3 WHERE value = 2")
+        poller.poll()
+        assert _events(viewer)[-1] == ('diff', {'upsert': [['["a", 3]', ['a', 3]]], 'delete': ['["a", 2]']})
+    finally:
+        run("DROP TABLE stats.live_test")
+
+
+def test_viewers_share_a_poller(config, server):
+    first, q1 = live.subscribe(server, 'main', 'global_variables', 10)
+    second, q2 = live.subscribe(server, 'main', 'global_variables', 10)
+    try:
+        assert first is second and first.subscribers == {q1, q2}
+    finally:
+        first.unsubscribe(q1)
+        first.unsubscribe(q2)
+
+
+def test_stream_validates_its_arguments(client, server):
+    response = client.get('/%s/main/global_variables/live/?interval=3' % server)
+    assert response.status_code == 400
+    assert 'Invalid interval' in response.get_json()['error']
+    assert client.get('/no_such_server/main/global_variables/live/?interval=2').status_code == 400
+
+
+def test_stream_starts_with_the_whole_table(client, server):
+    response = client.get('/%s/main/global_variables/live/?interval=1' % server, buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    events = iter(response.response)
+    assert next(events) == b"retry: 1000\n\n"
+    assert next(events).startswith(b"event: reset\n")
+    response.close()
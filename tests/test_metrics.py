@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# The metrics registry, the exposition format and the /metrics endpoint.
+
+import json
+import os
+import time
+
+import pytest
+
+import mdb
+import metrics
+
+
+def test_counter_gauge_and_histogram_exposition():
+    requests = metrics.counter('test_requests_total', 'Requests', ['path'])
+    requests.inc('/a')
+    requests.inc('/a', amount=2)
+    requests.inc('/b"\n')
+    metrics.gauge('test_connections', 'Connections').set(value=4)
+    latency = metrics.histogram('test_latency_seconds', 'Latency', buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        latency.observe(value=value)
+    lines = metrics.render([metrics.collect()]).splitlines()
+    assert '# TYPE test_requests_total counter' in lines
+    assert 'test_requests_total{path="/a"} 3' in lines
+    assert 'test_requests_total{path="/b\\"\\n"} 1' in lines
+    assert 'test_connections 4' in lines
+    assert ['test_latency_seconds_bucket{le="0.1"} 1', 'test_latency_seconds_bucket{le="1"} 2',
+            'test_latency_seconds_bucket{le="+Inf"} 3', 'test_latency_seconds_sum 5.55',
+            'test_latency_seconds_count 3'] == [line for line in lines if line.startswith('test_latency_seconds')]
+
+
+def test_registering_twice_returns_the_same_metric():
+    assert metrics.counter('test_twice_total', 'Twice') is metrics.counter('test_twice_total', 'Twice')
+
+
+def test_workers_are_added_up_and_stale_ones_ignored(tmp_path):
+    worker = {'test_worker_total': {'kind': 'counter', 'help': 'Per worker', 'labelnames': ['server'],
+                                    'buckets': [], 'samples': [[['a'], 2], [['b'], 1]]}}
+    for name in ('worker_1.json', 'worker_2.json', 'worker_3.json'):
+        (tmp_path / name).write_text(json.dumps(worker))
+    stale = time.time() - metrics.stale_after - 1
+    os.utime(tmp_path / 'worker_3.json', (stale, stale))
+    lines = metrics.render(metrics.read_dumps(str(tmp_path))).splitlines()
+    assert 'test_worker_total{server="a"} 4' in lines
+    assert 'test_worker_total{server="b"} 2' in lines
+
+
+@pytest.fixture
+def metrics_config(config, monkeypatch):
+    """Sets the metrics: section of the loaded config"""
+    def replace(section):
+        monkeypatch.setitem(mdb.get_config(), 'metrics', section)
+    return replace
+
+
+def test_disabled_by_default(proxyweb, client, metrics_config):
+    metrics_config(None)
+    assert client.get('/metrics').status_code == 404
+
+
+def test_login_or_token_required(proxyweb, client, metrics_config):
+    metrics_config({'enabled': True, 'token': 's3cret'})
+    anonymous = proxyweb.app.test_client()
+    assert anonymous.get('/metrics').status_code == 401
+    assert anonymous.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    scraped = anonymous.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert scraped.status_code == 200
+    assert scraped.mimetype == 'text/plain'
+    assert b'# TYPE proxyweb_query_seconds histogram' in scraped.data
+    assert client.get('/metrics').status_code == 200
+
+
+def test_without_a_token_only_the_login_works(proxyweb, client, metrics_config):
+    metrics_config({'enabled': True})
+    assert proxyweb.app.test_client().get('/metrics', headers={'Authorization': 'Bearer '}).status_code == 401
+    assert client.get('/metrics').status_code == 200
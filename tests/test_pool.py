@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# The connection pools and the writes running over them.
+
+import pytest
+
+import fake_proxysql
+import mdb
+
+dsn = {'host': 'localhost', 'user': 'admin', 'passwd': 'admin', 'port': 6032}
+
+
+@pytest.fixture
+def connects(config, monkeypatch):
+    """The keyword arguments of every mysql.connector.connect() call, the connections are fake"""
+    calls = []
+
+    def connect(**kwargs):
+        calls.append(kwargs)
+        return fake_proxysql.connect(**kwargs)
+    monkeypatch.setattr(mdb.mysql.connector, 'connect', connect)
+    return calls
+
+
+def test_write_connections_autocommit(connects):
+    # mysql.connector sends its autocommit setting on connect, execute_changes() never commits
+    pool = mdb.ConnectionPool('proxysql', dsn, kind='write')
+    pool.release(pool.acquire())
+    assert connects[-1]['autocommit'] is True
+    assert connects[-1]['get_warnings'] is False
+    assert connects[-1]['raise_on_warnings'] is False
+
+
+def test_read_connections_keep_the_original_settings(connects):
+    pool = mdb.ConnectionPool('proxysql', dsn, kind='read')
+    pool.release(pool.acquire())
+    assert connects[-1]['autocommit'] is False
+    assert connects[-1]['raise_on_warnings'] is True
+
+
+def test_connections_are_reused_and_discarded_on_failure(connects):
+    pool = mdb.ConnectionPool('proxysql', dsn, size=2)
+    conn = pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+    pool.release(conn, discard=True)
+    assert pool.acquire() is not conn
+    stats = pool.stats()
+    assert (stats['created'], stats['reused'], stats['closed']) == (2, 1, 1)
+
+
+def test_checkout_times_out_when_the_pool_is_exhausted(connects):
+    pool = mdb.ConnectionPool('proxysql', dsn, size=1, checkout_timeout=0.05)
+    conn = pool.acquire()
+    with pytest.raises(mdb.DatabaseError):
+        pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_idle_and_old_connections_are_closed(connects):
+    pool = mdb.ConnectionPool('proxysql', dsn, idle_timeout=60, max_lifetime=600)
+    conn = pool.acquire()
+    pool.release(conn)
+    pool._idle[0].last_used -= 61
+    assert pool.acquire() is not conn
+    assert pool.stats()['evicted_idle'] == 1
+
+
+def test_a_block_that_raises_discards_its_connection(config, server):
+    pool = mdb.get_pool(server)
+    with mdb.pooled_cursor(server) as cur:
+        cur.execute("SELECT 1")
+        cur.fetchall()
+    closed = pool.stats()['closed']
+    with pytest.raises(ZeroDivisionError):
+        with mdb.pooled_cursor(server) as cur:
+            1 / 0
+    assert pool.stats()['closed'] == closed + 1
+    assert pool.stats()['in_use'] == 0
+
+
+def test_pool_is_recreated_when_its_settings_change(config, server, monkeypatch):
+    pool = mdb.get_pool(server)
+    assert mdb.get_pool(server) is pool
+    changed = dict(config, **{'global': dict(config['global'], pool={'size': 2})})
+    monkeypatch.setattr(mdb, 'get_config', lambda config="config/config.yml": changed)
+    resized = mdb.get_pool(server)
+    assert resized is not pool and resized.size == 2
+    assert pool.closed
+    changed['global']['pool'] = {'no_such_setting': 1}
+    with pytest.raises(mdb.ConfigError):
+        mdb.get_pool(server)
+
+
+def test_execute_changes_stops_at_the_first_error(config, server):
+    sql = ("UPDATE main.global_variables SET variable_value = 'changed' WHERE variable_name = 'admin-test'; "
+           "UPDATE main.no_such_table SET a = 1; "
+           "UPDATE main.global_variables SET variable_value = 'skipped'")
+    results = mdb.execute_changes(None, server, sql)
+    assert [result['status'] for result in results] == ['ok', 'error', 'skipped']
+    assert results[1]['error']
+
+
+def test_execute_changes_is_visible_to_the_read_pool(config, server):
+    mdb.execute_changes(None, server, "INSERT INTO main.mysql_query_rules (rule_id, active, match_digest, apply) "
+                                      "VALUES (990001, 0, '^SELECT pool_test', 1)")
+    with mdb.pooled_cursor(server, dictionary=False) as cur:
+        cur.execute("SELECT match_digest FROM main.mysql_query_rules WHERE rule_id = 990001")
+        assert cur.fetchall() == [('^SELECT pool_test',)]
+    assert mdb.get_pool(server, 'write') is not mdb.get_pool(server, 'read')
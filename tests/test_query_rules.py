@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# The query rule simulator follows ProxySQL: rule_id order, flagIN/flagOUT chains, apply, negation.
+
+import query_rules
+
+
+def rule(rule_id, match_digest=None, match_pattern=None, flag_in=0, flag_out=None, destination=None, apply=0,
+         negate=0, username=None, schemaname=None, client_addr=None, digest=None, re_modifiers='CASELESS'):
+    # the columns of query_rules.sql_rules
+    return (rule_id, username, schemaname, flag_in, client_addr, digest, match_digest, match_pattern, negate,
+            re_modifiers, flag_out, destination, apply)
+
+
+def evaluate(rules, text, username='app', schemaname='shop', client='10.0.0.1', digest='0x1', users=()):
+    return query_rules.RuleIndex(rules, users).evaluate(username, schemaname, client, digest, text)
+
+
+def test_no_match():
+    assert evaluate([rule(1, '^UPDATE', destination=1, apply=1)], "SELECT 1") == ((), None)
+
+
+def test_apply_stops_at_the_first_match():
+    rules = [rule(1, '^SELECT', destination=2, apply=1), rule(2, '^SELECT', destination=3, apply=1)]
+    assert evaluate(rules, "SELECT 1") == ((1,), 2)
+
+
+def test_without_apply_later_rules_override_the_destination():
+    rules = [rule(1, '^SELECT', destination=2), rule(2, 'FOR UPDATE$', destination=1, apply=1),
+             rule(3, '.', destination=5)]
+    assert evaluate(rules, "SELECT * FROM t FOR UPDATE") == ((1, 2), 1)
+    # rule 2 misses: rule 3 still runs, rule 1's destination is overridden
+    assert evaluate(rules, "SELECT * FROM t") == ((1, 3), 5)
+
+
+def test_a_match_without_destination_keeps_the_previous_one():
+    rules = [rule(1, '^SELECT', destination=2), rule(2, '.')]
+    assert evaluate(rules, "SELECT 1") == ((1, 2), 2)
+
+
+def test_flag_out_continues_with_the_rules_of_that_flag_in():
+    rules = [rule(1, '^SELECT', flag_out=10),
+             rule(2, '.', destination=9, apply=1),                 # flagIN 0, skipped after the jump
+             rule(3, 'FROM orders', flag_in=10, destination=3, apply=1),
+             rule(4, '.', flag_in=10, destination=4, apply=1)]
+    assert evaluate(rules, "SELECT * FROM orders") == ((1, 3), 3)
+    assert evaluate(rules, "SELECT * FROM users") == ((1, 4), 4)
+    assert evaluate(rules, "UPDATE users SET a = 1") == ((2,), 9)
+
+
+def test_flag_out_only_continues_after_the_matching_rule():
+    rules = [rule(1, '.', flag_in=10, destination=1, apply=1),     # before the jump, never reached
+             rule(2, '^SELECT', flag_out=10),
+             rule(3, '.', flag_in=10, destination=3, apply=1)]
+    assert evaluate(rules, "SELECT 1") == ((2, 3), 3)
+
+
+def test_chained_flags():
+    rules = [rule(1, '^SELECT', flag_out=1), rule(2, 'orders', flag_in=1, flag_out=2),
+             rule(3, '.', flag_in=2, destination=7, apply=1)]
+    assert evaluate(rules, "SELECT * FROM orders") == ((1, 2, 3), 7)
+    # no rule of flagIN 1 matches: the evaluation ends there
+    assert evaluate(rules, "SELECT * FROM users") == ((1,), None)
+
+
+def test_apply_ends_the_chain_even_with_flag_out():
+    rules = [rule(1, '^SELECT', flag_out=1, destination=2, apply=1), rule(2, '.', flag_in=1, destination=3)]
+    assert evaluate(rules, "SELECT 1") == ((1,), 2)
+
+
+def test_negate_match_pattern():
+    rules = [rule(1, '^SELECT', negate=1, destination=1, apply=1), rule(2, '.', destination=2, apply=1)]
+    assert evaluate(rules, "UPDATE t SET a = 1") == ((1,), 1)
+    assert evaluate(rules, "SELECT 1") == ((2,), 2)
+
+
+def test_negated_match_pattern_is_tested_against_the_digest_text():
+    rules = [rule(1, match_pattern='FOR UPDATE', negate=1, destination=2, apply=1)]
+    assert evaluate(rules, "SELECT * FROM t") == ((1,), 2)
+    assert evaluate(rules, "SELECT * FROM t FOR UPDATE") == ((), None)
+
+
+def test_re_modifiers():
+    assert evaluate([rule(1, '^select', destination=2, apply=1)], "SELECT 1") == ((1,), 2)
+    assert evaluate([rule(1, '^select', destination=2, apply=1, re_modifiers='')], "SELECT 1") == ((), None)
+
+
+def test_username_schemaname_client_and_digest_filters():
+    rules = [rule(1, '.', username='batch', destination=1, apply=1),
+             rule(2, '.', schemaname='reports', destination=2, apply=1),
+             rule(3, '.', client_addr='192.168.%', destination=3, apply=1),
+             rule(4, '.', digest='0xABC', destination=4, apply=1),
+             rule(5, '.', destination=5, apply=1)]
+    assert evaluate(rules, "SELECT 1", username='batch') == ((1,), 1)
+    assert evaluate(rules, "SELECT 1", schemaname='reports') == ((2,), 2)
+    assert evaluate(rules, "SELECT 1", client='192.168.1.5') == ((3,), 3)
+    assert evaluate(rules, "SELECT 1", digest='0xabc') == ((4,), 4)
+    assert evaluate(rules, "SELECT 1") == ((5,), 5)
+
+
+def test_invalid_regex_is_reported_and_never_matches():
+    index = query_rules.RuleIndex([rule(1, '(', destination=1, apply=1), rule(2, '.', destination=2, apply=1)], ())
+    assert index.errors and 'rule 1' in index.errors[0]
+    assert index.evaluate('app', 'shop', '', '0x1', "SELECT 1") == ((2,), 2)
+
+
+def test_literal_prefix_shortcut_agrees_with_the_regex():
+    rules = [rule(1, r'^SELECT\.x', destination=1, apply=1), rule(2, '^(SELECT|UPDATE) ', destination=2, apply=1)]
+    assert evaluate(rules, "SELECT.x FROM t") == ((1,), 1)
+    assert evaluate(rules, "SELECTx FROM t") == ((), None)
+    assert evaluate(rules, "UPDATE t SET a = 1") == ((2,), 2)
+
+
+def test_simulate_accounts_for_every_digest(config, server):
+    summary, report = query_rules.simulate(server, 'main', top=5)
+    assert summary['error'] is None and report['row_count'] <= 5
+    assert sum(row[2] for row in summary['rows']) == query_rules.mdb.fetch_query(
+        server, "select count(*) from stats.stats_mysql_query_digest")[1][0][0]
+    # the digests no rule routes go to the default_hostgroup of their user
+    index, cached = query_rules.get_rule_index(server, 'main')
+    assert cached
+    for sum_time, count_star, username, schemaname, hostgroup, destination, chain, text in report['rows']:
+        if not chain:
+            assert destination == index.default_hostgroups.get(username)
@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# The result cache and the ETag / 304 answers of the table data endpoint.
+
+import time
+
+import mdb
+
+page = '/%s/stats/stats_mysql_query_digest/data/?draw=1&start=0&length=10&order[0][column]=1&order[0][dir]=desc'
+
+
+def test_entries_expire_and_are_dropped_lru_first():
+    cache = mdb.ResultCache(max_entries=2)
+    cache.put(('a', 1), 'one', 60)
+    cache.put(('a', 2), 'two', 0.01)
+    assert cache.get(('a', 1)).value == 'one'
+    time.sleep(0.02)
+    assert cache.get(('a', 2)) is None
+    cache.put(('b', 3), 'three', 60)
+    cache.put(('b', 4), 'four', 60)
+    # ('a', 1) was the least recently used
+    assert cache.get(('a', 1)) is None
+    cache.invalidate('b')
+    assert cache.get(('b', 3)) is None and cache.get(('b', 4)) is None
+
+
+def test_ttl_zero_is_not_stored_and_not_hashed():
+    cache = mdb.ResultCache()
+    entry = cache.put(('a', 1), {'rows': [(1, 2)]}, 0)
+    assert cache.get(('a', 1)) is None
+    assert entry._etag is None
+    assert entry.etag == mdb.content_etag({'rows': [(1, 2)]})
+    assert cache.put(('a', 1), {'rows': [(1, 2)]}, 0).etag == entry.etag
+    assert cache.put(('a', 1), {'rows': [(1, 3)]}, 0).etag != entry.etag
+
+
+def test_unchanged_page_is_answered_with_304(client, server):
+    first = client.get(page % server)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert first.headers['Cache-Control'] == 'no-cache'
+    assert len(first.get_json()['data']) == 10
+
+    again = client.get(page % server, headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+    assert again.headers['ETag'] == etag
+
+    # draw doesn't change the content, the paging does
+    assert client.get((page % server).replace('draw=1', 'draw=2'), headers={'If-None-Match': etag}).status_code == 304
+    other = client.get((page % server).replace('start=0', 'start=10'), headers={'If-None-Match': etag})
+    assert other.status_code == 200
+    assert other.headers['ETag'] != etag
+
+
+def test_changed_data_gets_a_new_etag(client, server):
+    url = '/%s/main/global_variables/data/?draw=1&start=0&length=5' % server
+    etag = client.get(url).headers['ETag']
+    mdb.execute_changes(None, server, "UPDATE main.global_variables SET variable_value = 'etag-test' "
+                                      "WHERE variable_name = (SELECT min(variable_name) FROM main.global_variables)")
+    changed = client.get(url, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# The stats sampler: changed values only, counter resets, gauges, the rollup and the retention.
+
+import time
+
+import pytest
+
+import mdb
+import sampler
+
+table = 'sampler_test'
+spec = {'key': ['name'], 'values': ['total', 'current'], 'gauges': ['current']}
+
+
+@pytest.fixture
+def stats_table(config, server):
+    """Runs "... %s ..." % the test table on the fake backend"""
+    def run(sql):
+        with mdb.pooled_cursor(server, kind='write') as cur:
+            cur.execute(sql % ('stats.' + table))
+    run("CREATE TABLE %s (name VARCHAR, total INT, current INT)")
+    yield run
+    run("DROP TABLE %s")
+
+
+@pytest.fixture
+def store(config, tmp_path, monkeypatch):
+    settings = dict(sampler.defaults, path=str(tmp_path / 'stats.sqlite'), tables={table: spec},
+                    downsample_after=3600, downsample_step=60, retention=7200)
+    monkeypatch.setattr(sampler, 'get_settings', lambda: settings)
+    store = sampler.Sampler(settings)
+    yield store
+    store.conn.close()
+
+
+def _sample(store, server, ts):
+    changed = store.sample_table(server, table, spec, ts)
+    # sample() commits once per round, the readers only see committed samples
+    store.conn.commit()
+    return changed
+
+
+def _set(stats_table, total, current, name='a'):
+    stats_table("DELETE FROM %s")
+    stats_table("INSERT INTO %%s VALUES ('%s', %d, %d)" % (name, total, current))
+
+
+def test_only_changed_values_are_stored(server, stats_table, store):
+    now = int(time.time())
+    _set(stats_table, 100, 5)
+    assert _sample(store, server, now - 20) == 2
+    assert _sample(store, server, now - 10) == 0
+    _set(stats_table, 150, 5)
+    assert _sample(store, server, now) == 1
+    assert sampler.get_history(server, table, 'a', 'total') == [[now - 20, 100, None], [now, 150, 50]]
+
+
+def test_rates_across_a_counter_reset(server, stats_table, store):
+    now = int(time.time())
+    for ts, total in ((now - 30, 100), (now - 20, 150), (now - 10, 30)):
+        _set(stats_table, total, total)
+        _sample(store, server, ts)
+    # +50, then a restart: the counter went from 0 to 30
+    assert sampler.get_rates(server, table, window=60) == {'a': {'total': 80 / 60}}
+
+
+def test_gauges_have_no_rate(server, stats_table, store):
+    assert sampler.is_gauge(spec, 'a', 'current')
+    assert not sampler.is_gauge(spec, 'a', 'total')
+    assert sampler.is_gauge({'gauge_keys': ['Client_Connections_*']}, 'client_connections_connected', 'value')
+    now = int(time.time())
+    _set(stats_table, 1, 10)
+    _sample(store, server, now - 10)
+    _set(stats_table, 1, 3)
+    _sample(store, server, now)
+    assert sampler.get_rates(server, table) == {}
+    assert [point[1] for point in sampler.get_history(server, table, 'a', 'current')] == [10, 3]
+
+
+def test_vanished_rows_start_over(server, stats_table, store):
+    now = int(time.time())
+    _set(stats_table, 100, 1)
+    _sample(store, server, now - 20)
+    _set(stats_table, 100, 1, name='b')
+    _sample(store, server, now - 10)
+    assert not any(ident[2] == 'a' for ident in store.series)
+    _set(stats_table, 100, 1)
+    _sample(store, server, now)
+    # no delta against the value seen before the row was gone
+    assert sampler.get_history(server, table, 'a', 'total')[-1] == [now, 100, None]
+
+
+def test_rollup_and_retention(server, stats_table, store):
+    now = int(time.time())
+    now -= now % 60
+    for ts, total in ((now - 9000, 1), (now - 5000, 2), (now - 4990, 5), (now - 10, 6)):
+        _set(stats_table, total, 0)
+        _sample(store, server, ts)
+    store.rollup(now)
+    samples = store.conn.execute("SELECT ts FROM samples").fetchall()
+    rollup = store.conn.execute("SELECT ts, value, delta FROM rollup ORDER BY ts").fetchall()
+    # the two samples of the same minute are one bucket with the last value and the sum of the deltas,
+    # the one older than the retention is gone
+    assert samples == [(now - 10,)]
+    assert rollup == [(now - 5040, 5, 4)]
+    assert [point[0] for point in sampler.get_history(server, table, 'a', 'total', since=86400)] == \
+        [now - 5040, now - 10]
@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# The settings editor has to stay usable with a config that doesn't load, it's the way to fix it.
+
+import pytest
+
+import mdb
+
+config_path = "config/config.yml"
+
+
+@pytest.fixture
+def saved_config(config):
+    with open(config_path) as f:
+        saved = f.read()
+    yield saved
+    with open(config_path, 'w') as f:
+        f.write(saved)
+    mdb.invalidate_config(config_path)
+
+
+def test_invalid_config_is_not_saved(client, saved_config):
+    response = client.post('/settings/save/', data={'settings': 'servers: [unclosed'})
+    assert response.status_code == 200
+    assert b'The config was not saved' in response.data and b'servers: [unclosed' in response.data
+    response = client.post('/settings/save/', data={'settings': '- a list'})
+    assert b'The config was not saved' in response.data
+    with open(config_path) as f:
+        assert f.read() == saved_config
+
+
+def test_editor_works_with_a_broken_config(client, saved_config):
+    with open(config_path, 'w') as f:
+        f.write('servers: [unclosed')
+    mdb.invalidate_config(config_path)
+
+    response = client.get('/settings/edit/')
+    assert response.status_code == 200
+    assert b'servers: [unclosed' in response.data
+    # the other pages report the error instead of failing on the way
+    response = client.get('/')
+    assert response.status_code == 500
+    assert b'YAML parsing error' in response.data
+
+    response = client.post('/settings/save/', data={'settings': saved_config})
+    assert b'successful' in response.data
+    assert client.get('/').status_code == 200
@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# Server-side paging, sorting and searching of the table views (the DataTables /data/ endpoint).
+
+import pytest
+
+import mdb
+
+data_url = '/%s/stats/stats_mysql_query_digest/data/'
+count_star = 6      # the index of the count_star column of stats_mysql_query_digest
+
+
+def _all_rows(server):
+    with mdb.pooled_cursor(server, dictionary=False) as cur:
+        cur.execute("select * from stats.stats_mysql_query_digest")
+        return cur.fetchall()
+
+
+def _page(client, server, **args):
+    query = dict({'draw': 3, 'start': 0, 'length': 10, 'order[0][column]': 0, 'order[0][dir]': 'asc',
+                  'search[value]': ''}, **args)
+    response = client.get(data_url % server, query_string=query)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_pages_follow_the_datatables_protocol(client, server):
+    total = len(_all_rows(server))
+    first = _page(client, server, length=10)
+    assert first['draw'] == 3
+    assert first['recordsTotal'] == first['recordsFiltered'] == total
+    assert len(first['data']) == 10
+    second = _page(client, server, start=10, length=10)
+    assert len(second['data']) == 10 and second['data'] != first['data']
+    last = _page(client, server, start=total - 3, length=10)
+    assert len(last['data']) == 3
+
+
+@pytest.mark.parametrize('direction', ['asc', 'desc'])
+def test_ordering(client, server, direction):
+    data = _page(client, server, length=50, **{'order[0][column]': count_star, 'order[0][dir]': direction})['data']
+    counts = [row[count_star] for row in data]
+    expected = sorted((row[count_star] for row in _all_rows(server)), reverse=direction == 'desc')[:50]
+    assert counts == expected
+
+
+def test_invalid_ordering_falls_back_to_the_first_column(client, server):
+    data = _page(client, server, length=20, **{'order[0][column]': 99, 'order[0][dir]': 'sideways'})['data']
+    assert [row[0] for row in data] == sorted(row[0] for row in _all_rows(server))[:20]
+
+
+def test_search_matches_any_column(client, server):
+    expected = [row for row in _all_rows(server) if any('user1' in str(value).lower() for value in row)]
+    found = _page(client, server, length=1000, **{'search[value]': 'USER1'})
+    assert 0 < found['recordsFiltered'] == len(expected) == len(found['data'])
+    assert found['recordsTotal'] == len(_all_rows(server))
+
+
+@pytest.mark.parametrize('search', ['user_', '100%', "it's", '!', '\\'])
+def test_search_wildcards_and_quotes_are_literal(client, server, search):
+    # unescaped, "user_" and "100%" would be LIKE patterns matching most of the rows
+    expected = [row for row in _all_rows(server) if any(search.lower() in str(value).lower() for value in row)]
+    found = _page(client, server, length=1000, **{'search[value]': search})
+    assert 'error' not in found
+    assert found['recordsFiltered'] == len(expected)
+
+
+def test_page_length_is_capped(config, server):
+    page = mdb.get_table_page(None, server, 'stats', 'stats_mysql_query_digest', length=mdb.max_page_length + 1)
+    assert len(page['rows']) == min(mdb.max_page_length, page['records_total'])
+    with pytest.raises(mdb.ValidationError):
+        mdb.get_table_page(None, server, 'stats', 'stats_mysql_query_digest', start='x')
+
+
+def test_identifiers_are_validated(client, server):
+    with pytest.raises(mdb.ValidationError):
+        mdb.quote_identifier('stats_mysql_query_digest; DROP TABLE x')
+    assert mdb.quote_column('a`b') == '`a``b`'
+    response = client.get('/%s/stats/no%%60such/data/' % server, query_string={'draw': 1})
+    assert 'error' in response.get_json()
@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# The epoch timestamp columns shown as UTC datetimes.
+
+import pytest
+
+import mdb
+
+epoch = 1700000000
+formatted = '2023-11-14 22:13:20'
+
+
+def test_known_columns_are_converted_in_their_unit(config):
+    column_names = ['digest', 'first_seen', 'time_start_us', 'count_star']
+    rows = [('0x1', epoch, epoch * 1_000_000 + 999_999, 7), ('0x2', str(epoch), epoch * 1_000_000, 8)]
+    assert mdb.convert_time_columns(column_names, rows) == [('0x1', formatted, formatted, 7),
+                                                            ('0x2', formatted, formatted, 8)]
+
+
+def test_invalid_values_are_left_alone(config):
+    rows = [(None,), ('never',), (10 ** 30,)]
+    assert mdb.convert_time_columns(['last_seen'], rows) == rows
+
+
+def test_nothing_to_convert(config):
+    rows = [(1, 2)]
+    assert mdb.convert_time_columns(['a', 'b'], rows) is rows
+    assert mdb.convert_time_columns(['first_seen'], []) == []
+
+
+@pytest.fixture
+def time_columns(config, monkeypatch):
+    """Sets global: time_columns: of the loaded config"""
+    def replace(columns):
+        monkeypatch.setitem(mdb.get_config()['global'], 'time_columns', columns)
+    return replace
+
+
+def test_columns_from_the_config(time_columns):
+    time_columns({'updated_ms': 'ms', 'first_seen': 'ms'})
+    assert mdb.convert_time_columns(['updated_ms', 'first_seen', 'last_seen'],
+                                    [(epoch * 1000, epoch * 1000, epoch)]) == [(formatted, formatted, formatted)]
+
+
+def test_unknown_unit(time_columns):
+    time_columns({'updated': 'minutes'})
+    with pytest.raises(mdb.ConfigError, match='minutes'):
+        mdb.convert_time_columns(['updated'], [(1,)])
+
+
+def test_table_pages_show_datetimes(client, server):
+    page = client.get('/%s/stats/stats_mysql_query_digest/data/' % server,
+                      query_string={'draw': 1, 'start': 0, 'length': 5}).get_json()
+    first_seen = page['data'][0][7]
+    assert isinstance(first_seen, str) and first_seen[4] == '-' and first_seen[13] == ':'
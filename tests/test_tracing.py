@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# Request tracing: the Server-Timing header, the slow request log and the ?profile=1 profiler.
+
+import json
+import logging
+
+import pytest
+
+import tracing
+
+page = '/%s/stats/stats_mysql_query_digest/data/?draw=1&start=0&length=10'
+
+
+@pytest.fixture
+def tracing_config(config, monkeypatch):
+    """Replaces the tracing: section of the config"""
+    def replace(**section):
+        settings = dict(tracing.get_settings(), **section)
+        monkeypatch.setattr(tracing, 'get_settings', lambda: settings)
+    return replace
+
+
+def test_server_timing_breakdown(client, server):
+    response = client.get(page % server)
+    timings = dict(entry.split(';dur=') for entry in response.headers['Server-Timing'].split(', '))
+    assert {'query', 'total'} <= set(timings)
+    assert all(float(duration) >= 0 for duration in timings.values())
+    assert float(timings['total']) >= float(timings['query'])
+
+
+def test_server_timing_is_for_logged_in_users_only(proxyweb):
+    response = proxyweb.app.test_client().get('/login')
+    assert response.status_code == 200
+    assert 'Server-Timing' not in response.headers
+
+
+def test_server_timing_can_be_turned_off(client, server, tracing_config):
+    tracing_config(server_timing=False)
+    assert 'Server-Timing' not in client.get(page % server).headers
+
+
+def test_slow_requests_are_logged(client, server, tracing_config, caplog):
+    tracing_config(slow_ms=0)
+    tracing.slow_log.addHandler(caplog.handler)
+    try:
+        with caplog.at_level(logging.INFO, logger='proxyweb.slow'):
+            client.get(page % server)
+    finally:
+        tracing.slow_log.removeHandler(caplog.handler)
+    entry = json.loads(caplog.records[-1].getMessage())
+    assert entry['endpoint'] == 'render_table_data'
+    assert entry['status'] == 200
+    assert 'query' in entry['breakdown']
+    assert any(span['name'] == 'query' for span in entry['spans'])
+
+
+def test_spans_are_capped():
+    trace = tracing.Trace(max_spans=2)
+    for n in range(5):
+        trace.add('query', trace.started, 0.001)
+    assert len(trace.spans) == 2 and trace.dropped == 3
+    assert trace.breakdown() == {'query': [2, 0.002]}
+
+
+def test_no_trace_outside_of_requests():
+    tracing.record('query', 0)
+
+
+def test_profile(client, server, proxyweb):
+    response = client.get((page % server) + '&profile=1')
+    assert response.mimetype == 'text/plain'
+    assert 'profile.folded' in response.headers['Content-Disposition']
+    for line in response.data.decode().splitlines():
+        stack, count = line.rsplit(' ', 1)
+        assert int(count) > 0 and stack
+    # anonymous users get the login page, not a profile
+    assert proxyweb.app.test_client().get('/login?profile=1').mimetype == 'text/html'
@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+
+""" ProxyWeb - A Proxysql Web user interface
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Miklos Mukka Szel"
+__contact__ = "email@miklos-szel.com"
+__license__ = "GPLv3"
+
+# Where the time of a request goes, as per the tracing: section of the config.
+#
+# Every request gets a trace; mdb.py records spans into it (config parsing, pool checkout,
+# connecting, queries, fetching, processing the rows) and app.py the template rendering. The
+# totals per span name are sent to the logged in users in the Server-Timing header (browser dev
+# tools show them), and a request slower than slow_ms is written to the slow request log as one
+# JSON line with all its spans. Without a trace (outside of requests, tracing disabled) record()
+# is a no-op.
+#
+# ?profile=1 on any page runs a sampling profiler on the request's thread (and the fan-out threads
+# working for it) and returns the samples in the collapsed stack format of flamegraph.pl /
+# speedscope instead of the page.
+
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from flask import Response, g, request, session
+
+import mdb
+
+defaults = {
+    'enabled': True,
+    'slow_ms': 1000,
+    'slow_log': '',            # file, empty: stderr
+    'server_timing': True,
+    'profiler': True,
+    'profile_interval': 0.005,
+    'max_spans': 1000,
+}
+
+slow_log = logging.getLogger('proxyweb.slow')
+slow_log.propagate = False
+
+_current = contextvars.ContextVar('trace', default=None)
+
+
+def get_settings():
+    return mdb.get_section('tracing', defaults)
+
+
+class Trace:
+    """The spans of one request: (name, start, duration, detail), times in seconds from the start of the request"""
+
+    def __init__(self, max_spans=1000):
+        self.started = time.perf_counter()
+        self.max_spans = max_spans
+        self.spans = []
+        self.dropped = 0
+        self.threads = set()      # the ids of the threads working for the request besides its own
+
+    def add(self, name, started, duration, detail=None):
+        # list.append is atomic, the fan-out threads of a request add to the same trace
+        if len(self.spans) < self.max_spans:
+            self.spans.append((name, started - self.started, duration, detail))
+        else:
+            self.dropped += 1
+
+    def breakdown(self):
+        """{name: [count, total seconds]}"""
+        totals = {}
+        for name, start, duration, detail in self.spans:
+            total = totals.setdefault(name, [0, 0.0])
+            total[0] += 1
+            total[1] += duration
+        return totals
+
+
+def record(name, started, detail=None):
+    """Adds a span from started (a time.perf_counter() value) until now to the trace of the current request"""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, started, time.perf_counter() - started, detail)
+
+
+@contextmanager
+def thread():
+    """Marks the current thread as working for the request of the current trace while in the block (profiling)"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    ident = threading.get_ident()
+    trace.threads.add(ident)
+    try:
+        yield
+    finally:
+        trace.threads.discard(ident)
+
+
+def server_timing(trace, duration):
+    return ", ".join(["%s;dur=%.1f" % (name.replace('.', '_'), total * 1000)
+                      for name, (count, total) in trace.breakdown().items()] + ["total;dur=%.1f" % (duration * 1000)])
+
+
+def slow_request(trace, duration, status):
+    """The slow request log entry"""
+    return {
+        'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': request.endpoint,
+        'status': status,
+        'duration_ms': round(duration * 1000, 1),
+        'breakdown': {name: {'count': count, 'ms': round(total * 1000, 1)}
+                      for name, (count, total) in trace.breakdown().items()},
+        'spans': [{'name': name, 'start_ms': round(start * 1000, 1), 'ms': round(duration * 1000, 1),
+                   'detail': detail} for name, start, duration, detail in trace.spans],
+        'dropped_spans': trace.dropped,
+    }
+
+
+class Profiler:
+    """Samples the stacks of the request's threads every interval seconds from a background thread"""
+
+    def __init__(self, thread_id, trace=None, interval=0.005):
+        self.thread_id = thread_id
+        self.trace = trace
+        self.interval = float(interval)
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    @staticmethod
+    def _stack(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("%s (%s)" % (code.co_name, os.path.basename(code.co_filename)))
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            frame = frames.get(self.thread_id)
+            if frame is not None:
+                self.samples[self._stack(frame)] += 1
+            workers = list(self.trace.threads) if self.trace else []
+            if workers:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident in workers:
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        # the pool threads (adhoc_0, adhoc_1, ...) are merged under their common name
+                        name = names.get(ident, 'thread').rsplit('_', 1)[0]
+                        self.samples["%s;%s" % (name, self._stack(frame))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Returns with the samples in the collapsed stack format: "frame;frame;frame count" per line"""
+        self._stop.set()
+        self._thread.join()
+        return "".join("%s %d\n" % (stack, count) for stack, count in self.samples.most_common())
+
+
+def _start_request():
+    settings = get_settings()
+    if settings['enabled']:
+        g.trace = Trace(int(settings['max_spans']))
+        g.trace_token = _current.set(g.trace)
+    if request.args.get('profile') == '1' and settings['profiler'] and session.get('logged_in'):
+        g.profiler = Profiler(threading.get_ident(), g.get('trace'), settings['profile_interval']).start()
+
+
+def _finish_request(response):
+    if 'profiler' in g:
+        folded = g.pop('profiler').stop()
+        response = Response(folded, mimetype='text/plain',
+                            headers={'Content-Disposition': 'inline; filename="profile.folded"'})
+    if 'trace' in g:
+        trace = g.trace
+        duration = time.perf_counter() - trace.started
+        settings = get_settings()
+        # the spans show the queries and the connect times, the login page and co. don't hand them out
+        if settings['server_timing'] and session.get('logged_in'):
+            response.headers['Server-Timing'] = server_timing(trace, duration)
+        if duration * 1000 >= float(settings['slow_ms']):
+            slow_log.warning(json.dumps(slow_request(trace, duration, response.status_code), default=str))
+    return response
+
+
+def _teardown_request(exc):
+    if 'trace_token' in g:
+        _current.reset(g.pop('trace_token'))
+
+
+def install(app):
+    """Registers the request hooks and points the slow request log to slow_log"""
+    settings = get_settings()
+    handler = logging.FileHandler(settings['slow_log']) if settings['slow_log'] else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    slow_log.handlers = [handler]
+    slow_log.setLevel(logging.INFO)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_teardown_request)